@@ -1,7 +1,7 @@
 # Version control system repository manager.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: April 26, 2018
+# Last Change: October 16, 2026
 # URL: https://github.com/xolox/python-vcs-repo-mgr
 
 """
@@ -78,27 +78,43 @@ Python API (`vcs-repo-mgr`)         Bazaar             Git                    Me
 """
 
 # Standard library modules.
+import collections
+import contextlib
+import fnmatch
+import io
+import json
 import logging
 import operator
 import os
 import re
+import shutil
+import stat
 import sys
-import tempfile
+import threading
 import time
+import weakref
+
+try:
+    # Python 3.3+
+    from collections.abc import MutableMapping
+except ImportError:
+    # Python 2.x
+    from collections import MutableMapping
 
 # External dependencies.
 from executor import ExternalCommandFailed
 from executor.contexts import LocalContext
-from humanfriendly import Timer, coerce_boolean, coerce_pattern, format_path, parse_path
+from humanfriendly import Timer, coerce_boolean, coerce_pattern, format_path, format_size, format_timespan, parse_path
 from humanfriendly.text import compact, concatenate, format, pluralize
-from humanfriendly.prompts import prompt_for_confirmation
 from humanfriendly.terminal import connected_to_terminal
-from natsort import natsort, natsort_key
-from property_manager import PropertyManager, required_property, mutable_property, set_property
+from property_manager import PropertyManager, lazy_property, required_property, mutable_property, set_property
 from six import add_metaclass, string_types
-from six.moves import configparser
 from six.moves import urllib_parse as urlparse
 
+# Modules that are relatively slow to import and only needed by some of the
+# functionality in this module (like natsort and configparser) are imported
+# on demand, to keep the startup time of the `vcs-tool' program low.
+
 # Modules included in our package.
 from vcs_repo_mgr.exceptions import (
     AmbiguousRepositoryNameError,
@@ -122,23 +138,57 @@ SYSTEM_CONFIG_FILE = '/etc/vcs-repo-mgr.ini'
 UPDATE_VARIABLE = 'VCS_REPO_MGR_UPDATE_LIMIT'
 """The name of the environment variable that's used to rate limit repository updates (a string)."""
 
+CONFIG_INDEX_VARIABLE = 'VCS_REPO_MGR_CONFIG_INDEX'
+"""The name of the environment variable that enables the on-disk configuration index (a string)."""
+
+DEFAULT_CACHE_SIZE = 1000
+"""
+The default number of repositories kept alive by :data:`loaded_repositories`
+and the maximum number of results cached by :func:`find_repository_type()`
+(an integer).
+"""
+
+DETECTION_CACHE_TIMEOUT = 60
+"""The number of seconds that :func:`find_repository_type()` caches results for remote directories (a number)."""
+
+DEFAULT_CONCURRENCY = 4
+"""
+The default number of threads used by :func:`update_repositories()` and
+:func:`sum_revision_numbers()` (an integer).
+"""
+
 KNOWN_RELEASE_SCHEMES = ('branches', 'tags')
 """The names of valid release schemes (a tuple of strings)."""
 
 BUNDLED_BACKENDS = ('bzr', 'git', 'hg')
 """The names of the version control modules provided by `vcs-repo-mgr` (a tuple of strings)."""
 
+BUNDLED_ALIASES = {'bazaar': 'bzr', 'bzr': 'bzr', 'git': 'git', 'hg': 'hg', 'mercurial': 'hg'}
+"""A dictionary that maps the aliases of the bundled backends to the names in :data:`BUNDLED_BACKENDS`."""
+
 REPOSITORY_TYPES = set()
 """Available :class:`Repository` subclasses (a :class:`set` of :class:`type` objects)."""
 
+ARCHIVE_FORMATS = ('tar', 'tar.gz', 'zip')
+"""The archive formats supported by :func:`Repository.export_stream()` (a tuple of strings)."""
+
+EXPORT_MARKER_FILE = '.vcs-repo-mgr-export'
+"""The name of the file in which :func:`Repository.export()` records the exported revision (a string)."""
+
+EXPORT_BATCH_SIZE = 500
+"""The maximum number of changed files written by a single archive command during incremental exports (an integer)."""
+
 HEX_PATTERN = re.compile('^[A-Fa-f0-9]+$')
 """Compiled regular expression pattern to match hexadecimal strings."""
 
 # Initialize a logger.
 logger = logging.getLogger(__name__)
 
-# Dictionary of previously constructed Repository objects.
-loaded_repositories = {}
+# Dictionary with the fingerprint and contents of the configuration index.
+configuration_index = {}
+
+# Ordered dictionary of previously detected repository types.
+detected_repository_types = collections.OrderedDict()
 
 
 def coerce_author(value):
@@ -250,9 +300,9 @@ def coerce_repository(value, context=None):
         except UnknownRepositoryTypeError:
             pass
     # Try to infer the type of an existing local repository.
-    for cls in load_backends():
-        if cls.contains_repository(context, value):
-            return repository_factory(cls, context=context, local=value)
+    cls = find_repository_type(value, context)
+    if cls is not None:
+        return repository_factory(cls, context=context, local=value)
     # Check for locations that end with `.git' (a common idiom for remote
     # git repositories) even if the location isn't prefixed with `git+'.
     if value.endswith('.git'):
@@ -268,12 +318,28 @@ def coerce_repository(value, context=None):
     raise ValueError(msg % value)
 
 
+def decode_record(record):
+    """
+    Decode a record in the output of a version control command.
+
+    :param record: A byte string.
+    :returns: A string (refer to :func:`Repository.iter_output()` for details).
+    """
+    try:
+        return record.decode('UTF-8')
+    except UnicodeDecodeError:
+        if sys.version_info[0] == 2:
+            return record
+        return record.decode('UTF-8', 'surrogateescape')
+
+
 def find_cache_directory(remote):
     """
     Find the directory where temporary local checkouts are to be stored.
 
     :returns: The absolute pathname of a directory (a string).
     """
+    import tempfile
     return os.path.join('/var/cache/vcs-repo-mgr' if os.access('/var/cache', os.W_OK) else tempfile.gettempdir(),
                         urlparse.quote(remote, safe=''))
 
@@ -312,25 +378,21 @@ def find_configured_repository(name):
        release-filter = .*
 
     Three VCS types are currently supported: ``hg`` (``mercurial`` is also
-    accepted), ``git`` and ``bzr`` (``bazaar`` is also accepted).
+    accepted), ``git`` and ``bzr`` (``bazaar`` is also accepted). The option
+    ``cache-revision-numbers`` can be used to enable
+    :attr:`Repository.cache_revision_numbers`.
     """
-    parser = configparser.RawConfigParser()
-    for config_file in [SYSTEM_CONFIG_FILE, USER_CONFIG_FILE]:
-        config_file = parse_path(config_file)
-        if os.path.isfile(config_file):
-            logger.debug("Loading configuration file (%s) ..", format_path(config_file))
-            parser.read(config_file)
-    matching_repos = [r for r in parser.sections() if normalize_name(name) == normalize_name(r)]
+    matching_repos = load_configuration_index().get(normalize_name(name), [])
     if not matching_repos:
         msg = "No repositories found matching the name '%s'!"
         raise NoSuchRepositoryError(msg % name)
     elif len(matching_repos) != 1:
         msg = "Multiple repositories found matching the name '%s'! (matches: %s)"
-        raise AmbiguousRepositoryNameError(msg % (name, concatenate(map(repr, matching_repos))))
+        raise AmbiguousRepositoryNameError(msg % (name, concatenate(repr(r) for r, o in matching_repos)))
     else:
         kw = {}
         # Get the repository specific options.
-        options = dict(parser.items(matching_repos[0]))
+        options = dict(matching_repos[0][1])
         vcs_type = options.get('type', '').lower()
         # Process the `local' directory pathname.
         local_path = options.get('local')
@@ -343,6 +405,10 @@ def find_configured_repository(name):
             # Default to bare=None but enable configuration
             # file(s) to enforce bare=True or bare=False.
             kw['bare'] = coerce_boolean(bare)
+        # Process the `cache-revision-numbers' option.
+        cache_revision_numbers = options.get('cache-revision-numbers', None)
+        if cache_revision_numbers is not None:
+            kw['cache_revision_numbers'] = coerce_boolean(cache_revision_numbers)
         # Process the `remote', `release_scheme' and `release_filter' options.
         for name in 'remote', 'release-scheme', 'release-filter':
             value = options.get(name)
@@ -351,25 +417,266 @@ def find_configured_repository(name):
         return repository_factory(vcs_type, **kw)
 
 
+def find_configured_repositories(patterns=None):
+    """
+    Find the names of the repositories defined by the user in configuration files.
+
+    :param patterns: A list of shell wildcard patterns (strings) used to
+                     select a subset of the configured repositories (optional,
+                     matching is case insensitive).
+    :returns: A sorted list of repository names (strings).
+
+    Refer to :func:`find_configured_repository()` for details about the
+    configuration files.
+    """
+    names = [name for entries in load_configuration_index().values() for name, options in entries]
+    if patterns:
+        names = [n for n in names if any(fnmatch.fnmatch(n.lower(), p.lower()) for p in patterns)]
+    return sorted(names)
+
+
+def find_repository_type(directory, context=None):
+    """
+    Find the type of the local repository contained in a directory.
+
+    :param directory: The pathname of a directory (a string).
+    :param context: An execution context created by :mod:`executor.contexts`
+                    (defaults to :class:`executor.contexts.LocalContext`).
+    :returns: A :class:`Repository` subclass or :data:`None` when the
+              directory doesn't exist or doesn't contain a repository.
+
+    The directory is listed once (using :func:`os.listdir()` for local
+    directories and :func:`~executor.contexts.AbstractContext.list_entries()`
+    otherwise) and the listing is classified using
+    :func:`Repository.contains_repository_entries()`. Only backends that
+    can't classify the listing fall back to the more expensive
+    :func:`Repository.contains_repository()`.
+
+    The results are cached per context and directory (up to
+    :data:`DEFAULT_CACHE_SIZE` results). For local directories the cache is
+    validated using the modification time of the directory, for other
+    contexts only positive results are cached (because validating the cache
+    would cost another round trip) and they expire after
+    :data:`DETECTION_CACHE_TIMEOUT` seconds.
+    """
+    context = context or LocalContext()
+    is_local = isinstance(context, LocalContext)
+    cache_key = (type(context), str(context), directory)
+    fingerprint = None
+    if is_local:
+        try:
+            metadata = os.stat(directory)
+        except OSError:
+            return None
+        if not stat.S_ISDIR(metadata.st_mode):
+            return None
+        fingerprint = metadata.st_mtime
+    cached = detected_repository_types.get(cache_key)
+    if cached:
+        if (cached[0] == fingerprint) if is_local else (time.time() < cached[0] + DETECTION_CACHE_TIMEOUT):
+            return cached[1]
+    try:
+        entries = set(os.listdir(directory) if is_local else context.list_entries(directory))
+    except (ExternalCommandFailed, OSError):
+        return None
+    result = None
+    undecided = []
+    for cls in load_backends():
+        verdict = cls.contains_repository_entries(entries)
+        if verdict:
+            result = cls
+            break
+        elif verdict is None:
+            undecided.append(cls)
+    else:
+        for cls in undecided:
+            if cls.contains_repository(context, directory):
+                result = cls
+                break
+    # Negative results that depend on the contents of subdirectories can't
+    # be validated using the modification time of the directory.
+    if result is not None or (is_local and not undecided):
+        detected_repository_types.pop(cache_key, None)
+        detected_repository_types[cache_key] = (fingerprint if is_local else time.time(), result)
+        while len(detected_repository_types) > DEFAULT_CACHE_SIZE:
+            try:
+                detected_repository_types.popitem(last=False)
+            except KeyError:
+                # Another thread emptied the cache.
+                break
+    return result
+
+
+def get_configuration_fingerprint():
+    """
+    Get a fingerprint of the configuration files that define repositories.
+
+    :returns: A tuple with a (pathname, size, modification time) tuple for
+              each of the configuration files that exist.
+
+    The fingerprint changes when a configuration file is created, changed
+    or removed. Refer to :func:`find_configured_repository()` for details
+    about the configuration files.
+    """
+    fingerprint = []
+    for config_file in [SYSTEM_CONFIG_FILE, USER_CONFIG_FILE]:
+        config_file = parse_path(config_file)
+        try:
+            metadata = os.stat(config_file)
+            fingerprint.append((config_file, metadata.st_size, metadata.st_mtime))
+        except OSError:
+            pass
+    return tuple(fingerprint)
+
+
 def load_backends():
     """
     Load the backend modules bundled with `vcs-repo-mgr`.
 
     :returns: The value of :data:`REPOSITORY_TYPES`.
 
-    When :data:`REPOSITORY_TYPES` is empty this function will import each of
-    the backend modules listed in :data:`BUNDLED_BACKENDS` before it accesses
+    This function imports each of the backend modules listed in
+    :data:`BUNDLED_BACKENDS` that hasn't been imported yet before it accesses
     :data:`REPOSITORY_TYPES`, to make sure that all of the :class:`Repository`
-    subclasses bundled with `vcs-repo-mgr` are registered.
+    subclasses bundled with `vcs-repo-mgr` are registered. (Individual backend
+    modules may already have been imported by :func:`repository_factory()`.)
     """
-    # Load the bundled backend modules?
-    if not REPOSITORY_TYPES:
-        for name in BUNDLED_BACKENDS:
-            __import__('vcs_repo_mgr.backends.%s' % name)
+    # Load the bundled backend modules that haven't been loaded yet.
+    for name in BUNDLED_BACKENDS:
+        module_name = 'vcs_repo_mgr.backends.%s' % name
+        if module_name not in sys.modules:
+            __import__(module_name)
     # Return the subclasses registered by our metaclass.
     return REPOSITORY_TYPES
 
 
+def load_configuration():
+    """
+    Load the configuration files that define repositories.
+
+    :returns: A :class:`~six.moves.configparser.RawConfigParser` object.
+
+    Refer to :func:`find_configured_repository()` for details about the
+    configuration files.
+    """
+    from six.moves import configparser
+    parser = configparser.RawConfigParser()
+    for config_file in [SYSTEM_CONFIG_FILE, USER_CONFIG_FILE]:
+        config_file = parse_path(config_file)
+        if os.path.isfile(config_file):
+            logger.debug("Loading configuration file (%s) ..", format_path(config_file))
+            parser.read(config_file)
+    return parser
+
+
+def load_configuration_index():
+    """
+    Get an index of the repositories defined in the configuration files.
+
+    :returns: A dictionary that maps normalized repository names (see
+              :func:`normalize_name()`) to lists of (name, options) pairs,
+              where options is a dictionary with the options of a repository.
+
+    Parsing configuration files that define thousands of repositories is
+    relatively slow, so the index is kept in memory until the fingerprint of
+    the configuration files changes (see :func:`get_configuration_fingerprint()`).
+    When the environment variable :data:`CONFIG_INDEX_VARIABLE` is set to a
+    pathname the index is also saved to that file (as JSON) so that new
+    processes don't need to parse the configuration files either.
+    """
+    fingerprint = [list(f) for f in get_configuration_fingerprint()]
+    cached = configuration_index.get('current')
+    if cached and cached[0] == fingerprint:
+        return cached[1]
+    index_file = parse_path(os.environ[CONFIG_INDEX_VARIABLE]) if os.environ.get(CONFIG_INDEX_VARIABLE) else None
+    index = None
+    if index_file and os.path.isfile(index_file):
+        try:
+            with open(index_file) as handle:
+                contents = json.load(handle)
+            if contents['fingerprint'] == fingerprint:
+                logger.debug("Loaded configuration index (%s).", format_path(index_file))
+                index = contents['index']
+        except Exception as e:
+            logger.warning("Ignoring invalid configuration index (%s)! (%s)", format_path(index_file), e)
+    if index is None:
+        parser = load_configuration()
+        index = {}
+        for name in parser.sections():
+            index.setdefault(normalize_name(name), []).append((name, dict(parser.items(name))))
+        if index_file:
+            try:
+                temporary_file = '%s.%i' % (index_file, os.getpid())
+                with open(temporary_file, 'w') as handle:
+                    json.dump(dict(fingerprint=fingerprint, index=index), handle)
+                os.rename(temporary_file, index_file)
+                logger.debug("Saved configuration index (%s).", format_path(index_file))
+            except Exception as e:
+                logger.warning("Failed to save configuration index (%s)! (%s)", format_path(index_file), e)
+    configuration_index['current'] = (fingerprint, index)
+    return index
+
+
+def load_repository(name):
+    """
+    Load a repository for :func:`update_repositories()`.
+
+    :param name: A value accepted by :func:`coerce_repository()`.
+    :returns: A :class:`Repository` object or the exception raised by
+              :func:`coerce_repository()`.
+    """
+    try:
+        return coerce_repository(name)
+    except Exception as e:
+        return e
+
+
+def map_concurrently(function, values, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Call a function for each of the given values using a pool of threads.
+
+    :param function: The function to call (it receives one value).
+    :param values: An iterable of values.
+    :param concurrency: The maximum number of threads (an integer, defaults
+                        to :data:`DEFAULT_CONCURRENCY`).
+    :returns: A list with the return values of the function (in the same
+              order as the given values).
+    :raises: When the function raises an exception for any of the values the
+             exception of the first of those values is re-raised (after all
+             values have been processed).
+    """
+    values = list(values)
+    pending = list(range(len(values)))
+    results = [None] * len(values)
+    errors = [None] * len(values)
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                index = pending.pop(0)
+            try:
+                results[index] = function(values[index])
+            except Exception as e:
+                errors[index] = e
+
+    if len(values) == 1 or concurrency == 1:
+        # Don't bother starting threads when there's nothing to parallelize.
+        worker()
+    else:
+        threads = [threading.Thread(target=worker) for i in range(max(1, min(concurrency, len(values))))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    for error in errors:
+        if error is not None:
+            raise error
+    return results
+
+
 def normalize_name(name):
     """
     Normalize a repository name.
@@ -394,10 +701,16 @@ def repository_factory(vcs_type, **kw):
     :raises: :exc:`~vcs_repo_mgr.exceptions.UnknownRepositoryTypeError` when
              the given type is unknown.
     """
-    # Resolve VCS aliases to Repository subclasses.
+    # Resolve VCS aliases to Repository subclasses. The aliases of the bundled
+    # backends are resolved by importing only the relevant backend module.
     if isinstance(vcs_type, string_types):
         vcs_type = vcs_type.lower()
-        for cls in load_backends():
+        if vcs_type in BUNDLED_ALIASES:
+            __import__('vcs_repo_mgr.backends.%s' % BUNDLED_ALIASES[vcs_type])
+            candidates = REPOSITORY_TYPES
+        else:
+            candidates = load_backends()
+        for cls in candidates:
             if vcs_type in cls.ALIASES:
                 vcs_type = cls
                 break
@@ -407,35 +720,142 @@ def repository_factory(vcs_type, **kw):
     # Generate a cache key that we will use to avoid constructing duplicates.
     cache_key = tuple('%s=%s' % (k, v) for k, v in sorted(kw.items()))
     logger.debug("Generated repository cache key: %r", cache_key)
-    if cache_key in loaded_repositories:
-        logger.debug("Repository previously constructed, returning cached instance ..")
-    else:
-        logger.debug("Repository not yet constructed, creating new instance ..")
-        loaded_repositories[cache_key] = vcs_type(**kw)
-    return loaded_repositories[cache_key]
+    return loaded_repositories.get_or_create(cache_key, lambda: vcs_type(**kw))
 
 
-def sum_revision_numbers(arguments):
+def sum_revision_numbers(arguments, concurrency=DEFAULT_CONCURRENCY):
     """
     Sum revision numbers of multiple repository/revision pairs.
 
     :param arguments: A list of strings with repository names and revision
                       strings.
+    :param concurrency: The maximum number of repositories that are queried
+                        at the same time (an integer, defaults to
+                        :data:`DEFAULT_CONCURRENCY`).
     :returns: A single integer containing the summed revision numbers.
 
     This is useful when you're building a package based on revisions from
     multiple VCS repositories. By taking changes in all repositories into
     account when generating version numbers you can make sure that your version
     number is bumped with every single change.
+
+    The repositories are loaded concurrently, after which the revisions are
+    grouped by repository and the revision numbers of each repository are
+    found (concurrently) using a single call to
+    :func:`~Repository.resolve_revisions()`. Repository arguments that refer
+    to the same local repository (for example a configured name and its
+    location) are grouped together, so that a local repository is never used
+    by multiple threads. Identical repository/revision pairs are resolved
+    only once (but they're still counted each time).
     """
     arguments = list(arguments)
     if len(arguments) % 2 != 0:
         raise ValueError("Please provide an even number of arguments! (one or more repository/revision pairs)")
-    summed_revision_number = 0
-    while arguments:
-        repository = coerce_repository(arguments.pop(0))
-        summed_revision_number += repository.find_revision_number(arguments.pop(0))
-    return summed_revision_number
+    pairs = list(zip(arguments[0::2], arguments[1::2]))
+    # Load the repositories (each distinct repository argument only once).
+    names = []
+    for name, revision in pairs:
+        if name not in names:
+            names.append(name)
+    repositories = dict(zip(names, map_concurrently(coerce_repository, names, concurrency)))
+    # Group the distinct revisions by local repository.
+    grouped_revisions = []
+    for name, revision in pairs:
+        repository = repositories[name]
+        for other_repository, revisions in grouped_revisions:
+            if other_repository.local == repository.local:
+                # Use the same repository object for the whole group.
+                repositories[name] = other_repository
+                if revision not in revisions:
+                    revisions.append(revision)
+                break
+        else:
+            grouped_revisions.append((repository, [revision]))
+    # Find the revision numbers of each repository.
+    revision_numbers = {}
+    resolved_revisions = map_concurrently(
+        lambda group: group[0].resolve_revisions(group[1]),
+        grouped_revisions, concurrency,
+    )
+    for (repository, revisions), resolved in zip(grouped_revisions, resolved_revisions):
+        for revision, record in zip(revisions, resolved):
+            revision_numbers[(id(repository), revision)] = record.revision_number
+    return sum(revision_numbers[(id(repositories[name]), revision)] for name, revision in pairs)
+
+
+def update_repositories(names, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Update multiple repositories concurrently.
+
+    :param names: An iterable of values accepted by :func:`coerce_repository()`
+                  (for example the names returned by
+                  :func:`find_configured_repositories()`).
+    :param concurrency: The maximum number of repositories to update at the
+                        same time (an integer, defaults to
+                        :data:`DEFAULT_CONCURRENCY`).
+    :returns: A list of :class:`UpdateResult` objects (in the same order as
+              the given names).
+
+    The repositories are updated using :func:`Repository.pull()` by a pool
+    of threads (see :func:`map_concurrently()`). Failures are reported in the
+    results instead of raising an exception. Unless :class:`limit_vcs_updates`
+    is already active it is used to avoid duplicate updates.
+
+    Names that refer to the same local repository (for example a configured
+    name and its remote location) are updated only once, because concurrent
+    updates could clone into the same directory at the same time.
+    """
+    unique_names = []
+    for name in names:
+        if name not in unique_names:
+            unique_names.append(name)
+    logger.info("Updating %s (concurrency: %i) ..",
+                pluralize(len(unique_names), "repository", "repositories"),
+                concurrency)
+    # Resolve the names to repository objects before dispatching updates.
+    results = {}
+    grouped_names = collections.OrderedDict()
+    for name, repository in zip(unique_names, map_concurrently(load_repository, unique_names, concurrency)):
+        if isinstance(repository, Exception):
+            logger.warning("Failed to load %s! (%s)", name, repository)
+            results[name] = UpdateResult(name=name, elapsed_time=0, error=repository)
+        elif repository.local in grouped_names:
+            grouped_names[repository.local][1].append(name)
+        else:
+            grouped_names[repository.local] = (repository, [name])
+    groups = list(grouped_names.values())
+
+    def update_group(group):
+        return update_repository(group[1][0], repository=group[0])
+
+    if UPDATE_VARIABLE in os.environ:
+        outcomes = map_concurrently(update_group, groups, concurrency)
+    else:
+        with limit_vcs_updates():
+            outcomes = map_concurrently(update_group, groups, concurrency)
+    for (repository, group_names), outcome in zip(groups, outcomes):
+        for name in group_names:
+            results[name] = UpdateResult(name=name, elapsed_time=outcome.elapsed_time, error=outcome.error)
+    return [results[name] for name in unique_names]
+
+
+def update_repository(name, repository=None):
+    """
+    Update a single repository and report the outcome.
+
+    :param name: A value accepted by :func:`coerce_repository()`.
+    :param repository: The :class:`Repository` object (optional, defaults
+                       to the result of :func:`coerce_repository()`).
+    :returns: An :class:`UpdateResult` object.
+    """
+    timer = Timer()
+    try:
+        (repository or coerce_repository(name)).pull()
+    except Exception as e:
+        logger.warning("Failed to update %s after %s! (%s)", name, timer, e)
+        return UpdateResult(name=name, elapsed_time=timer.elapsed_time, error=e)
+    logger.info("Updated %s in %s.", name, timer)
+    return UpdateResult(name=name, elapsed_time=timer.elapsed_time)
 
 
 class limit_vcs_updates(object):
@@ -569,6 +989,24 @@ class Repository(PropertyManager):
         """
         return context.is_directory(cls.get_vcs_directory(context, directory))
 
+    @classmethod
+    def contains_repository_entries(cls, entries):
+        """
+        Check whether the entries in a directory identify a local repository.
+
+        :param entries: A :class:`set` with the names of the entries in a
+                        directory (strings).
+        :returns: :data:`True` if the entries identify a local repository,
+                  :data:`False` if they don't and :data:`None` when the
+                  entries aren't conclusive.
+
+        This is used by :func:`find_repository_type()` to detect the type of
+        a repository based on a single directory listing. The default
+        implementation returns :data:`None`, which means
+        :func:`contains_repository()` is used instead.
+        """
+        return None
+
     @staticmethod
     def get_vcs_directory(context, directory):
         """
@@ -660,10 +1098,28 @@ class Repository(PropertyManager):
          'pu':     Revision(repository=GitRepo(...), branch='pu',     revision_id='d61c1fa'),
          'todo':   Revision(repository=GitRepo(...), branch='todo',   revision_id='dea8a2d')}
         """
-        # Make sure the local repository exists.
-        self.create()
-        # Create a mapping of branch names to revisions.
-        return dict((r.branch, r) for r in self.find_branches())
+        return self.get_ref_snapshot('branches', lambda: dict((r.branch, r) for r in self.find_branches()))
+
+    @mutable_property
+    def cache_revision_numbers(self):
+        """
+        :data:`True` to remember revision numbers on disk, :data:`False` (the default) otherwise.
+
+        Computing the revision number of a revision can be expensive (for
+        example ``git rev-list --count`` traverses the complete history) while
+        the revision number of a given global revision id never changes. When
+        this option is enabled :func:`find_revision_number()` stores the
+        revision numbers it computes in :attr:`revision_numbers_file` and
+        looks for them there first (see :func:`lookup_revision_number()`).
+        The git and Bazaar backends support this, Mercurial revision numbers
+        are cheap to find (and local to a clone) so they aren't stored.
+
+        This option can also be set in the configuration file (see
+        :func:`find_configured_repository()`). It shouldn't be enabled for
+        shallow clones, because their revision numbers change when more
+        history is fetched.
+        """
+        return False
 
     @mutable_property
     def compiled_filter(self):
@@ -717,10 +1173,39 @@ class Repository(PropertyManager):
         """:data:`True` if the local repository exists, :data:`False` otherwise."""
         return self.contains_repository(self.context, self.local)
 
+    @mutable_property(cached=True, repr=False)
+    def export_cache(self):
+        """
+        The :class:`~vcs_repo_mgr.exports.ExportCache` used by :func:`export()` (or :data:`None`).
+
+        The export cache is opt-in, by default it's enabled when the
+        environment variable ``$VCS_REPO_MGR_EXPORT_CACHE`` is set (refer to
+        :func:`~vcs_repo_mgr.exports.ExportCache.from_environment()`). The
+        cache object is created once per repository, so its statistics
+        accumulate over all exports.
+        """
+        from vcs_repo_mgr.exports import ExportCache
+        return ExportCache.from_environment()
+
     @required_property
     def friendly_name(self):
         """A user friendly name for the version control system (a string)."""
 
+    @lazy_property(repr=False)
+    def helpers(self):
+        """
+        Long running helper processes started by :func:`get_helper()` (a dictionary).
+
+        The keys of the dictionary are helper names and the values are
+        :class:`~vcs_repo_mgr.helpers.HelperProcess` objects. The helper
+        processes are stopped when the :class:`Repository` object is garbage
+        collected (see :func:`~vcs_repo_mgr.helpers.stop_when_collected()`).
+        """
+        from vcs_repo_mgr.helpers import stop_when_collected
+        helpers = {}
+        stop_when_collected(self, helpers)
+        return helpers
+
     @property
     def is_bare(self):
         """
@@ -794,6 +1279,7 @@ class Repository(PropertyManager):
         ascending order (i.e. the first value is the "oldest" branch and the
         last value is the "newest" branch).
         """
+        from natsort import natsort
         return natsort(self.branches.values(), key=operator.attrgetter('branch'))
 
     @property
@@ -806,6 +1292,7 @@ class Repository(PropertyManager):
         ascending order (i.e. the first value is the "oldest" release and the
         last value is the "newest" release).
         """
+        from natsort import natsort
         return natsort(self.releases.values(), key=operator.attrgetter('identifier'))
 
     @property
@@ -818,8 +1305,81 @@ class Repository(PropertyManager):
         order (i.e. the first value is the "oldest" tag and the last value is
         the "newest" tag).
         """
+        from natsort import natsort
         return natsort(self.tags.values(), key=operator.attrgetter('tag'))
 
+    @mutable_property
+    def persistent_helpers(self):
+        """
+        :data:`True` to use long running helper processes, :data:`False` (the default) otherwise.
+
+        Backends that support it can answer frequent queries (like
+        :func:`find_revision_id()`) using a single long running helper process
+        instead of starting one or more new processes for every query. This is
+        opt-in because it means the :class:`Repository` object owns child
+        processes, which should be shut down using :func:`stop_helpers()` when
+        they're no longer needed (this also happens automatically when the
+        :class:`Repository` object is garbage collected or the interpreter
+        exits).
+
+        When a helper process can't be started `vcs-repo-mgr` silently falls
+        back to running regular subprocesses, so enabling this option never
+        changes the results of queries.
+        """
+        return False
+
+    @property
+    def ref_files(self):
+        """
+        The pathnames of the files that determine the branches and tags in the repository (a list of strings).
+
+        Directories are included recursively. This property is used by
+        :attr:`ref_fingerprint` and should be implemented by subclasses, the
+        default implementation returns an empty list (which disables the
+        caching of :attr:`branches`, :attr:`tags` and :attr:`releases`).
+        """
+        return []
+
+    @property
+    def ref_fingerprint(self):
+        """
+        A value that changes when the branches or tags in the repository change (or :data:`None`).
+
+        The fingerprint is based on the inode numbers, sizes and last
+        modification times of the files in :attr:`ref_files`. It's only
+        available for repositories that are accessed using
+        :class:`~executor.contexts.LocalContext`, because other contexts
+        would require running external commands (which is what we're
+        trying to avoid).
+        """
+        if isinstance(self.context, LocalContext):
+            pathnames = list(reversed(self.ref_files))
+            if pathnames:
+                fingerprint = []
+                while pathnames:
+                    pathname = pathnames.pop()
+                    try:
+                        metadata = os.stat(pathname)
+                    except EnvironmentError:
+                        fingerprint.append((pathname, None))
+                        continue
+                    fingerprint.append((pathname, metadata.st_ino, metadata.st_size, metadata.st_mtime))
+                    if stat.S_ISDIR(metadata.st_mode):
+                        pathnames.extend(os.path.join(pathname, n) for n in sorted(os.listdir(pathname), reverse=True))
+                return tuple(fingerprint)
+
+    @lazy_property(repr=False)
+    def ref_snapshot(self):
+        """
+        Cached information about the branches and tags in the repository (a dictionary).
+
+        The cached values are used as long as :attr:`ref_fingerprint` doesn't
+        change (see :func:`get_ref_snapshot()`). The methods that create or
+        delete branches and tags clear the snapshot explicitly (see
+        :func:`clear_ref_snapshot()`).
+        """
+        return {}
+
     @property
     def release_branches(self):
         """A dictionary that maps branch names to :class:`Release` objects."""
@@ -901,27 +1461,34 @@ class Repository(PropertyManager):
          Release(revision=Revision(..., tag='v2.3.7', ...), identifier='2.3.7'),
          Release(revision=Revision(..., tag='v2.4.0', ...), identifier='2.4.0')]
         """
-        available_releases = {}
-        available_revisions = getattr(self, self.release_scheme)
-        for identifier, revision in available_revisions.items():
-            match = self.compiled_filter.match(identifier)
-            if match:
-                # If the regular expression contains a capturing group we
-                # set the release identifier to the captured substring
-                # instead of the complete tag/branch identifier.
-                captures = match.groups()
-                if captures:
-                    identifier = captures[0]
-                available_releases[identifier] = Release(
-                    revision=revision,
-                    identifier=identifier,
-                )
-        return available_releases
+        key = ('releases', self.release_scheme, self.compiled_filter)
+        return self.get_ref_snapshot(key, self.find_releases)
 
     @mutable_property
     def remote(self):
         """The location of the remote repository (a string or :data:`None`)."""
 
+    @lazy_property(repr=False)
+    def revision_numbers(self):
+        """
+        A dictionary that maps global revision ids to revision numbers.
+
+        The dictionary is initialized from :attr:`revision_numbers_file` and
+        updated by :func:`lookup_revision_number()`.
+        """
+        mapping = {}
+        listing = self.context.capture('cat', self.revision_numbers_file, check=False, silent=True)
+        for line in listing.splitlines():
+            tokens = line.split()
+            if len(tokens) == 2 and tokens[1].isdigit():
+                mapping[tokens[0]] = int(tokens[1])
+        return mapping
+
+    @property
+    def revision_numbers_file(self):
+        """The pathname of the file used to store revision numbers (a string, see :attr:`cache_revision_numbers`)."""
+        return os.path.join(self.vcs_directory, 'vcs-repo-mgr-revisions.txt')
+
     @property
     def supports_working_tree(self):
         """
@@ -962,10 +1529,7 @@ class Repository(PropertyManager):
                             tag='v2.4.0',
                             revision_id='67308bd628c6235dbc1bad60c9ad1f2d27d576cc')}
         """
-        # Make sure the local repository exists.
-        self.create()
-        # Create a mapping of tag names to revisions.
-        return dict((r.tag, r) for r in self.find_tags())
+        return self.get_ref_snapshot('tags', lambda: dict((r.tag, r) for r in self.find_tags()))
 
     @property
     def vcs_directory(self):
@@ -1052,6 +1616,23 @@ class Repository(PropertyManager):
         logger.info("Checking out revision '%s' in %s ..", revision, format_path(self.local))
         self.context.execute(*self.get_checkout_command(revision, clean))
 
+    def clear_ref_snapshot(self):
+        """Forget the cached information about the branches and tags in the repository (see :attr:`ref_snapshot`)."""
+        self.ref_snapshot.clear()
+
+    def clear_directory(self, directory):
+        """
+        Remove the contents of a local directory (but not the directory itself).
+
+        :param directory: The absolute pathname of the directory (a string).
+        """
+        for filename in os.listdir(directory):
+            pathname = os.path.join(directory, filename)
+            if os.path.isdir(pathname) and not os.path.islink(pathname):
+                shutil.rmtree(pathname)
+            else:
+                os.unlink(pathname)
+
     def commit(self, message, author=None):
         """
         Commit changes to tracked files in the working tree.
@@ -1067,6 +1648,7 @@ class Repository(PropertyManager):
         logger.info("Committing changes in %s: %s", format_path(self.local), message)
         author = coerce_author(author) if author else self.author
         self.context.execute(*self.get_commit_command(message, author))
+        self.clear_ref_snapshot()
 
     def create(self):
         """
@@ -1108,6 +1690,7 @@ class Repository(PropertyManager):
                 self.mark_updated()
             # Ensure that all further commands are executed in the local repository.
             self.update_context()
+            self.update_caches()
             return True
 
     def create_branch(self, branch_name):
@@ -1126,6 +1709,66 @@ class Repository(PropertyManager):
         # Create the new branch in the local repository.
         logger.info("Creating branch '%s' in %s ..", branch_name, format_path(self.local))
         self.context.execute(*self.get_create_branch_command(branch_name))
+        self.clear_ref_snapshot()
+
+    def create_helper(self, name):
+        """
+        Create a long running helper process.
+
+        :param name: The name of the helper process (a string).
+        :returns: A :class:`~vcs_repo_mgr.helpers.HelperProcess` object or
+                  :data:`None` when the backend doesn't support the named
+                  helper process.
+
+        This method is used by :func:`get_helper()` and can be overridden by
+        subclasses that support helper processes, the default implementation
+        returns :data:`None`.
+        """
+        return None
+
+    def count_revisions_in_bulk(self, revision_ids):
+        """
+        Find the revision numbers of multiple revisions.
+
+        :param revision_ids: A list of global revision ids (strings).
+        :returns: A dictionary that maps revision ids to revision numbers.
+
+        This method is used by :func:`find_revision_numbers()` and can be
+        overridden by subclasses that are able to compute the revision numbers
+        of multiple revisions more efficiently than by calling
+        :func:`find_revision_number()` for each revision (which is what the
+        default implementation does).
+        """
+        return dict((revision_id, self.find_revision_number(revision_id)) for revision_id in revision_ids)
+
+    def create_revisions(self, references, revision_ids, revision_numbers=None):
+        """
+        Create :class:`Revision` objects for resolved revision references.
+
+        :param references: A list of revision references (strings).
+        :param revision_ids: A list of global revision ids (strings) that
+                             correspond to the given references.
+        :param revision_numbers: A list of local revision numbers (integers or
+                                 :data:`None`) that correspond to the given
+                                 references (optional).
+        :returns: A list of :class:`Revision` objects.
+
+        The references are recorded in :attr:`Revision.reference` so that
+        :attr:`Revision.branch` and :attr:`Revision.tag` can be computed on
+        demand (which avoids listing the branches and tags of the repository
+        when the caller only needs revision ids or numbers).
+        """
+        revisions = []
+        for i, reference in enumerate(references):
+            revision = Revision(
+                repository=self,
+                revision_id=revision_ids[i],
+                reference=reference,
+            )
+            if revision_numbers and revision_numbers[i] is not None:
+                revision.revision_number = revision_numbers[i]
+            revisions.append(revision)
+        return revisions
 
     def create_release_branch(self, branch_name):
         """
@@ -1153,6 +1796,7 @@ class Repository(PropertyManager):
         # Make sure the local repository exists.
         self.create()
         # Figure out the correct parent release branch.
+        from natsort import natsort
         candidates = natsort([r.revision.branch for r in self.ordered_releases] + [branch_name])
         index = candidates.index(branch_name) - 1
         if index < 0:
@@ -1174,6 +1818,7 @@ class Repository(PropertyManager):
         # Create the new tag in the local repository.
         logger.info("Creating tag '%s' in %s ..", tag_name, format_path(self.local))
         self.context.execute(*self.get_create_tag_command(tag_name))
+        self.clear_ref_snapshot()
 
     def delete_branch(self, branch_name, message=None, author=None):
         """
@@ -1196,6 +1841,7 @@ class Repository(PropertyManager):
             message=(message or ("Closing branch %s" % branch_name)),
             branch_name=branch_name,
         ))
+        self.clear_ref_snapshot()
 
     def ensure_clean(self):
         """
@@ -1265,7 +1911,7 @@ class Repository(PropertyManager):
                 repository at {directory} doesn't support a working tree!
             """, friendly_name=self.friendly_name, directory=format_path(self.local)))
 
-    def export(self, directory, revision=None):
+    def export(self, directory, revision=None, incremental=False):
         """
         Export the complete tree from the local version control repository.
 
@@ -1273,6 +1919,36 @@ class Repository(PropertyManager):
                           (a string).
         :param revision: The revision to export (a string or :data:`None`,
                          defaults to :attr:`default_revision`).
+        :param incremental: :data:`True` to only write the changes since the
+                            previous export to the same directory, :data:`False`
+                            (the default) to always export the complete tree.
+
+        When `incremental` is :data:`True` the global revision id of the
+        exported revision is recorded in a file named :data:`EXPORT_MARKER_FILE`
+        inside the directory. A later incremental export to the same directory
+        uses :func:`find_changed_files()` to find the files that changed between
+        the two revisions and only writes, updates and deletes those files. A
+        complete export is done when the marker file is missing, refers to
+        another repository or to a revision that can't be compared, or when the
+        repository isn't accessed through :class:`~executor.contexts.LocalContext`.
+        When the marker file exists (valid or not) the contents of the
+        directory are removed before such a complete export.
+        The marker file is removed while an export is in progress, so that an
+        interrupted export is never trusted.
+
+        Complete exports of local repositories use :attr:`export_cache` when
+        it's set, so that exporting the same tree again only needs to link
+        (or copy) the files of a previous export into the directory.
+
+        .. note:: Local repositories are exported by streaming the output of
+                  :func:`get_archive_command()` through :mod:`tarfile` (see
+                  :func:`extract_archive()`). This isn't possible for
+                  repositories accessed through other contexts (for example
+                  :class:`~executor.contexts.RemoteContext`) because the
+                  directory is on the remote system. For these repositories
+                  the directory is created using ``mkdir -p`` and the tree
+                  is exported using :func:`get_export_command()`, which can
+                  be a shell pipeline like ``git archive | tar --extract``.
         """
         # Make sure we're dealing with an absolute pathname (because a relative
         # pathname would be interpreted as relative to the repository's main
@@ -1284,9 +1960,213 @@ class Repository(PropertyManager):
         timer = Timer()
         revision = revision or self.default_revision
         logger.info("Exporting revision '%s' in %s to %s ..", revision, format_path(self.local), directory)
-        self.context.execute('mkdir', '-p', directory)
-        self.context.execute(*self.get_export_command(directory, revision))
-        logger.debug("Took %s to pull changes from remote %s repository.", timer, self.friendly_name)
+        try:
+            archive_command = self.get_archive_command(revision)
+        except NotImplementedError:
+            archive_command = None
+        if archive_command and isinstance(self.context, LocalContext):
+            if incremental:
+                revision = self.find_revision_id(revision)
+                previous_export = os.path.lexists(os.path.join(directory, EXPORT_MARKER_FILE))
+                if self.export_changes(directory, revision):
+                    logger.debug("Took %s to export changes.", timer)
+                    return
+                if previous_export:
+                    # Files deleted since the previous export would survive
+                    # a complete export into the existing tree.
+                    logger.debug("Removing previous export from %s ..", format_path(directory))
+                    self.clear_directory(directory)
+                archive_command = self.get_archive_command(revision)
+            elif os.path.isfile(os.path.join(directory, EXPORT_MARKER_FILE)):
+                # Don't leave behind a marker that no longer matches the tree.
+                os.unlink(os.path.join(directory, EXPORT_MARKER_FILE))
+            if not incremental and self.export_cache is not None:
+                self.export_cache.export(self, revision, directory)
+                logger.debug("Took %s to export revision '%s' using cache.", timer, revision)
+                return
+            extractor = self.extract_archive(archive_command, directory)
+            if incremental:
+                self.write_export_marker(directory, revision)
+            logger.debug("Took %s to export %s (%s).", timer,
+                         pluralize(extractor.num_files, "file"),
+                         format_size(extractor.num_bytes))
+        else:
+            # The directory is on another system, so the tree can't be
+            # extracted by us (refer to the docstring for details).
+            self.context.execute('mkdir', '-p', directory)
+            self.context.execute(*self.get_export_command(directory, revision))
+            logger.debug("Took %s to export revision '%s'.", timer, revision)
+
+    def export_archive(self, filename, revision=None, format=None, concurrency=None):
+        """
+        Export a revision to an archive file.
+
+        :param filename: The pathname of the archive (a string).
+        :param revision: The revision to export (a string or :data:`None`,
+                         defaults to :attr:`default_revision`).
+        :param format: The archive format (a string, one of the formats in
+                       :data:`~vcs_repo_mgr.archives.ARCHIVE_EXTENSIONS`,
+                       defaults to the format that matches the extension of
+                       `filename`).
+        :param concurrency: The number of threads used to compress the archive
+                            (an integer, defaults to :data:`DEFAULT_CONCURRENCY`).
+        :returns: The size of the archive in bytes (an integer).
+        :raises: :exc:`~exceptions.ValueError` when the format isn't supported.
+
+        The ``tar.gz`` and ``tar.xz`` formats are compressed using
+        :class:`~vcs_repo_mgr.archives.ParallelCompressor`, the other formats
+        are written by the version control system (see :func:`export_stream()`).
+        The archive is written to a temporary file that's renamed into place,
+        so that an interrupted export doesn't leave behind a partial archive.
+        """
+        from vcs_repo_mgr.archives import COMPRESSED_FORMATS, ParallelCompressor, find_archive_format
+        timer = Timer()
+        filename = os.path.abspath(filename)
+        format = format or find_archive_format(filename)
+        temporary_file = '%s.%i.tmp' % (filename, os.getpid())
+        try:
+            with open(temporary_file, 'wb') as handle:
+                if format in COMPRESSED_FORMATS:
+                    compressor = ParallelCompressor(compression=COMPRESSED_FORMATS[format])
+                    if concurrency:
+                        compressor.concurrency = concurrency
+                    with self.export_stream(revision, format='tar') as stream:
+                        num_bytes = compressor.compress(stream, handle)
+                else:
+                    num_bytes = self.export_stream(revision, format=format, output=handle)
+            os.rename(temporary_file, filename)
+        finally:
+            if os.path.exists(temporary_file):
+                os.unlink(temporary_file)
+        logger.info("Took %s to export %s archive of %s to %s.", timer,
+                    format_size(num_bytes), self.friendly_name, format_path(filename))
+        return num_bytes
+
+    def export_changes(self, directory, revision_id):
+        """
+        Update a previous export to a different revision.
+
+        :param directory: The absolute pathname of the export directory (a string).
+        :param revision_id: The global revision id to export (a string).
+        :returns: :data:`True` if the export was updated, :data:`False` when
+                  a complete export is required.
+
+        This is used by :func:`export()`, refer to its documentation for
+        details.
+        """
+        previous_revision = self.read_export_marker(directory)
+        if previous_revision is None:
+            return False
+        os.unlink(os.path.join(directory, EXPORT_MARKER_FILE))
+        if previous_revision != revision_id:
+            try:
+                changed_files, deleted_files = self.find_changed_files(previous_revision, revision_id)
+            except (ExternalCommandFailed, NotImplementedError) as e:
+                logger.info("Can't find changes since previous export, falling back to complete export. (%s)", e)
+                return False
+            logger.info("Updating export from revision %s (%s changed, %s deleted) ..", previous_revision,
+                        pluralize(len(changed_files), "file"), pluralize(len(deleted_files), "file"))
+            from vcs_repo_mgr.archives import ArchiveExtractor
+            resolver = ArchiveExtractor(directory=directory)
+            for filename in deleted_files:
+                pathname = resolver.get_target(filename)
+                if os.path.lexists(pathname) and not os.path.isdir(pathname):
+                    os.unlink(pathname)
+                # Remove directories that became empty.
+                parent = os.path.dirname(pathname)
+                while parent != directory and os.path.isdir(parent) and not os.listdir(parent):
+                    os.rmdir(parent)
+                    parent = os.path.dirname(parent)
+            for i in range(0, len(changed_files), EXPORT_BATCH_SIZE):
+                batch = changed_files[i:i + EXPORT_BATCH_SIZE]
+                self.extract_archive(self.get_archive_command(revision_id, paths=batch), directory)
+        self.write_export_marker(directory, revision_id)
+        return True
+
+    def export_stream(self, revision=None, format='tar', output=None):
+        """
+        Stream an archive of a revision without touching the filesystem.
+
+        :param revision: The revision to archive (a string or :data:`None`,
+                         defaults to :attr:`default_revision`).
+        :param format: One of the values in :data:`ARCHIVE_FORMATS` (a string,
+                       defaults to ``tar``).
+        :param output: A binary file-like object to which the archive is
+                       written (optional).
+        :returns: When `output` is given the number of bytes written (an
+                  integer), otherwise an :class:`~vcs_repo_mgr.archives.ArchiveStream`
+                  object from which the archive can be read.
+        :raises: :exc:`~exceptions.ValueError` when the format isn't supported,
+                 :exc:`~exceptions.NotImplementedError` when the backend doesn't
+                 implement :func:`get_archive_command()` and
+                 :exc:`~executor.ExternalCommandFailed` when the archive
+                 command fails.
+
+        The archive is produced by the version control system (see
+        :func:`get_archive_command()`) and read directly from its standard
+        output stream in chunks, so memory usage doesn't depend on the size
+        of the archive. This also works for repositories that aren't accessed
+        through :class:`~executor.contexts.LocalContext`.
+        """
+        if format not in ARCHIVE_FORMATS:
+            raise ValueError(compact("""
+                Unsupported archive format {format}! (supported formats
+                are {supported})
+            """, format=repr(format), supported=concatenate(map(repr, ARCHIVE_FORMATS))))
+        from vcs_repo_mgr.archives import CHUNK_SIZE, ArchiveStream
+        self.create()
+        revision = revision or self.default_revision
+        command = self.get_archive_command(revision, format=format)
+        logger.info("Streaming %s archive of revision '%s' in %s ..", format, revision, format_path(self.local))
+        stream = ArchiveStream(self.context.execute(*command, asynchronous=True, buffered=False,
+                                                    capture=True, silent=True))
+        if output is None:
+            return stream
+        num_bytes = 0
+        with stream:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                output.write(chunk)
+                num_bytes += len(chunk)
+        return num_bytes
+
+    def extract_archive(self, command, directory):
+        """
+        Extract the tar archive written to standard output by a command.
+
+        :param command: The command that writes the archive (a list of strings,
+                        see :func:`get_archive_command()`).
+        :param directory: The absolute pathname of the directory where the
+                          archive should be extracted (a string).
+        :returns: The :class:`~vcs_repo_mgr.archives.ArchiveExtractor` object.
+        :raises: :exc:`~executor.ExternalCommandFailed` when the command fails
+                 (also when the command fails before writing a complete
+                 archive, instead of the error reported by :mod:`tarfile`).
+
+        The archive is streamed from the command through :mod:`tarfile`,
+        refer to :mod:`vcs_repo_mgr.archives` for details.
+        """
+        import tarfile
+        from vcs_repo_mgr.archives import ArchiveExtractor
+        extractor = ArchiveExtractor(directory=directory)
+        process = self.context.execute(*command, asynchronous=True, buffered=False, capture=True, silent=True)
+        stream = process.stdout
+        try:
+            # On Python 3 the pipe is unbuffered.
+            if isinstance(stream, io.RawIOBase):
+                stream = io.BufferedReader(stream)
+            extractor.extract(stream)
+        except tarfile.TarError:
+            # An unreadable archive is usually caused by a failing command, in
+            # which case the error of the command is a lot more useful. We
+            # close the pipe so that the command can't block while writing.
+            stream.close()
+            process.wait(check=True)
+            raise
+        except Exception:
+            process.kill()
+            raise
+        process.wait()
+        return extractor
 
     def find_author(self):
         """
@@ -1310,6 +2190,22 @@ class Repository(PropertyManager):
         """
         raise NotImplementedError()
 
+    def find_changed_files(self, old_revision, new_revision):
+        """
+        Find the files that changed between two revisions.
+
+        :param old_revision: The global revision id of the old revision (a string).
+        :param new_revision: The global revision id of the new revision (a string).
+        :returns: A tuple with two lists of filenames (strings) relative to the
+                  root of the tree: The files that were added or modified and
+                  the files that were removed.
+
+        This method is optional, it's used by incremental exports (see
+        :func:`export()`). When it raises :exc:`~exceptions.NotImplementedError`
+        a complete export is done instead.
+        """
+        raise NotImplementedError()
+
     def find_tags(self):
         """
         Find information about the tags in the repository.
@@ -1320,6 +2216,22 @@ class Repository(PropertyManager):
         """
         raise NotImplementedError()
 
+    def find_tree_id(self, revision=None):
+        """
+        Find the id of the tree (the contents) of a revision.
+
+        :param revision: A reference to a revision, most likely the name of a
+                         branch (a string, defaults to :attr:`default_revision`).
+        :returns: The tree id (a hexadecimal string).
+
+        Different revisions with the same contents have the same tree id,
+        which makes it a good key for caching exports (see
+        :class:`~vcs_repo_mgr.exports.ExportCache`). This method is optional,
+        when it raises :exc:`~exceptions.NotImplementedError` the global
+        revision id is used instead.
+        """
+        raise NotImplementedError()
+
     def find_remote(self, default=False, name=None, role=None):
         """
         Find a remote repository connected to the local repository.
@@ -1338,6 +2250,32 @@ class Repository(PropertyManager):
                     (role in remote.roles if role else True)):
                 return remote
 
+    def find_releases(self):
+        """
+        Find the releases in the repository.
+
+        :returns: A dictionary that maps release identifiers to
+                  :class:`Release` objects.
+
+        This method is used by :attr:`releases`, which caches the result.
+        """
+        available_releases = {}
+        available_revisions = getattr(self, self.release_scheme)
+        for identifier, revision in available_revisions.items():
+            match = self.compiled_filter.match(identifier)
+            if match:
+                # If the regular expression contains a capturing group we
+                # set the release identifier to the captured substring
+                # instead of the complete tag/branch identifier.
+                captures = match.groups()
+                if captures:
+                    identifier = captures[0]
+                available_releases[identifier] = Release(
+                    revision=revision,
+                    identifier=identifier,
+                )
+        return available_releases
+
     def find_revision_id(self, revision=None):
         """
         Find the global revision id of the given revision.
@@ -1369,6 +2307,62 @@ class Repository(PropertyManager):
         """
         raise NotImplementedError()
 
+    def find_revision_numbers(self, revisions=None):
+        """
+        Find the revision numbers of multiple revisions at once.
+
+        :param revisions: An iterable of :class:`Revision` objects (defaults
+                          to the values of :attr:`branches` and :attr:`tags`).
+        :returns: A dictionary that maps global revision ids to revision numbers.
+
+        The :attr:`~Revision.revision_number` properties of the given
+        :class:`Revision` objects are set as a side effect, so this is an
+        efficient way to prepare for using the revision numbers of many
+        revisions, for example:
+
+        >>> repository.find_revision_numbers(r.revision for r in repository.ordered_releases)
+
+        Revision numbers that are already known (because the backend reported
+        them while listing branches and tags or because they're available in
+        the persistent store, see :attr:`cache_revision_numbers`) are not
+        computed again. The remaining revision numbers are computed using
+        :func:`count_revisions_in_bulk()`, which backends implement using a
+        single traversal of the history.
+        """
+        if revisions is None:
+            revisions = list(self.branches.values()) + list(self.tags.values())
+        revisions = list(revisions)
+        revision_numbers = {}
+        for revision in revisions:
+            if revision.__dict__.get('revision_number') is not None:
+                revision_numbers[revision.revision_id] = revision.revision_number
+            elif self.cache_revision_numbers and self.is_immutable_revision_id(revision.revision_id):
+                revision_number = self.revision_numbers.get(revision.revision_id)
+                if revision_number is not None:
+                    revision_numbers[revision.revision_id] = revision_number
+        missing = sorted(set(r.revision_id for r in revisions) - set(revision_numbers))
+        if missing:
+            logger.debug("Computing %s in %s ..", pluralize(len(missing), "revision number"), format_path(self.local))
+            revision_numbers.update(self.count_revisions_in_bulk(missing))
+        for revision in revisions:
+            revision.revision_number = revision_numbers[revision.revision_id]
+        return revision_numbers
+
+    def find_revisions(self, references):
+        """
+        Find the global revision ids of multiple revisions at once.
+
+        :param references: A list of revision references (strings).
+        :returns: A list of :class:`Revision` objects (in the same order as
+                  the given references).
+
+        This method is used by :func:`resolve_revisions()`. The default
+        implementation calls :func:`find_revision_id()` for each of the given
+        references, backends override it to resolve all of the references
+        using a single command.
+        """
+        return self.create_revisions(references, [self.find_revision_id(r) for r in references])
+
     def generate_control_field(self, revision=None):
         """
         Generate a Debian control file field referring for this repository and revision.
@@ -1390,6 +2384,62 @@ class Repository(PropertyManager):
         value = "%s#%s" % (self.remote or self.local, self.find_revision_id(revision))
         return self.control_field, value
 
+    def get_helper(self, name):
+        """
+        Get a running helper process (if enabled and available).
+
+        :param name: The name of the helper process (a string).
+        :returns: A :class:`~vcs_repo_mgr.helpers.HelperProcess` object or
+                  :data:`None` when :attr:`persistent_helpers` is disabled,
+                  the backend doesn't support the named helper or the helper
+                  failed to start.
+
+        Helper processes run inside the local repository, so :data:`None` is
+        also returned when the local repository doesn't exist (yet). When
+        :data:`None` is returned callers should fall back to running regular
+        subprocesses.
+        """
+        if self.persistent_helpers:
+            helper = self.helpers.get(name)
+            if not (helper and helper.is_running) and not self.exists:
+                return None
+            if helper is None:
+                helper = self.create_helper(name)
+                if helper is None:
+                    return None
+                self.helpers[name] = helper
+            if helper.ensure_running():
+                return helper
+
+    def get_ref_snapshot(self, key, function):
+        """
+        Get cached information about the branches and tags in the repository.
+
+        :param key: The key in :attr:`ref_snapshot` (any hashable value).
+        :param function: A callable that computes the value when it's not
+                         cached (it should return a dictionary).
+        :returns: A shallow copy of the cached dictionary.
+
+        When :attr:`ref_fingerprint` is :data:`None` nothing is cached and
+        `function` is called every time. Otherwise the cached value is used
+        until the fingerprint changes, in which case the whole snapshot is
+        discarded.
+        """
+        fingerprint = self.ref_fingerprint
+        snapshot = self.ref_snapshot
+        if fingerprint is None or snapshot.get('fingerprint') != fingerprint:
+            snapshot.clear()
+        if fingerprint is not None and key in snapshot:
+            logger.debug("Using cached %s of %s.", key[0] if isinstance(key, tuple) else key, format_path(self.local))
+            return dict(snapshot[key])
+        # Make sure the local repository exists.
+        self.create()
+        value = function()
+        if fingerprint is not None:
+            snapshot['fingerprint'] = fingerprint
+            snapshot[key] = value
+        return dict(value)
+
     def get_add_files_command(self, *filenames):
         """
         Get the command to include added and/or removed files in the working tree in the next commit.
@@ -1481,6 +2531,24 @@ class Repository(PropertyManager):
         """
         raise NotImplementedError()
 
+    def get_archive_command(self, revision, paths=None, format='tar'):
+        """
+        Get the command to write an archive of a revision to standard output.
+
+        :param revision: The revision to archive (a string).
+        :param paths: A list of filenames relative to the root of the tree
+                      (strings) to limit the archive to these files (optional).
+        :param format: One of the values in :data:`ARCHIVE_FORMATS` (a string,
+                       defaults to ``tar``).
+        :returns: A list of strings.
+
+        The names of the files in the archive should be relative to the root
+        of the tree (without a leading directory). This method is optional,
+        when it raises :exc:`~exceptions.NotImplementedError`
+        :func:`export()` uses :func:`get_export_command()` instead.
+        """
+        raise NotImplementedError()
+
     def get_export_command(self, directory, revision):
         """
         Get the command to export the complete tree from the local repository.
@@ -1490,7 +2558,10 @@ class Repository(PropertyManager):
         :param revision: The revision to export (a string,
                          defaults to :attr:`default_revision`).
 
-        This method needs to be implemented by subclasses.
+        This method needs to be implemented by subclasses. It's used by
+        :func:`export()` for repositories that aren't accessed through
+        :class:`~executor.contexts.LocalContext` and for backends that don't
+        implement :func:`get_archive_command()`.
         """
         raise NotImplementedError()
 
@@ -1554,6 +2625,7 @@ class Repository(PropertyManager):
                 changes but don't commit the result just yet (it will be done
                 for you).
             """))
+            from humanfriendly.prompts import prompt_for_confirmation
             while True:
                 if prompt_for_confirmation("Ignore merge error because you've resolved all conflicts?"):
                     if self.merge_conflicts:
@@ -1567,6 +2639,20 @@ class Repository(PropertyManager):
                     break
         return False
 
+    def is_immutable_revision_id(self, revision):
+        """
+        Check whether a revision reference is a global revision id.
+
+        :param revision: A reference to a revision (a string).
+        :returns: :data:`True` if the reference is known to be a global
+                  revision id, :data:`False` otherwise.
+
+        This method is used by :func:`lookup_revision_number()` to avoid
+        resolving references that are already revision ids. The default
+        implementation always returns :data:`False`.
+        """
+        return False
+
     def is_feature_branch(self, branch_name):
         """
         Try to determine whether a branch name refers to a feature branch.
@@ -1596,6 +2682,128 @@ class Repository(PropertyManager):
             # Other valid branches are considered feature branches.
             return True
 
+    def iter_files(self, revision, paths):
+        """
+        Read files at a revision without exporting the tree.
+
+        :param revision: The revision to read (a string or :data:`None`,
+                         defaults to :attr:`default_revision`).
+        :param paths: An iterable of filenames relative to the root of the
+                      tree (strings).
+        :returns: A generator of tuples with two values each: The filename
+                  and the contents of the file (a byte string or :data:`None`
+                  when the file doesn't exist at the given revision).
+
+        The files are read using :func:`read_files()`.
+        """
+        self.create()
+        revision = revision or self.default_revision
+        paths = list(paths)
+        for path, contents in zip(paths, self.read_files([(revision, path) for path in paths])):
+            yield path, contents
+
+    def iter_output(self, command, delimiter=b'\n', input=None):
+        r"""
+        Stream the output of a command as a sequence of records.
+
+        :param command: The command to run (a list of strings).
+        :param delimiter: The byte string that separates records (defaults
+                          to a newline, use ``b'\0'`` for NUL terminated records).
+        :param input: The input to feed to the command on its standard input
+                      stream (a string, defaults to :data:`None`).
+        :returns: A generator of strings (the decoded records, without delimiters).
+        :raises: :exc:`~executor.ExternalCommandFailed` when the command fails.
+
+        Unlike :func:`~executor.contexts.AbstractContext.capture()` the output
+        is read in chunks while the command is running, so memory usage is
+        bounded by the size of the largest record. When the caller stops
+        iterating before the end of the output the command is killed.
+
+        Records are decoded as UTF-8. On Python 3 bytes that aren't valid
+        UTF-8 (for example filenames in Latin-1) are decoded using the
+        ``surrogateescape`` error handler, which is how Python 3 represents
+        such filenames (so :func:`os.fsencode()` gives back the original
+        bytes). On Python 2 such records are returned as byte strings.
+        """
+        from vcs_repo_mgr.archives import CHUNK_SIZE, ArchiveStream
+        process = self.context.execute(*command, asynchronous=True, buffered=False,
+                                       capture=True, input=input, silent=True)
+        with ArchiveStream(process) as stream:
+            partial = b''
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                records = (partial + chunk).split(delimiter)
+                partial = records.pop()
+                for record in records:
+                    yield decode_record(record)
+            if partial:
+                yield decode_record(partial)
+
+    def iter_release_files(self, path):
+        """
+        Read the same file in all releases.
+
+        :param path: A filename relative to the root of the tree (a string).
+        :returns: A generator of tuples with two values each: A
+                  :class:`Release` object (in the order given by
+                  :attr:`ordered_releases`) and the contents of the file (a
+                  byte string or :data:`None` when the file doesn't exist in
+                  the release).
+
+        This is useful to extract version numbers from many releases, the
+        files are read using :func:`read_files()` which means backends can
+        read all of them using a single process.
+        """
+        releases = self.ordered_releases
+        requests = [(release.revision.revision_id, path) for release in releases]
+        for release, contents in zip(releases, self.read_files(requests)):
+            yield release, contents
+
+    def list_files(self, revision=None, prefix=None):
+        """
+        List the files in the tree of a revision without exporting the tree.
+
+        :param revision: The revision to list (a string or :data:`None`,
+                         defaults to :attr:`default_revision`).
+        :param prefix: The pathname of a directory relative to the root of
+                       the tree (a string, optional). When given only the
+                       files inside this directory are listed.
+        :returns: A generator of :class:`TreeEntry` objects.
+
+        The output of the version control system is streamed (see
+        :func:`iter_output()`) so this works with very large trees. This
+        method needs to be implemented by subclasses.
+        """
+        raise NotImplementedError()
+
+    def lookup_revision_number(self, revision, function):
+        """
+        Find a revision number using the persistent store (if enabled).
+
+        :param revision: A reference to a revision (a string).
+        :param function: A callable that computes the revision number of the
+                         revision it's given (a global revision id when
+                         :attr:`cache_revision_numbers` is enabled).
+        :returns: The local revision number (an integer).
+
+        This method is meant to be used by implementations of
+        :func:`find_revision_number()`. When :attr:`cache_revision_numbers`
+        is :data:`False` it simply calls `function`. Otherwise the reference
+        is resolved to a global revision id (using :func:`find_revision_id()`)
+        which is looked up in :attr:`revision_numbers`. When the revision
+        number isn't known yet it's computed and appended to
+        :attr:`revision_numbers_file`.
+        """
+        if not self.cache_revision_numbers:
+            return function(revision)
+        revision_id = revision if self.is_immutable_revision_id(revision) else self.find_revision_id(revision)
+        revision_number = self.revision_numbers.get(revision_id)
+        if revision_number is not None:
+            logger.debug("Found revision number of %s in %s.", revision_id, format_path(self.revision_numbers_file))
+        else:
+            revision_number = function(revision_id)
+            self.store_revision_numbers({revision_id: revision_number})
+        return revision_number
+
     def mark_updated(self):
         """Mark a successful update so that :attr:`last_updated` can report it."""
         self.context.write_file(self.last_updated_file, '%i\n' % time.time())
@@ -1790,10 +2998,12 @@ class Repository(PropertyManager):
             return
         # Pull the changes from the remote repository.
         timer = Timer()
+        fingerprint = self.ref_fingerprint
         logger.info("Pulling changes from %s into local %s repository (%s) ..",
                     remote or "default remote", self.friendly_name, format_path(self.local))
         self.context.execute(*self.get_pull_command(remote=remote, revision=revision))
         logger.debug("Took %s to pull changes from remote %s repository.", timer, self.friendly_name)
+        self.update_caches(changed=(fingerprint is None or fingerprint != self.ref_fingerprint))
         self.mark_updated()
 
     def push(self, remote=None, revision=None):
@@ -1821,6 +3031,55 @@ class Repository(PropertyManager):
                     remote or self.remote or "default remote")
         self.context.execute(*self.get_push_command(remote, revision))
         logger.debug("Took %s to push changes to remote repository.", timer)
+        # Pushing can update remote tracking branches in the local repository.
+        self.clear_ref_snapshot()
+
+    def read_export_marker(self, directory):
+        """
+        Find the revision recorded by a previous incremental export.
+
+        :param directory: The absolute pathname of the export directory (a string).
+        :returns: A global revision id (a string) or :data:`None` when the
+                  marker file is missing, invalid or was written for another
+                  repository.
+        """
+        try:
+            with open(os.path.join(directory, EXPORT_MARKER_FILE)) as handle:
+                marker = json.load(handle)
+            if marker['repository'] == self.local and HEX_PATTERN.match(marker['revision']):
+                return marker['revision']
+            logger.debug("Ignoring export marker of other repository (%s).", marker['repository'])
+        except Exception as e:
+            logger.debug("Ignoring missing or invalid export marker in %s! (%s)", format_path(directory), e)
+
+    def read_file(self, revision, path):
+        """
+        Read a file at a revision without exporting the tree.
+
+        :param revision: The revision to read (a string or :data:`None`,
+                         defaults to :attr:`default_revision`).
+        :param path: A filename relative to the root of the tree (a string).
+        :returns: The contents of the file (a byte string) or :data:`None`
+                  when the file doesn't exist at the given revision.
+        """
+        for path, contents in self.iter_files(revision, [path]):
+            return contents
+
+    def read_files(self, requests):
+        """
+        Read files at revisions without exporting the tree.
+
+        :param requests: A list of tuples with two strings each (a revision
+                         and a filename relative to the root of the tree).
+        :returns: A generator of the contents of the files (byte strings or
+                  :data:`None` for files that don't exist) in the same order
+                  as `requests`.
+
+        This method is used by :func:`read_file()`, :func:`iter_files()` and
+        :func:`iter_release_files()` and needs to be implemented by
+        subclasses. The contents of one file at a time are kept in memory.
+        """
+        raise NotImplementedError()
 
     def release_to_branch(self, release_id):
         """
@@ -1846,6 +3105,35 @@ class Repository(PropertyManager):
         self.ensure_release_scheme('tags')
         return self.releases[release_id].revision.tag
 
+    def resolve_revisions(self, references, numbers=True):
+        """
+        Resolve multiple revision references at once.
+
+        :param references: An iterable of revision references, most likely
+                           the names of branches or tags (strings, :data:`None`
+                           selects :attr:`default_revision`).
+        :param numbers: :data:`True` to find the revision numbers of the
+                        revisions as well (the default), :data:`False` to
+                        compute them on demand instead.
+        :returns: A list of :class:`Revision` objects (in the same order as
+                  the given references).
+
+        The global revision ids are found using :func:`find_revisions()` and
+        the revision numbers using :func:`find_revision_numbers()`, so each
+        backend runs a fixed number of commands regardless of the number of
+        references. References that match the name of a branch or tag are
+        recorded in :attr:`Revision.branch` and :attr:`Revision.tag`.
+        """
+        # Make sure the local repository exists.
+        self.create()
+        references = [r or self.default_revision for r in references]
+        if not references:
+            return []
+        revisions = self.find_revisions(references)
+        if numbers:
+            self.find_revision_numbers(revisions)
+        return revisions
+
     def select_release(self, highest_allowed_release):
         """
         Select the newest release that is not newer than the given release.
@@ -1857,6 +3145,7 @@ class Repository(PropertyManager):
         :raises: :exc:`~vcs_repo_mgr.exceptions.NoMatchingReleasesError`
                  when no matching releases are found.
         """
+        from natsort import natsort_key
         matching_releases = []
         highest_allowed_key = natsort_key(highest_allowed_release)
         for release in self.ordered_releases:
@@ -1868,10 +3157,70 @@ class Repository(PropertyManager):
             raise NoMatchingReleasesError(msg % highest_allowed_release)
         return matching_releases[-1]
 
+    def store_revision_numbers(self, revision_numbers):
+        """
+        Add revision numbers to the persistent store (if enabled).
+
+        :param revision_numbers: A dictionary that maps global revision ids
+                                 to revision numbers.
+
+        When :attr:`cache_revision_numbers` is :data:`False` this does
+        nothing. Revision numbers that are already known aren't stored again.
+        """
+        if self.cache_revision_numbers:
+            lines = []
+            for revision_id, revision_number in sorted(revision_numbers.items()):
+                if self.revision_numbers.get(revision_id) != revision_number:
+                    self.revision_numbers[revision_id] = revision_number
+                    lines.append('%s %i\n' % (revision_id, revision_number))
+            if lines:
+                data = ''.join(lines)
+                try:
+                    # Small appends are atomic, which means concurrent
+                    # processes can safely update the same file.
+                    if isinstance(self.context, LocalContext):
+                        fd = os.open(self.revision_numbers_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                        try:
+                            os.write(fd, data.encode('ascii'))
+                        finally:
+                            os.close(fd)
+                    else:
+                        self.context.execute('tee', '-a', self.revision_numbers_file, input=data, silent=True)
+                except (EnvironmentError, ExternalCommandFailed) as e:
+                    logger.warning("Failed to store revision numbers in %s! (%s)",
+                                   format_path(self.revision_numbers_file), e)
+
+    def stop_helpers(self):
+        """
+        Shut down the helper processes started by this repository (if any).
+
+        It's safe to keep using the :class:`Repository` object after calling
+        this method, helper processes will be restarted on demand.
+        """
+        helpers = self.__dict__.get('helpers')
+        if helpers:
+            from vcs_repo_mgr.helpers import stop_helper_processes
+            logger.debug("Stopping %s for %s ..", pluralize(len(helpers), "helper process", "helper processes"),
+                         format_path(self.local))
+            stop_helper_processes(helpers)
+
     def update(self, remote=None):
         """Alias for :func:`pull()` to enable backwards compatibility."""
         self.pull(remote=remote)
 
+    def update_caches(self, changed=True):
+        """
+        Update cached information after the local repository was created or updated.
+
+        :param changed: :data:`False` if the refs in the local repository are
+                        known to be unchanged, :data:`True` otherwise.
+
+        This method is called by :func:`create()` and :func:`pull()`. The
+        default implementation forgets the :attr:`ref_snapshot`, backends
+        can extend it to update their own caches.
+        """
+        self.clear_ref_snapshot()
+
     def update_context(self):
         """
         Try to ensure that external commands are executed in the local repository.
@@ -1895,6 +3244,44 @@ class Repository(PropertyManager):
             # Clear the execution context's working directory.
             self.context.options.pop('directory', None)
 
+    @contextlib.contextmanager
+    def use_helper(self, name):
+        """
+        Use a helper process for a batch of queries.
+
+        :param name: The name of the helper process (a string).
+        :returns: A context manager that returns a
+                  :class:`~vcs_repo_mgr.helpers.HelperProcess` object (or
+                  :data:`None` when the helper isn't available).
+
+        When :attr:`persistent_helpers` is enabled this returns the result of
+        :func:`get_helper()`, otherwise a helper process is started for the
+        duration of the :keyword:`with` block. This enables bulk operations
+        to share a single process without requiring the caller to opt in to
+        persistent helper processes.
+        """
+        if self.persistent_helpers or not self.exists:
+            yield self.get_helper(name)
+            return
+        helper = self.create_helper(name)
+        if helper is None:
+            yield None
+            return
+        try:
+            yield helper if helper.ensure_running() else None
+        finally:
+            helper.stop()
+
+    def write_export_marker(self, directory, revision_id):
+        """
+        Record the revision that was exported to a directory.
+
+        :param directory: The absolute pathname of the export directory (a string).
+        :param revision_id: The global revision id that was exported (a string).
+        """
+        with open(os.path.join(directory, EXPORT_MARKER_FILE), 'w') as handle:
+            json.dump(dict(repository=self.local, revision=revision_id), handle)
+
 
 class RepositoryMeta(type):
 
@@ -1916,6 +3303,222 @@ class RepositoryMeta(type):
 Repository = add_metaclass(RepositoryMeta)(Repository)
 
 
+class RepositoryCache(PropertyManager, MutableMapping):
+
+    """
+    Bounded cache of the :class:`Repository` objects constructed by :func:`repository_factory()`.
+
+    The cache keeps the :attr:`max_size` most recently used repositories
+    alive. Repositories that are evicted from the cache have their helper
+    processes stopped (see :func:`Repository.stop_helpers()`). When
+    :attr:`weak_references` is enabled evicted repositories that are still
+    in use elsewhere are returned again instead of constructing duplicates.
+
+    The cache implements the mapping protocol (so :data:`loaded_repositories`
+    can still be used like the dictionary it used to be) in addition to
+    :func:`get_or_create()`.
+    """
+
+    def __init__(self, **options):
+        """
+        Initialize a :class:`RepositoryCache` object.
+
+        :param options: Any keyword arguments are used to set the values of
+                        the properties of the :class:`RepositoryCache` object.
+
+        The lock and the containers are initialized here because lazy
+        initialization wouldn't be thread safe.
+        """
+        super(RepositoryCache, self).__init__(**options)
+        for name in 'entries', 'lock', 'weak_entries':
+            getattr(self, name)
+
+    @lazy_property(repr=False)
+    def entries(self):
+        """A :class:`~collections.OrderedDict` that maps keys to repositories (from least to most recently used)."""
+        return collections.OrderedDict()
+
+    @mutable_property
+    def evictions(self):
+        """The number of repositories evicted because the cache was full (an integer)."""
+        return 0
+
+    @mutable_property
+    def hits(self):
+        """The number of times a cached repository was returned (an integer)."""
+        return 0
+
+    @lazy_property(repr=False)
+    def lock(self):
+        """A :class:`threading.RLock` object that serializes access to the cache."""
+        return threading.RLock()
+
+    @mutable_property
+    def max_size(self):
+        """
+        The maximum number of repositories kept alive by the cache (an integer).
+
+        Defaults to :data:`DEFAULT_CACHE_SIZE`, :data:`None` disables the
+        limit. Changing the maximum size takes effect on the next lookup.
+        """
+        return DEFAULT_CACHE_SIZE
+
+    @mutable_property
+    def misses(self):
+        """The number of times a new repository had to be constructed (an integer)."""
+        return 0
+
+    @lazy_property(repr=False)
+    def weak_entries(self):
+        """A :class:`weakref.WeakValueDictionary` that maps keys to repositories."""
+        return weakref.WeakValueDictionary()
+
+    @mutable_property
+    def weak_references(self):
+        """:data:`True` (the default) to keep weak references to evicted repositories, :data:`False` otherwise."""
+        return True
+
+    def __contains__(self, key):
+        """Check whether a repository with the given key is cached."""
+        with self.lock:
+            return key in self.entries or (self.weak_references and key in self.weak_entries)
+
+    def __delitem__(self, key):
+        """Evict the repository with the given key (raises :exc:`~exceptions.KeyError` when it isn't cached)."""
+        if not self.evict(key):
+            raise KeyError(key)
+
+    def __getitem__(self, key):
+        """Get the repository with the given key (raises :exc:`~exceptions.KeyError` when it isn't cached)."""
+        evicted = []
+        with self.lock:
+            repository = self.lookup(key, evicted)
+        self.release(evicted)
+        if repository is None:
+            raise KeyError(key)
+        return repository
+
+    def __iter__(self):
+        """Iterate over the keys of the repositories kept alive by the cache."""
+        with self.lock:
+            return iter(list(self.entries))
+
+    def __len__(self):
+        """Get the number of repositories kept alive by the cache."""
+        return len(self.entries)
+
+    def __setitem__(self, key, repository):
+        """Add a repository to the cache."""
+        with self.lock:
+            evicted = self.insert(key, repository)
+        self.release(evicted)
+
+    def clear(self):
+        """Evict all repositories from the cache."""
+        with self.lock:
+            evicted = set(self.entries.values()) | set(self.weak_entries.values())
+            self.entries.clear()
+            self.weak_entries.clear()
+        self.release(evicted)
+
+    def evict(self, value):
+        """
+        Evict a repository from the cache.
+
+        :param value: A :class:`Repository` object or a cache key.
+        :returns: :data:`True` if the repository was cached, :data:`False` otherwise.
+        """
+        with self.lock:
+            if isinstance(value, Repository):
+                keys = set(k for k, r in self.entries.items() if r is value)
+                keys.update(k for k, r in list(self.weak_entries.items()) if r is value)
+            else:
+                keys = set([value])
+            evicted = set()
+            for key in keys:
+                for container in self.entries, self.weak_entries:
+                    repository = container.pop(key, None)
+                    if repository is not None:
+                        evicted.add(repository)
+        self.release(evicted)
+        return bool(evicted)
+
+    def get_or_create(self, key, factory):
+        """
+        Get a cached repository or construct a new one.
+
+        :param key: The cache key (a tuple of strings).
+        :param factory: A callable that constructs a :class:`Repository` object.
+        :returns: A :class:`Repository` object.
+
+        The factory is called without holding :attr:`lock` (so that threads
+        can construct different repositories concurrently). When two threads
+        construct the same repository at the same time the repository that's
+        added to the cache first is returned to both threads.
+        """
+        evicted = []
+        with self.lock:
+            repository = self.lookup(key, evicted)
+        if repository is not None:
+            logger.debug("Repository previously constructed, returning cached instance ..")
+        else:
+            logger.debug("Repository not yet constructed, creating new instance ..")
+            candidate = factory()
+            with self.lock:
+                repository = self.lookup(key, evicted)
+                if repository is None:
+                    self.misses += 1
+                    repository = candidate
+                    evicted.extend(self.insert(key, repository))
+                else:
+                    logger.debug("Repository was constructed concurrently, discarding duplicate ..")
+        self.release(evicted)
+        return repository
+
+    def insert(self, key, repository):
+        """
+        Add a repository to the cache (the caller must hold :attr:`lock`).
+
+        :param key: The cache key (a tuple of strings).
+        :param repository: A :class:`Repository` object.
+        :returns: A list with the repositories that were evicted to make room
+                  (their helper processes should be stopped using
+                  :func:`release()`, without holding :attr:`lock`).
+        """
+        self.entries.pop(key, None)
+        self.entries[key] = repository
+        if self.weak_references:
+            self.weak_entries[key] = repository
+        evicted = []
+        while self.max_size is not None and len(self.entries) > self.max_size:
+            evicted.append(self.entries.popitem(last=False)[1])
+            self.evictions += 1
+        return evicted
+
+    def lookup(self, key, evicted):
+        """
+        Find a cached repository and mark it as most recently used (the caller must hold :attr:`lock`).
+
+        :param key: The cache key (a tuple of strings).
+        :param evicted: A list to which repositories are added that were
+                        evicted because a weakly referenced repository was
+                        added to the cache again (see :func:`insert()`).
+        :returns: A :class:`Repository` object or :data:`None`.
+        """
+        repository = self.entries.get(key)
+        if repository is None and self.weak_references:
+            repository = self.weak_entries.get(key)
+        if repository is not None:
+            self.hits += 1
+            evicted.extend(self.insert(key, repository))
+        return repository
+
+    def release(self, repositories):
+        """Stop the helper processes of evicted repositories."""
+        for repository in repositories:
+            repository.stop_helpers()
+
+
 class Release(PropertyManager):
 
     """
@@ -1985,13 +3588,21 @@ class Revision(PropertyManager):
 
     """:class:`Revision` objects represent a specific revision in a :class:`Repository`."""
 
-    @mutable_property
+    @mutable_property(cached=True)
     def branch(self):
         """
         The name of the branch in which the revision exists (a string or :data:`None`).
 
         When this property is not available its value will be :data:`None`.
+        When the revision was resolved from a :attr:`reference` that matches
+        the name of a branch that name is used.
         """
+        if self.reference and self.reference in self.repository.branches:
+            return self.reference
+
+    @mutable_property(repr=False)
+    def reference(self):
+        """The revision reference from which the revision was resolved (a string or :data:`None`)."""
 
     @required_property(repr=False)
     def repository(self):
@@ -2023,10 +3634,69 @@ class Revision(PropertyManager):
         """
         return self.repository.find_revision_number(self.revision_id)
 
-    @mutable_property
+    @mutable_property(cached=True)
     def tag(self):
         """
         The name of the tag associated to the revision (a string or :data:`None`).
 
         When this property is not available its value will be :data:`None`.
+        When the revision was resolved from a :attr:`reference` that matches
+        the name of a tag that name is used.
         """
+        if self.reference and self.reference in self.repository.tags:
+            return self.reference
+
+
+class TreeEntry(collections.namedtuple('TreeEntry', 'path, mode, object_id')):
+
+    """
+    A file in the tree of a revision, as reported by :func:`Repository.list_files()`.
+
+    This is a :func:`~collections.namedtuple()` (instead of a
+    :class:`~property_manager.PropertyManager` subclass like the other
+    classes in this module) because trees can contain millions of files.
+    The fields are:
+
+    - `path`: The filename relative to the root of the tree (a string).
+    - `mode`: The file mode in the format used by git, for example
+      ``0o100644`` for regular files, ``0o100755`` for executable files and
+      ``0o120000`` for symbolic links (an integer or :data:`None` when the
+      backend doesn't report modes).
+    - `object_id`: The id of the contents of the file (a hexadecimal string or
+      :data:`None` when the backend doesn't report object ids).
+    """
+
+    __slots__ = ()
+
+
+class UpdateResult(PropertyManager):
+
+    """The outcome of a repository update performed by :func:`update_repositories()`."""
+
+    @required_property
+    def elapsed_time(self):
+        """The number of seconds it took to update the repository (a number)."""
+
+    @mutable_property
+    def error(self):
+        """The exception that caused the update to fail (an exception or :data:`None`)."""
+
+    @required_property
+    def name(self):
+        """The name of the repository (a string)."""
+
+    @property
+    def succeeded(self):
+        """:data:`True` if the update succeeded, :data:`False` otherwise."""
+        return self.error is None
+
+    def __str__(self):
+        """Render a human friendly description of the outcome."""
+        if self.succeeded:
+            return "%s: updated in %s" % (self.name, format_timespan(self.elapsed_time))
+        else:
+            return "%s: failed after %s (%s)" % (self.name, format_timespan(self.elapsed_time), self.error)
+
+
+# The cache of Repository objects constructed by repository_factory().
+loaded_repositories = RepositoryCache()
@@ -0,0 +1,181 @@
+# Version control system repository manager.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/xolox/python-vcs-repo-mgr
+
+"""
+Asynchronous interface to version control repositories based on :mod:`asyncio`.
+
+The :class:`~vcs_repo_mgr.Repository` class runs external commands using the
+synchronous :mod:`executor` module, which means each method call blocks until
+the version control command finishes. The :class:`AsyncRepository` class wraps
+a repository object and provides awaitable counterparts of the most commonly
+used methods and properties, so that a single event loop can update many
+repositories concurrently:
+
+.. code-block:: python
+
+   import asyncio
+   from vcs_repo_mgr.aio import AsyncRepository
+
+   async def update_mirrors(names):
+       repositories = [AsyncRepository(n) for n in names]
+       await asyncio.gather(*(r.pull() for r in repositories))
+
+The methods of :class:`AsyncRepository` run the existing synchronous methods
+of :class:`~vcs_repo_mgr.Repository` in a thread pool (using
+:meth:`~asyncio.AbstractEventLoop.run_in_executor()`) and return
+:class:`asyncio.Future` objects, so the behavior of for example
+:func:`~AsyncRepository.pull()` is exactly the same as the behavior of
+:func:`.Repository.pull()` (including support for remote execution contexts).
+
+Because each operation occupies a thread until its external commands have
+finished, the number of operations that run at the same time is limited by
+the size of the thread pool. By default all :class:`AsyncRepository` objects
+share a thread pool of :data:`DEFAULT_MAX_WORKERS` threads (see
+:func:`get_shared_executor()`), which is much larger than the default
+executor of the event loop because the threads spend nearly all of their
+time waiting for version control commands. Operations beyond this limit are
+queued. To update more repositories at the same time set
+:attr:`AsyncRepository.executor` to a larger thread pool.
+
+This module requires :mod:`asyncio` (Python 3.4 or newer), importing it on
+Python 2 raises :exc:`~exceptions.ImportError`. The module doesn't use the
+``async`` and ``await`` syntax, so it can be byte compiled on all of the
+Python versions supported by `vcs-repo-mgr` (callers on Python 3.4 can use
+``yield from`` instead of ``await``).
+"""
+
+# Standard library modules.
+import asyncio
+import concurrent.futures
+import threading
+
+# External dependencies.
+from property_manager import PropertyManager, lazy_property, mutable_property, required_property
+
+# Modules included in our package.
+from vcs_repo_mgr import coerce_repository
+
+# Public identifiers that require documentation.
+__all__ = (
+    'AsyncRepository',
+    'DEFAULT_MAX_WORKERS',
+    'get_shared_executor',
+)
+
+DEFAULT_MAX_WORKERS = 64
+"""The number of threads in the thread pool returned by :func:`get_shared_executor()` (an integer)."""
+
+# The thread pool shared by AsyncRepository objects (created on demand).
+shared_executor = None
+shared_executor_lock = threading.Lock()
+
+
+def get_shared_executor():
+    """
+    Get the thread pool that is shared by :class:`AsyncRepository` objects.
+
+    :returns: A :class:`concurrent.futures.ThreadPoolExecutor` object with
+              :data:`DEFAULT_MAX_WORKERS` threads (created on the first call).
+    """
+    global shared_executor
+    with shared_executor_lock:
+        if shared_executor is None:
+            shared_executor = concurrent.futures.ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS)
+        return shared_executor
+
+
+class AsyncRepository(PropertyManager):
+
+    """
+    Awaitable counterpart of :class:`~vcs_repo_mgr.Repository`.
+
+    Operations on a single repository are serialized using :attr:`lock`
+    (because repository objects aren't meant to be used from multiple
+    threads at the same time) while operations on different repositories
+    run concurrently.
+    """
+
+    def __init__(self, repository, **options):
+        """
+        Initialize an :class:`AsyncRepository` object.
+
+        :param repository: A :class:`~vcs_repo_mgr.Repository` object or a
+                           value accepted by :func:`~vcs_repo_mgr.coerce_repository()`.
+        :param options: Any keyword arguments are used to set the values of
+                        the properties of the :class:`AsyncRepository` object.
+        """
+        super(AsyncRepository, self).__init__(repository=coerce_repository(repository), **options)
+
+    @property
+    def branches(self):
+        """An awaitable that returns :attr:`.Repository.branches`."""
+        return self.call(lambda: self.repository.branches)
+
+    @mutable_property(cached=True, repr=False)
+    def executor(self):
+        """
+        The :class:`concurrent.futures.Executor` used to run synchronous code.
+
+        Defaults to the thread pool returned by :func:`get_shared_executor()`.
+        Set this to :data:`None` to use the default executor of the event loop.
+        """
+        return get_shared_executor()
+
+    @lazy_property(repr=False)
+    def lock(self):
+        """A :class:`threading.RLock` object that serializes operations on :attr:`repository`."""
+        return threading.RLock()
+
+    @property
+    def releases(self):
+        """An awaitable that returns :attr:`.Repository.releases`."""
+        return self.call(lambda: self.repository.releases)
+
+    @required_property
+    def repository(self):
+        """The :class:`~vcs_repo_mgr.Repository` object that is wrapped."""
+
+    @property
+    def tags(self):
+        """An awaitable that returns :attr:`.Repository.tags`."""
+        return self.call(lambda: self.repository.tags)
+
+    def call(self, function, *args, **kw):
+        """
+        Run a synchronous function in the thread pool given by :attr:`executor`.
+
+        :param function: The function to call.
+        :param args: Any positional arguments are passed on to the function.
+        :param kw: Any keyword arguments are passed on to the function.
+        :returns: An :class:`asyncio.Future` object that resolves to the
+                  return value of the function.
+
+        The function is called while holding :attr:`lock`.
+        """
+        def locked_call():
+            with self.lock:
+                return function(*args, **kw)
+        return asyncio.get_event_loop().run_in_executor(self.executor, locked_call)
+
+    def create(self):
+        """Awaitable version of :func:`.Repository.create()`."""
+        return self.call(self.repository.create)
+
+    def find_revision_id(self, revision=None):
+        """Awaitable version of :func:`.Repository.find_revision_id()`."""
+        return self.call(self.repository.find_revision_id, revision)
+
+    def find_revision_number(self, revision=None):
+        """Awaitable version of :func:`.Repository.find_revision_number()`."""
+        return self.call(self.repository.find_revision_number, revision)
+
+    def pull(self, remote=None, revision=None):
+        """Awaitable version of :func:`.Repository.pull()`."""
+        return self.call(self.repository.pull, remote=remote, revision=revision)
+
+    def push(self, remote=None, revision=None):
+        """Awaitable version of :func:`.Repository.push()`."""
+        return self.call(self.repository.push, remote=remote, revision=revision)
@@ -0,0 +1,487 @@
+# Version control system repository manager.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/xolox/python-vcs-repo-mgr
+
+"""
+Extract tar archives that are streamed from version control commands.
+
+The version control systems supported by `vcs-repo-mgr` can all write a tar
+archive of a revision to their standard output stream (see
+:func:`.Repository.get_archive_command()`). The :class:`ArchiveExtractor`
+class reads such a stream using :mod:`tarfile` in stream mode and writes the
+files directly into the target directory, which avoids a shell pipeline and
+an external ``tar`` process.
+
+Trees with many small files spend most of their time creating files, so the
+contents of small files are handed to a pool of threads that write them to
+disk while the archive is being read. The number of pending files is bounded,
+so memory usage doesn't depend on the size of the tree.
+
+The :class:`ArchiveStream` class makes the archive written by a version
+control command available as a readable file-like object, for callers that
+want to store or upload an archive instead of extracting it (see
+:func:`.Repository.export_stream()`).
+
+The :class:`ParallelCompressor` class compresses such a stream using multiple
+threads, for compressed archives of large trees (see
+:func:`.Repository.export_archive()`).
+"""
+
+# Standard library modules.
+import errno
+import functools
+import io
+import logging
+import os
+import tarfile
+import threading
+import zlib
+
+# External dependencies.
+from property_manager import PropertyManager, lazy_property, mutable_property, required_property
+from six.moves import queue
+
+# Modules included in our package.
+from vcs_repo_mgr import DEFAULT_CONCURRENCY
+
+# Public identifiers that require documentation.
+__all__ = (
+    'ARCHIVE_EXTENSIONS',
+    'ArchiveExtractor',
+    'ArchiveStream',
+    'CHUNK_SIZE',
+    'COMPRESSED_FORMATS',
+    'CompressionJob',
+    'ParallelCompressor',
+    'SMALL_FILE_SIZE',
+    'find_archive_format',
+)
+
+ARCHIVE_EXTENSIONS = (
+    ('.tar', 'tar'),
+    ('.tar.gz', 'tar.gz'),
+    ('.tgz', 'tar.gz'),
+    ('.tar.xz', 'tar.xz'),
+    ('.txz', 'tar.xz'),
+    ('.zip', 'zip'),
+)
+"""Filename extensions and the corresponding archive formats (a tuple of tuples with two strings)."""
+
+CHUNK_SIZE = 1024 * 64
+"""The number of bytes copied at a time when extracting large files (an integer)."""
+
+COMPRESSED_FORMATS = {'tar.gz': 'gz', 'tar.xz': 'xz'}
+"""A dictionary that maps compressed archive formats to the compression used by :class:`ParallelCompressor`."""
+
+SMALL_FILE_SIZE = 1024 * 256
+"""Files up to this size (in bytes) are written by the threads of :class:`ArchiveExtractor` (an integer)."""
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+
+def find_archive_format(filename):
+    """
+    Find the archive format that matches the extension of a filename.
+
+    :param filename: The filename of an archive (a string).
+    :returns: An archive format (a string, see :data:`ARCHIVE_EXTENSIONS`).
+    :raises: :exc:`~exceptions.ValueError` when the extension isn't recognized.
+    """
+    for extension, format in ARCHIVE_EXTENSIONS:
+        if filename.lower().endswith(extension):
+            return format
+    supported = ', '.join(extension for extension, format in ARCHIVE_EXTENSIONS)
+    raise ValueError("Unsupported archive filename extension! (%r, supported are %s)" % (filename, supported))
+
+
+class ArchiveExtractor(PropertyManager):
+
+    """Extract a tar archive from a (non-seekable) stream into a directory."""
+
+    @mutable_property
+    def concurrency(self):
+        """The number of threads that write small files (an integer, defaults to :data:`.DEFAULT_CONCURRENCY`)."""
+        return DEFAULT_CONCURRENCY
+
+    @required_property
+    def directory(self):
+        """The absolute pathname of the directory where the archive is extracted (a string)."""
+
+    @mutable_property
+    def num_bytes(self):
+        """The number of bytes in the files that have been extracted so far (an integer)."""
+        return 0
+
+    @mutable_property
+    def num_files(self):
+        """The number of files that have been extracted so far (an integer)."""
+        return 0
+
+    @mutable_property
+    def progress(self):
+        """
+        A callable that's called for each extracted archive member (or :data:`None`).
+
+        The callable is given a :class:`tarfile.TarInfo` object. It's called
+        by the thread that reads the archive, before small files have
+        necessarily been written to disk.
+        """
+
+    @lazy_property(repr=False)
+    def errors(self):
+        """A list with the exceptions raised by the threads that write files."""
+        return []
+
+    @lazy_property(repr=False)
+    def pending(self):
+        """A bounded :class:`~six.moves.queue.Queue` of files waiting to be written."""
+        return queue.Queue(maxsize=self.concurrency * 8)
+
+    def extract(self, stream):
+        """
+        Extract the archive read from the given stream.
+
+        :param stream: A file-like object from which a tar archive is read.
+        :raises: Any exceptions raised while reading the archive or writing
+                 files (when multiple files can't be written the first
+                 exception is re-raised).
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        threads = [threading.Thread(target=self.worker) for i in range(max(1, self.concurrency))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            # TarFile objects aren't context managers on Python 2.6.
+            archive = tarfile.open(fileobj=stream, mode='r|')
+            try:
+                for member in archive:
+                    if self.errors:
+                        break
+                    self.extract_member(archive, member)
+            finally:
+                archive.close()
+        finally:
+            for thread in threads:
+                self.pending.put(None)
+            for thread in threads:
+                thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+    def extract_member(self, archive, member):
+        """
+        Extract a single member of the archive.
+
+        :param archive: The :class:`tarfile.TarFile` object.
+        :param member: A :class:`tarfile.TarInfo` object.
+        """
+        pathname = self.get_target(member.name)
+        if member.isdir():
+            if not os.path.isdir(pathname):
+                os.makedirs(pathname)
+        elif member.isfile():
+            self.prepare_target(pathname)
+            if member.size <= SMALL_FILE_SIZE:
+                self.pending.put((pathname, member, archive.extractfile(member).read()))
+            else:
+                handle = archive.extractfile(member)
+                self.write_file(pathname, member, iter(lambda: handle.read(CHUNK_SIZE), b''))
+            self.num_files += 1
+            self.num_bytes += member.size
+        elif member.issym():
+            self.prepare_target(pathname)
+            os.symlink(member.linkname, pathname)
+        else:
+            logger.warning("Skipping unsupported archive member: %s", member.name)
+            return
+        if self.progress is not None:
+            self.progress(member)
+
+    def get_target(self, name):
+        """
+        Get the pathname where an archive member should be extracted.
+
+        :param name: The name of the archive member (a string).
+        :returns: An absolute pathname inside :attr:`directory` (a string).
+        :raises: :exc:`~exceptions.ValueError` when the name is absolute or
+                 refers to a location outside of :attr:`directory` (also
+                 when one of the parent directories of the member is a
+                 symbolic link that points outside of :attr:`directory`).
+        """
+        pathname = os.path.normpath(os.path.join(self.directory, name))
+        if os.path.isabs(name) or not self.is_inside(pathname, self.directory):
+            raise ValueError("Refusing to extract archive member outside of target directory! (%r)" % name)
+        # Refuse to write through symbolic links (for example extracted from
+        # an earlier archive member) that point outside of the directory.
+        if pathname != self.directory:
+            parent = os.path.realpath(os.path.dirname(pathname))
+            if not self.is_inside(parent, os.path.realpath(self.directory)):
+                raise ValueError("Refusing to extract archive member through symbolic link! (%r)" % name)
+        return pathname
+
+    def is_inside(self, pathname, directory):
+        """Check whether a normalized pathname is (inside) the given directory."""
+        return pathname == directory or pathname.startswith(directory.rstrip(os.sep) + os.sep)
+
+    def prepare_target(self, pathname):
+        """Create the parent directory of a file and remove an existing file (if any)."""
+        parent = os.path.dirname(pathname)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        try:
+            os.unlink(pathname)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def worker(self):
+        """Write the files in :attr:`pending` until :data:`None` is received."""
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            pathname, member, data = item
+            try:
+                self.write_file(pathname, member, [data])
+            except Exception as e:
+                self.errors.append(e)
+
+    def write_file(self, pathname, member, chunks):
+        """
+        Write a regular file.
+
+        :param pathname: The pathname of the file (a string).
+        :param member: The :class:`tarfile.TarInfo` object of the file.
+        :param chunks: An iterable of byte strings with the contents of the file.
+
+        The permissions of the file are taken from the archive (subject to the
+        umask) and the modification time of the file is set to the value in
+        the archive.
+        """
+        fd = os.open(pathname, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, member.mode & 0o7777)
+        with os.fdopen(fd, 'wb') as handle:
+            for chunk in chunks:
+                handle.write(chunk)
+        os.utime(pathname, (member.mtime, member.mtime))
+
+
+class ArchiveStream(io.RawIOBase):
+
+    """
+    A readable file-like object backed by the standard output of a command.
+
+    The command is started by :func:`.Repository.export_stream()` and this
+    class takes ownership of it: When the stream is closed after all output
+    has been read the exit status of the command is checked, when the stream
+    is closed before that the command is killed. Use the stream as a context
+    manager to make sure it's closed.
+    """
+
+    def __init__(self, process):
+        """
+        Initialize an :class:`ArchiveStream` object.
+
+        :param process: An asynchronous :class:`~executor.ExternalCommand`
+                        object whose standard output is captured (unbuffered).
+        """
+        super(ArchiveStream, self).__init__()
+        self.process = process
+        self.exhausted = False
+
+    def close(self):
+        """
+        Close the stream and clean up the command.
+
+        :raises: :exc:`~executor.ExternalCommandFailed` when all output was
+                 read and the command exited with a nonzero status code.
+        """
+        if not self.closed:
+            super(ArchiveStream, self).close()
+            if self.exhausted:
+                self.process.wait()
+            else:
+                self.process.kill()
+                self.process.wait(check=False)
+
+    def readable(self):
+        """:data:`True` because :class:`ArchiveStream` objects are readable."""
+        return True
+
+    def readinto(self, buffer):
+        """
+        Read bytes from the command into a pre-allocated buffer.
+
+        :param buffer: A writable buffer (like a :class:`bytearray`).
+        :returns: The number of bytes read (an integer, zero at the end of the archive).
+        """
+        data = self.process.stdout.read(len(buffer))
+        if not data:
+            self.exhausted = True
+            return 0
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class ParallelCompressor(PropertyManager):
+
+    """
+    Compress a stream in independent blocks using multiple threads.
+
+    Each block is compressed into a complete gzip member or xz stream.
+    Concatenated members and streams are part of the gzip and xz file
+    formats, so the output can be decompressed by the standard ``gzip`` and
+    ``xz`` programs and by Python's :mod:`gzip`, :mod:`tarfile` and
+    :mod:`lzma` modules. Because :mod:`zlib` and :mod:`lzma` release the
+    global interpreter lock while compressing, the blocks are really
+    compressed in parallel. The number of blocks in flight is bounded, so
+    memory usage doesn't depend on the size of the input.
+    """
+
+    @mutable_property
+    def block_size(self):
+        """The size of the uncompressed blocks in bytes (an integer, defaults to 1 MiB)."""
+        return 1024 * 1024
+
+    @required_property
+    def compression(self):
+        """The compression to use (a string, one of the values in :data:`COMPRESSED_FORMATS`)."""
+
+    @mutable_property
+    def concurrency(self):
+        """The number of threads that compress blocks (an integer, defaults to :data:`.DEFAULT_CONCURRENCY`)."""
+        return DEFAULT_CONCURRENCY
+
+    @mutable_property
+    def level(self):
+        """The compression level (an integer between 0 and 9, defaults to 6)."""
+        return 6
+
+    def compress(self, stream, output):
+        """
+        Compress a stream.
+
+        :param stream: A binary file-like object from which the uncompressed
+                       data is read.
+        :param output: A binary file-like object to which the compressed
+                       data is written.
+        :returns: The number of compressed bytes written (an integer).
+        """
+        compress_block = self.get_compressor()
+        pending = queue.Queue()
+        ordered = []
+        num_bytes = 0
+
+        def worker():
+            while True:
+                job = pending.get()
+                if job is None:
+                    return
+                try:
+                    job.result = compress_block(job.data)
+                except Exception as e:
+                    job.error = e
+                job.data = None
+                job.event.set()
+
+        threads = [threading.Thread(target=worker) for i in range(max(1, self.concurrency))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            for data in iter(lambda: self.read_block(stream), b''):
+                job = CompressionJob(data)
+                pending.put(job)
+                ordered.append(job)
+                # Write finished blocks (in order) to bound memory usage.
+                while len(ordered) > len(threads) * 2 or (ordered and ordered[0].event.is_set()):
+                    num_bytes += self.write_block(ordered.pop(0), output)
+            while ordered:
+                num_bytes += self.write_block(ordered.pop(0), output)
+        finally:
+            for thread in threads:
+                pending.put(None)
+            for thread in threads:
+                thread.join()
+        return num_bytes
+
+    def get_compressor(self):
+        """
+        Get the function that compresses a single block.
+
+        :returns: A callable that takes and returns a byte string.
+        :raises: :exc:`~exceptions.ValueError` when :attr:`compression`
+                 isn't supported (the :mod:`lzma` module is required for
+                 ``xz`` compression).
+        """
+        level = self.level
+        if self.compression == 'gz':
+            def compress_block(data):
+                # A window size of 16 + 15 bits produces a gzip member.
+                compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                return compressor.compress(data) + compressor.flush()
+            return compress_block
+        elif self.compression == 'xz':
+            try:
+                import lzma
+            except ImportError:
+                raise ValueError("The 'lzma' module is required for xz compression!")
+            return functools.partial(lzma.compress, format=lzma.FORMAT_XZ, preset=level)
+        raise ValueError("Unsupported compression! (%r)" % self.compression)
+
+    def read_block(self, stream):
+        """
+        Read a block of uncompressed data.
+
+        :param stream: A binary file-like object.
+        :returns: A byte string of :attr:`block_size` bytes (shorter only at
+                  the end of the stream, empty when the stream is exhausted).
+
+        Raw streams (like pipes and :class:`ArchiveStream` objects) can return
+        fewer bytes than requested, so this method keeps reading until a full
+        block is available. Without this every short read would become a
+        separate gzip member or xz stream, which hurts the compression ratio.
+        """
+        chunks = []
+        remaining = self.block_size
+        while remaining > 0:
+            data = stream.read(remaining)
+            if not data:
+                break
+            chunks.append(data)
+            remaining -= len(data)
+        return b''.join(chunks)
+
+    def write_block(self, job, output):
+        """
+        Wait for a block to be compressed and write it.
+
+        :param job: A :class:`CompressionJob` object.
+        :param output: A binary file-like object.
+        :returns: The number of bytes written (an integer).
+        """
+        job.event.wait()
+        if job.error is not None:
+            raise job.error
+        output.write(job.result)
+        return len(job.result)
+
+
+class CompressionJob(object):
+
+    """A block of data that is being compressed by :class:`ParallelCompressor`."""
+
+    def __init__(self, data):
+        """
+        Initialize a :class:`CompressionJob` object.
+
+        :param data: The uncompressed data (a byte string).
+        """
+        self.data = data
+        self.error = None
+        self.event = threading.Event()
+        self.result = None
@@ -1,7 +1,7 @@
 # Version control system repository manager.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: March 5, 2018
+# Last Change: October 16, 2026
 # URL: https://github.com/xolox/python-vcs-repo-mgr
 
 """Support for Bazaar version control repositories."""
@@ -15,7 +15,7 @@ from humanfriendly.text import compact, is_empty_line
 from property_manager import required_property
 
 # Modules included in our package.
-from vcs_repo_mgr import Remote, Repository, Revision, coerce_author
+from vcs_repo_mgr import Remote, Repository, Revision, TreeEntry, coerce_author
 
 # Public identifiers that require documentation.
 __all__ = (
@@ -25,6 +25,9 @@ __all__ = (
 # Initialize a logger for this module.
 logger = logging.getLogger(__name__)
 
+# Mapping of vcs_repo_mgr.ARCHIVE_FORMATS to the values accepted by `bzr export --format'.
+ARCHIVE_TYPES = {'tar': 'tar', 'tar.gz': 'tgz', 'zip': 'zip'}
+
 
 class BzrRepo(Repository):
 
@@ -40,6 +43,16 @@ class BzrRepo(Repository):
         directory = cls.get_vcs_directory(context, directory)
         return context.is_file(os.path.join(directory, 'branch-format'))
 
+    @classmethod
+    def contains_repository_entries(cls, entries):
+        """
+        Check whether the entries in a directory identify a Bazaar repository.
+
+        A ``.bzr`` entry isn't conclusive (:func:`contains_repository()`
+        checks for the ``.bzr/branch-format`` file).
+        """
+        return None if '.bzr' in entries else False
+
     @staticmethod
     def get_vcs_directory(context, directory):
         """Get the pathname of the directory containing the version control metadata files."""
@@ -119,6 +132,34 @@ class BzrRepo(Repository):
 
     # Instance methods.
 
+    def count_revisions_in_bulk(self, revision_ids):
+        """
+        Find the revision numbers of multiple revisions using a single ``bzr revision-info`` command.
+
+        :param revision_ids: A list of global revision ids (strings).
+        :returns: A dictionary that maps revision ids to revision numbers.
+
+        For revisions on the mainline the revision number reported by ``bzr
+        revision-info`` is the same as the number of revisions counted by
+        :func:`count_revisions()`. Merged revisions have dotted revision
+        numbers, those are counted one by one.
+        """
+        revision_ids = list(revision_ids)
+        revision_numbers = {}
+        if revision_ids:
+            arguments = ['bzr', 'revision-info']
+            arguments.extend('revid:%s' % r for r in revision_ids)
+            listing = self.context.capture(*arguments, check=False, silent=True)
+            for line in listing.splitlines():
+                tokens = line.split()
+                if len(tokens) == 2 and tokens[0].isdigit() and tokens[1] in revision_ids:
+                    revision_numbers[tokens[1]] = int(tokens[0])
+            for revision_id in revision_ids:
+                if revision_id not in revision_numbers:
+                    revision_numbers[revision_id] = self.count_revisions(revision_id)
+            self.store_revision_numbers(revision_numbers)
+        return revision_numbers
+
     def find_author(self):
         """Get the author information from the version control system."""
         return coerce_author(self.context.capture('bzr', 'whoami'))
@@ -150,6 +191,29 @@ class BzrRepo(Repository):
             raise ValueError(msg)
         return output
 
+    def find_revisions(self, references):
+        """
+        Find the global revision ids and numbers of multiple revisions using a single ``bzr revision-info`` command.
+
+        :param references: A list of revision references (strings).
+        :returns: A list of :class:`.Revision` objects.
+
+        ``bzr version-info`` only accepts a single revision, which is why
+        ``bzr revision-info`` is used instead. Dotted revision numbers of
+        merged revisions are computed on demand.
+        """
+        self.create()
+        listing = self.context.capture('bzr', 'revision-info', *references)
+        tokens = [line.split() for line in listing.splitlines() if len(line.split()) == 2]
+        if len(tokens) != len(references):
+            msg = "Failed to find global revision ids! ('bzr revision-info' gave unexpected output)"
+            raise ValueError(msg)
+        return self.create_revisions(
+            references,
+            [revision_id for revision_number, revision_id in tokens],
+            [int(revision_number) if revision_number.isdigit() else None for revision_number, revision_id in tokens],
+        )
+
     def find_revision_number(self, revision=None):
         """
         Find the local revision number of the given revision.
@@ -177,6 +241,19 @@ class BzrRepo(Repository):
         self.create()
         # Try to find the revision number of the specified revision.
         revision = revision or self.default_revision
+        return self.lookup_revision_number(revision, self.count_revisions)
+
+    def count_revisions(self, revision):
+        """
+        Count the mainline revisions leading up to the given revision.
+
+        :param revision: A reference to a revision (a string).
+        :returns: The number of revisions (an integer).
+
+        This runs ``bzr log --line`` which needs to traverse the history of
+        the revision, refer to :func:`find_revision_number()` for a version
+        that can use the persistent store.
+        """
         output = self.context.capture('bzr', 'log', '--revision=..%s' % revision, '--line')
         revision_number = len([line for line in output.splitlines() if not is_empty_line(line)])
         if not (revision_number > 0):
@@ -212,6 +289,30 @@ class BzrRepo(Repository):
                     tag=tokens[0],
                 )
 
+    def list_files(self, revision=None, prefix=None):
+        """
+        List the files in the tree of a revision (using ``bzr ls --recursive``).
+
+        Bazaar doesn't report file modes or content ids, so the
+        :attr:`~vcs_repo_mgr.TreeEntry.mode` and
+        :attr:`~vcs_repo_mgr.TreeEntry.object_id` fields are :data:`None`.
+        """
+        self.create()
+        revision = revision or self.default_revision
+        command = ['bzr', 'ls', '--recursive', '--versioned', '--kind=file', '--null', '--revision=%s' % revision]
+        if prefix:
+            command.append(prefix.strip('/'))
+        for path in self.iter_output(command, delimiter=b'\0'):
+            yield TreeEntry(path=path, mode=None, object_id=None)
+
+    def read_files(self, requests):
+        """Read files at revisions using ``bzr cat``."""
+        for revision, path in requests:
+            command = self.context.prepare('bzr', 'cat', '--revision=%s' % revision, path,
+                                           capture=True, check=False, silent=True)
+            command.wait()
+            yield command.stdout if command.returncode == 0 else None
+
     def get_add_files_command(self, *filenames):
         """Get the command to include added and/or removed files in the working tree in the next commit."""
         command = ['bzr', 'add']
@@ -241,6 +342,12 @@ class BzrRepo(Repository):
         """Get the command to create a new tag based on the working tree's revision."""
         return ['bzr', 'tag', tag_name]
 
+    def get_archive_command(self, revision, paths=None, format='tar'):
+        """Get the command to write an archive of a revision to standard output."""
+        if paths:
+            raise NotImplementedError("Bazaar repository support doesn't include archives of specific files!")
+        return ['bzr', 'export', '--format=%s' % ARCHIVE_TYPES[format], '--root=', '--revision=%s' % revision, '-']
+
     def get_export_command(self, directory, revision):
         """Get the command to export the complete tree from the local repository."""
         return ['bzr', 'export', '--revision=%s' % revision, directory]
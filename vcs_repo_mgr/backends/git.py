@@ -1,33 +1,61 @@
 # Version control system repository manager.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: March 8, 2018
+# Last Change: October 16, 2026
 # URL: https://github.com/xolox/python-vcs-repo-mgr
 
 """Support for git version control repositories."""
 
 # Standard library modules.
+import array
+import binascii
+import heapq
 import logging
+import mmap
 import os
 import re
+import struct
 
 # External dependencies.
-from executor import quote
-from humanfriendly import coerce_boolean
+from executor import ExternalCommandFailed, quote
+from executor.contexts import LocalContext
+from humanfriendly import coerce_boolean, format_path
 from humanfriendly.text import split
-from property_manager import required_property
+from property_manager import PropertyManager, lazy_property, mutable_property, required_property
 
 # Modules included in our package.
-from vcs_repo_mgr import Author, Remote, Repository, Revision
+from vcs_repo_mgr import HEX_PATTERN, Author, Remote, Repository, Revision, TreeEntry
+from vcs_repo_mgr.helpers import HelperProcess
 
 # Public identifiers that require documentation.
 __all__ = (
+    'BULK_COUNT_THRESHOLD',
+    'BlobReader',
+    'CatFileHelper',
+    'CommitGraph',
     'GitRepo',
+    'is_full_revision_id',
+    'read_ref_storage',
 )
 
 # Initialize a logger for this module.
 logger = logging.getLogger(__name__)
 
+BULK_COUNT_THRESHOLD = 3
+"""
+The minimum number of commits counted using a single history traversal (an integer).
+
+Fewer commits are counted one by one by :func:`GitRepo.count_revisions()`
+because ``git rev-list --count`` is faster than the traversal implemented
+by :func:`GitRepo.count_revisions_in_bulk()`.
+"""
+
+# Constants used in the `Commit Data' chunk of commit-graph files.
+GRAPH_PARENT_NONE = 0x70000000
+GRAPH_EXTRA_EDGES_NEEDED = 0x80000000
+GRAPH_LAST_EDGE = 0x80000000
+GRAPH_EDGE_LAST_MASK = 0x7FFFFFFF
+
 # A compiled regular expression pattern to parse the output of the
 # 'git for-each-ref --format=%(refname)\t%(objectname)' command.
 FOR_EACH_REF_PATTERN = re.compile(r'''
@@ -51,6 +79,18 @@ class GitRepo(Repository):
         directory = cls.get_vcs_directory(context, directory)
         return context.is_file(os.path.join(directory, 'config'))
 
+    @classmethod
+    def contains_repository_entries(cls, entries):
+        """
+        Check whether the entries in a directory identify a (bare) git repository.
+
+        A ``.git`` entry isn't conclusive (:func:`contains_repository()`
+        checks for the ``.git/config`` file).
+        """
+        if all(name in entries for name in ('HEAD', 'config', 'objects', 'refs')):
+            return True
+        return None if '.git' in entries else False
+
     @staticmethod
     def get_vcs_directory(context, directory):
         """Get the pathname of the directory containing the version control metadata files."""
@@ -59,6 +99,46 @@ class GitRepo(Repository):
 
     # Instance properties.
 
+    @property
+    def commit_graph(self):
+        """
+        A :class:`CommitGraph` object for the local repository (or :data:`None`).
+
+        This is :data:`None` unless :attr:`use_commit_graph` is :data:`True`,
+        the repository is accessed using :class:`~executor.contexts.LocalContext`
+        and the commit-graph file exists. A new :class:`CommitGraph` object
+        is created when the commit-graph file is replaced.
+
+        When the commit-graph file uses an unsupported format (for example a
+        newer version written by a future release of git) or is corrupt this
+        is also :data:`None`, so that ``git rev-list`` is used instead.
+        """
+        if self.use_commit_graph and isinstance(self.context, LocalContext):
+            filename = os.path.join(self.local_git_directory, 'objects', 'info', 'commit-graph')
+            try:
+                metadata = os.stat(filename)
+            except EnvironmentError:
+                return None
+            fingerprint = (metadata.st_ino, metadata.st_size, metadata.st_mtime)
+            graph, previous_fingerprint = self.commit_graph_state or (None, None)
+            if fingerprint != previous_fingerprint:
+                if graph is not None:
+                    graph.close()
+                graph = CommitGraph(filename=filename)
+                try:
+                    # Validate the header and chunk table up front.
+                    graph.commit_count
+                except (EnvironmentError, ValueError, struct.error) as e:
+                    logger.debug("Ignoring unusable commit-graph file %s! (%s)", format_path(filename), e)
+                    graph.close()
+                    graph = None
+                self.commit_graph_state = (graph, fingerprint)
+            return graph
+
+    @mutable_property(repr=False)
+    def commit_graph_state(self):
+        """The current :attr:`commit_graph` and the fingerprint of its file (a tuple or :data:`None`)."""
+
     @required_property
     def control_field(self):
         """The name of the Debian control file field for git repositories (the string 'Vcs-Git')."""
@@ -67,6 +147,24 @@ class GitRepo(Repository):
     @property
     def current_branch(self):
         """The name of the branch that's currently checked out in the working tree (a string or :data:`None`)."""
+        storage = self.read_refs()
+        if storage:
+            refs, head = storage
+            if not head.startswith('ref: '):
+                # HEAD is detached.
+                return None
+            target = head[len('ref: '):]
+            if target.startswith('refs/heads/'):
+                name = target[len('refs/heads/'):]
+                if target not in refs:
+                    # The branch is unborn (it doesn't have any commits yet).
+                    return None
+                # When the branch name is ambiguous `git rev-parse' reports a
+                # longer name (like `heads/NAME'), we leave that up to git.
+                ambiguous = ('refs/%s' % name, 'refs/tags/%s' % name,
+                             'refs/remotes/%s' % name, 'refs/remotes/%s/HEAD' % name)
+                if not any(r in refs for r in ambiguous):
+                    return name
         output = self.context.capture('git', 'rev-parse', '--abbrev-ref', 'HEAD', check=False, silent=True)
         return output if output != 'HEAD' else None
 
@@ -142,6 +240,19 @@ class GitRepo(Repository):
                 ))
         return objects
 
+    @property
+    def local_git_directory(self):
+        """
+        The pathname of the git directory of the local repository (a string).
+
+        This is the same as :attr:`~.Repository.vcs_directory` except that it
+        checks the local filesystem directly instead of running an external
+        command, so it's only meaningful for repositories that are accessed
+        using :class:`~executor.contexts.LocalContext`.
+        """
+        nested = os.path.join(self.local, '.git')
+        return nested if os.path.isdir(nested) else self.local
+
     @property
     def merge_conflicts(self):
         """The filenames of any files with merge conflicts (a list of strings)."""
@@ -157,13 +268,141 @@ class GitRepo(Repository):
                 filenames.add(name)
         return sorted(filenames)
 
+    @mutable_property
+    def native_refs(self):
+        """
+        :data:`True` to read refs directly from the git directory, :data:`False` to run git commands.
+
+        When this is :data:`True` (the default for repositories that are
+        accessed using :class:`~executor.contexts.LocalContext`)
+        :func:`find_branches_raw()`, :func:`find_tags()` and
+        :attr:`current_branch` read the ``HEAD`` file, the ``packed-refs``
+        file and the loose refs in the ``refs`` directory instead of running
+        ``git for-each-ref``, ``git show-ref`` and ``git rev-parse``. When the
+        repository uses a ref storage format that isn't supported (like
+        reftable) regular git commands are used instead (see
+        :func:`read_ref_storage()` for details).
+        """
+        return isinstance(self.context, LocalContext)
+
+    @property
+    def ref_files(self):
+        """The pathnames of the ``packed-refs`` file and the ``refs`` directory (a list of strings)."""
+        directory = self.local_git_directory
+        return [os.path.join(directory, 'packed-refs'), os.path.join(directory, 'refs')]
+
     @property
     def supports_working_tree(self):
         """The opposite of :attr:`bare` (a boolean)."""
         return not self.is_bare
 
+    @mutable_property
+    def use_commit_graph(self):
+        """
+        :data:`True` to maintain and use git's commit-graph file, :data:`False` (the default) otherwise.
+
+        When this is :data:`True` :func:`create()` and :func:`pull()` make sure
+        that the commit-graph file is up to date (see
+        :func:`update_commit_graph()`) and :func:`count_revisions()` and
+        :func:`count_revisions_in_bulk()` count ancestors using
+        :attr:`commit_graph` instead of running ``git rev-list``. Revisions
+        that aren't included in the commit-graph file (for example because
+        they were committed after the last update) are counted using ``git
+        rev-list`` so the results are always the same.
+        """
+        return False
+
     # Instance methods.
 
+    def count_revisions_in_bulk(self, revision_ids):
+        """
+        Find the revision numbers of multiple revisions using a single history traversal.
+
+        :param revision_ids: A list of global revision ids (strings).
+        :returns: A dictionary that maps revision ids to revision numbers.
+
+        Instead of running ``git rev-list --count`` once per revision this
+        runs ``git rev-list --topo-order --parents`` once for all revisions.
+        Each revision is assigned a bit in an integer bit mask and the masks
+        are propagated from children to parents (the topological order
+        guarantees that a commit is only reported after all of its children),
+        which means the mask of each commit ends up identifying the revisions
+        that it's an ancestor of. Commits with identical masks are counted
+        together so that the final tally stays cheap. The output of ``git
+        rev-list`` is streamed (see :func:`~.Repository.iter_output()`) so
+        memory usage doesn't depend on the size of the history. When fewer
+        than :data:`BULK_COUNT_THRESHOLD` commits need to be counted they are
+        counted one by one using :func:`count_revisions()` instead.
+        """
+        revision_ids = list(revision_ids)
+        if not revision_ids:
+            return {}
+        # Tags can refer to tag objects, so we peel those to commits.
+        listing = self.context.capture(
+            'git', 'cat-file', '--batch-check=%(objectname)',
+            input=''.join('%s^{commit}\n' % r for r in revision_ids),
+        )
+        commits = listing.splitlines()
+        revision_numbers = {}
+        if len(commits) == len(revision_ids):
+            targets = dict((r, c) for r, c in zip(revision_ids, commits) if HEX_PATTERN.match(c))
+            counts_by_commit = {}
+            # Use the commit-graph file when it's available.
+            graph = self.commit_graph
+            if graph:
+                for commit in set(targets.values()):
+                    count = graph.count_ancestors(commit)
+                    if count is not None:
+                        counts_by_commit[commit] = count
+            unique_commits = sorted(set(targets.values()) - set(counts_by_commit))
+            if 0 < len(unique_commits) < BULK_COUNT_THRESHOLD:
+                for commit in unique_commits:
+                    counts_by_commit[commit] = self.count_revisions(commit)
+            elif unique_commits:
+                masks = dict((c, 1 << i) for i, c in enumerate(unique_commits))
+                groups = {}
+                for line in self.iter_output(
+                    ['git', 'rev-list', '--topo-order', '--parents', '--stdin'],
+                    input=''.join('%s\n' % c for c in unique_commits),
+                ):
+                    tokens = line.split()
+                    if tokens:
+                        mask = masks.pop(tokens[0], 0)
+                        groups[mask] = groups.get(mask, 0) + 1
+                        for parent in tokens[1:]:
+                            masks[parent] = masks.get(parent, 0) | mask
+                counts = [0] * len(unique_commits)
+                for mask, count in groups.items():
+                    while mask:
+                        lowest = mask & -mask
+                        counts[len(bin(lowest)) - 3] += count
+                        mask ^= lowest
+                counts_by_commit.update(zip(unique_commits, counts))
+            for revision_id, commit in targets.items():
+                revision_numbers[revision_id] = counts_by_commit[commit]
+        # Revisions that couldn't be resolved are handled one by one
+        # so that errors are reported in the usual way.
+        for revision_id in revision_ids:
+            if revision_id not in revision_numbers:
+                revision_numbers[revision_id] = self.count_revisions(revision_id)
+        self.store_revision_numbers(dict((r, n) for r, n in revision_numbers.items()
+                                         if self.is_immutable_revision_id(r)))
+        return revision_numbers
+
+    def create_helper(self, name):
+        """
+        Create a long running helper process.
+
+        :param name: The name of the helper process (a string).
+        :returns: A :class:`CatFileHelper` object when `name` is the string
+                  'cat-file', a :class:`BlobReader` object when `name` is the
+                  string 'cat-file-batch', otherwise :data:`None`.
+        """
+        if name == 'cat-file':
+            return CatFileHelper(context=self.context)
+        elif name == 'cat-file-batch':
+            return BlobReader(context=self.context)
+
     def expand_branch_name(self, name):
         """
         Expand branch names to their unambiguous form.
@@ -179,6 +418,16 @@ class GitRepo(Repository):
         # If no name is given we pick the default revision.
         if not name:
             return self.default_revision
+        # When the `git cat-file' helper is available we can recognize local
+        # branches and full revision ids without running `git for-each-ref'.
+        helper = self.get_helper('cat-file')
+        if helper:
+            if is_full_revision_id(name):
+                logger.debug("Branch name %r is a full revision id.", name)
+                return name
+            if helper.resolve('refs/heads/%s' % name):
+                logger.debug("Branch name %r matches local branch.", name)
+                return name
         # Run `git for-each-ref' once and remember the results.
         branches = list(self.find_branches_raw())
         # Check for an exact match against a local branch.
@@ -221,7 +470,12 @@ class GitRepo(Repository):
 
     def find_branches_raw(self):
         """Find information about the branches in the repository."""
-        listing = self.context.capture('git', 'for-each-ref', '--format=%(refname)\t%(objectname)')
+        storage = self.read_refs()
+        if storage:
+            refs, head = storage
+            listing = '\n'.join('%s\t%s' % (name, refs[name]) for name in sorted(refs))
+        else:
+            listing = self.context.capture('git', 'for-each-ref', '--format=%(refname)\t%(objectname)')
         for line in listing.splitlines():
             match = FOR_EACH_REF_PATTERN.match(line)
             if match and match.group('name') != 'HEAD':
@@ -229,22 +483,82 @@ class GitRepo(Repository):
                        match.group('name'),
                        match.group('revision_id'))
 
+    def find_changed_files(self, old_revision, new_revision):
+        """Find the files that changed between two revisions (using ``git diff --name-status``)."""
+        listing = self.context.capture('git', 'diff', '--name-status', '--no-renames', '-z',
+                                       old_revision, new_revision, silent=True)
+        tokens = listing.split('\0')
+        changed_files, deleted_files = [], []
+        for status, filename in zip(tokens[0::2], tokens[1::2]):
+            (deleted_files if status == 'D' else changed_files).append(filename)
+        return changed_files, deleted_files
+
     def find_revision_id(self, revision=None):
         """Find the global revision id of the given revision."""
         # Make sure the local repository exists.
         self.create()
         # Try to find the revision id of the specified revision.
         revision = self.expand_branch_name(revision)
+        helper = self.get_helper('cat-file')
+        if helper:
+            revision_id = helper.resolve(revision)
+            if revision_id:
+                return revision_id
+            # When the helper fails to resolve the revision we fall back to
+            # `git rev-parse' in order to report the error in the usual way.
         output = self.context.capture('git', 'rev-parse', revision)
         # Validate the `git rev-parse' output.
         return self.ensure_hexadecimal_string(output, 'git rev-parse')
 
+    def find_revisions(self, references):
+        """
+        Find the global revision ids of multiple revisions using a single ``git rev-parse`` command.
+
+        :param references: A list of revision references (strings).
+        :returns: A list of :class:`.Revision` objects.
+        """
+        self.create()
+        if self.get_helper('cat-file'):
+            # The helper process answers queries without starting subprocesses.
+            return super(GitRepo, self).find_revisions(references)
+        expanded = [self.expand_branch_name(r) for r in references]
+        output = self.context.capture('git', 'rev-parse', *expanded)
+        revision_ids = output.split()
+        if len(revision_ids) != len(references):
+            msg = "Failed to find global revision ids! ('git rev-parse' gave unexpected output)"
+            raise ValueError(msg)
+        for revision_id in revision_ids:
+            self.ensure_hexadecimal_string(revision_id, 'git rev-parse')
+        return self.create_revisions(references, revision_ids)
+
     def find_revision_number(self, revision=None):
         """Find the local revision number of the given revision."""
         # Make sure the local repository exists.
         self.create()
         # Try to find the revision number of the specified revision.
         revision = self.expand_branch_name(revision)
+        return self.lookup_revision_number(revision, self.count_revisions)
+
+    def count_revisions(self, revision):
+        """
+        Count the revisions reachable from the given revision.
+
+        :param revision: A reference to a revision (a string).
+        :returns: The number of revisions (an integer).
+
+        This uses :attr:`commit_graph` when it's available, otherwise it runs
+        ``git rev-list --count`` which needs to traverse the history of the
+        revision. Refer to :func:`find_revision_number()` for a version that
+        can use the persistent store.
+        """
+        graph = self.commit_graph
+        if graph:
+            commit = revision if graph.find_position(revision) is not None else self.context.capture(
+                'git', 'rev-parse', '--quiet', '--verify', '%s^{commit}' % revision, check=False, silent=True,
+            )
+            count = graph.count_ancestors(commit) if commit else None
+            if count is not None:
+                return count
         output = self.context.capture('git', 'rev-list', revision, '--count')
         if not (output and output.isdigit()):
             msg = "Failed to find local revision number! ('git rev-list --count' gave unexpected output)"
@@ -253,7 +567,12 @@ class GitRepo(Repository):
 
     def find_tags(self):
         """Find information about the tags in the repository."""
-        listing = self.context.capture('git', 'show-ref', '--tags', check=False)
+        storage = self.read_refs()
+        if storage:
+            refs, head = storage
+            listing = '\n'.join('%s %s' % (refs[name], name) for name in sorted(refs))
+        else:
+            listing = self.context.capture('git', 'show-ref', '--tags', check=False)
         for line in listing.splitlines():
             tokens = line.split()
             if len(tokens) >= 2 and tokens[1].startswith('refs/tags/'):
@@ -263,6 +582,94 @@ class GitRepo(Repository):
                     tag=tokens[1][len('refs/tags/'):],
                 )
 
+    def find_tree_id(self, revision=None):
+        """Find the object id of the tree of the given revision."""
+        self.create()
+        revision = '%s^{tree}' % self.expand_branch_name(revision)
+        helper = self.get_helper('cat-file')
+        if helper:
+            tree_id = helper.resolve(revision)
+            if tree_id:
+                return tree_id
+        output = self.context.capture('git', 'rev-parse', revision)
+        return self.ensure_hexadecimal_string(output, 'git rev-parse')
+
+    def is_immutable_revision_id(self, revision):
+        """Check whether a revision reference is a full revision id (see :func:`is_full_revision_id()`)."""
+        return is_full_revision_id(revision)
+
+    def read_refs(self):
+        """
+        Read the refs in the repository without running any git commands.
+
+        :returns: The result of :func:`read_ref_storage()` or :data:`None`
+                  when :attr:`native_refs` is disabled, the ref storage
+                  format isn't supported or the refs can't be read.
+        """
+        if self.native_refs:
+            directory = self.local_git_directory
+            try:
+                storage = read_ref_storage(directory)
+                if storage is not None:
+                    return storage
+                logger.debug("Ref storage in %s not supported, falling back to git commands.", directory)
+            except EnvironmentError as e:
+                logger.debug("Failed to read refs in %s, falling back to git commands: %s", directory, e)
+
+    def list_files(self, revision=None, prefix=None):
+        """List the files in the tree of a revision (using ``git ls-tree -r -z``)."""
+        self.create()
+        command = ['git', 'ls-tree', '-r', '-z', '--full-tree', self.expand_branch_name(revision)]
+        if prefix:
+            command.extend(('--', ':(literal)%s/' % prefix.strip('/')))
+        for record in self.iter_output(command, delimiter=b'\0'):
+            # Records look like `MODE TYPE OBJECT<tab>PATH'.
+            metadata, _, path = record.partition('\t')
+            mode, object_type, object_id = metadata.split()
+            yield TreeEntry(path=path, mode=int(mode, 8), object_id=object_id)
+
+    def read_files(self, requests):
+        """Read files at revisions using a single ``git cat-file --batch`` process."""
+        with self.use_helper('cat-file-batch') as helper:
+            for revision, path in requests:
+                name = '%s:%s' % (self.expand_branch_name(revision), path)
+                if helper:
+                    yield helper.read_blob(name)
+                else:
+                    command = self.context.prepare('git', 'cat-file', 'blob', name,
+                                                   capture=True, check=False, silent=True)
+                    command.wait()
+                    yield command.stdout if command.returncode == 0 else None
+
+    def update_caches(self, changed=True):
+        """
+        Update cached information after the local repository was created or updated.
+
+        This extends :func:`.Repository.update_caches()` to update the
+        commit-graph file when :attr:`use_commit_graph` is enabled (and the
+        refs in the local repository changed or the commit-graph file is
+        missing).
+        """
+        super(GitRepo, self).update_caches(changed=changed)
+        if changed or not self.commit_graph:
+            self.update_commit_graph()
+
+    def update_commit_graph(self):
+        """
+        Write git's commit-graph file (if :attr:`use_commit_graph` is enabled).
+
+        This runs ``git commit-graph write --reachable`` which writes a single
+        (not split) commit-graph file containing all reachable commits.
+        Failures are logged but otherwise ignored, because the commit-graph
+        file is only an optimization.
+        """
+        if self.use_commit_graph:
+            logger.debug("Updating commit-graph file of %s ..", format_path(self.local))
+            try:
+                self.context.execute('git', 'commit-graph', 'write', '--reachable', '--no-progress', silent=True)
+            except ExternalCommandFailed as e:
+                logger.warning("Failed to update commit-graph file of %s! (%s)", format_path(self.local), e)
+
     def get_add_files_command(self, *filenames):
         """Get the command to include added and/or removed files in the working tree in the next commit."""
         command = ['git', 'add']
@@ -316,6 +723,14 @@ class GitRepo(Repository):
         """Get the command to delete or close a branch in the local repository."""
         return ['git', 'branch', '--delete', branch_name]
 
+    def get_archive_command(self, revision, paths=None, format='tar'):
+        """Get the command to write an archive of a revision to standard output."""
+        command = ['git', 'archive', '--format=%s' % format, revision]
+        if paths:
+            command.append('--')
+            command.extend(':(literal)%s' % p for p in paths)
+        return command
+
     def get_export_command(self, directory, revision):
         """Get the command to export the complete tree from the local repository."""
         shell_command = 'git archive %s | tar --extract --directory=%s'
@@ -381,3 +796,397 @@ class GitRepo(Repository):
             if revision:
                 command.append(revision)
         return command
+
+
+class BlobReader(HelperProcess):
+
+    """
+    Read the contents of files using a long running ``git cat-file --batch`` process.
+
+    The ``git cat-file --batch`` command reads object names (like
+    ``v1.0:setup.py``) from its standard input stream and writes the type,
+    size and contents of the corresponding objects to its standard output
+    stream. This enables :func:`GitRepo.read_files()` to read any number of
+    files (at any number of revisions) using a single process.
+    """
+
+    @property
+    def command(self):
+        """The command line of the helper process (a list of strings)."""
+        return ['git', 'cat-file', '--batch']
+
+    def read_blob(self, name):
+        """
+        Read the contents of a file.
+
+        :param name: The name of a blob, usually in the form ``REVISION:PATH`` (a string).
+        :returns: The contents of the blob (a byte string) or :data:`None`
+                  when the object doesn't exist or isn't a blob.
+        :raises: Any exceptions raised while communicating with the helper
+                 process (after the helper process has been stopped).
+        """
+        # The input is line based which means we can't pass newlines.
+        if not name or '\n' in name:
+            return None
+        with self.lock:
+            try:
+                self.write(name.encode('UTF-8') + b'\n')
+                # The header looks like `OBJECTNAME TYPE SIZE' or `NAME missing'.
+                tokens = self.readline().decode('UTF-8').split()
+                if len(tokens) == 3 and tokens[2].isdigit():
+                    # The contents are always followed by a newline.
+                    contents = self.read(int(tokens[2]) + 1)[:-1]
+                    return contents if tokens[1] == 'blob' else None
+                return None
+            except Exception:
+                self.stop()
+                raise
+
+
+class CatFileHelper(HelperProcess):
+
+    """
+    Resolve revisions using a long running ``git cat-file --batch-check`` process.
+
+    The ``git cat-file --batch-check`` command reads object names (anything
+    accepted by ``git rev-parse``) from its standard input stream and reports
+    the corresponding object ids on its standard output stream. This enables
+    :class:`GitRepo` to resolve any number of revisions using a single
+    process (refer to :attr:`.Repository.persistent_helpers` for details).
+    """
+
+    @property
+    def command(self):
+        """The command line of the helper process (a list of strings)."""
+        return ['git', 'cat-file', '--batch-check=%(objectname)']
+
+    def resolve(self, revision):
+        """
+        Resolve a revision to an object id.
+
+        :param revision: The name of a revision (a string).
+        :returns: The object id (a hexadecimal string) or :data:`None` when
+                  the revision doesn't exist, is ambiguous or the helper
+                  process fails.
+        """
+        # The input is line based which means we can't pass newlines.
+        if not revision or '\n' in revision:
+            return None
+        with self.lock:
+            if not self.ensure_running():
+                return None
+            try:
+                self.write(revision.encode('UTF-8') + b'\n')
+                output = self.readline().decode('UTF-8')
+            except Exception as e:
+                logger.warning("Helper process failed, falling back to subprocesses: %s", e)
+                self.stop()
+                self.failed = True
+                return None
+        # The output for revisions that can't be resolved looks like
+        # `NAME missing' or `NAME ambiguous', which means it will not be
+        # a hexadecimal string.
+        return output if HEX_PATTERN.match(output) else None
+
+
+class CommitGraph(PropertyManager):
+
+    """
+    Memory mapped reader for git's `commit-graph file`_.
+
+    The commit-graph file stores the parents and generation numbers of all
+    commits in a compact binary format, which enables :class:`GitRepo` to
+    count the ancestors of commits without asking git to parse (and
+    decompress) every commit object in the history (refer to
+    :attr:`GitRepo.use_commit_graph` for details).
+
+    Ancestor counts are remembered (per commit), which means that after the
+    first query most queries only need to look at a few commits. Split
+    commit-graph chains aren't supported.
+
+    .. _commit-graph file: https://git-scm.com/docs/gitformat-commit-graph
+    """
+
+    @lazy_property(repr=False)
+    def chunks(self):
+        """
+        A dictionary that maps chunk ids (byte strings) to ``(offset, length)`` tuples.
+
+        :raises: :exc:`~exceptions.ValueError` when the file format isn't supported.
+        """
+        signature, version, hash_version, num_chunks, num_base_graphs = struct.unpack_from('>4sBBBB', self.data, 0)
+        if signature != b'CGPH' or version != 1 or hash_version not in (1, 2):
+            raise ValueError("Unsupported commit-graph file format!")
+        if num_base_graphs != 0:
+            raise ValueError("Split commit-graph files are not supported!")
+        table = [struct.unpack_from('>4sQ', self.data, 8 + i * 12) for i in range(num_chunks + 1)]
+        chunks = {}
+        for (chunk_id, offset), (next_id, next_offset) in zip(table, table[1:]):
+            chunks[chunk_id] = (offset, next_offset - offset)
+        for required_chunk in b'OIDF', b'OIDL', b'CDAT':
+            if required_chunk not in chunks:
+                raise ValueError("Commit-graph file is missing required chunk %r!" % required_chunk)
+        return chunks
+
+    @lazy_property
+    def commit_count(self):
+        """The number of commits in the commit-graph file (an integer)."""
+        offset, length = self.chunks[b'OIDF']
+        return struct.unpack_from('>I', self.data, offset + 255 * 4)[0]
+
+    @lazy_property(repr=False)
+    def counts(self):
+        """An :class:`array.array` with the known ancestor count of each commit (-1 when unknown)."""
+        return array.array('l', [-1]) * self.commit_count
+
+    @lazy_property(repr=False)
+    def data(self):
+        """The contents of the commit-graph file (a read only :class:`mmap.mmap` object)."""
+        with open(self.filename, 'rb') as handle:
+            return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @required_property
+    def filename(self):
+        """The pathname of the commit-graph file (a string)."""
+
+    @lazy_property
+    def hash_length(self):
+        """The length of object ids in bytes (20 for SHA-1, 32 for SHA-256)."""
+        return 20 if struct.unpack_from('>B', self.data, 5)[0] == 1 else 32
+
+    def close(self):
+        """Release the memory mapping of the commit-graph file."""
+        data = self.__dict__.pop('data', None)
+        if data is not None:
+            data.close()
+
+    def count_ancestors(self, revision_id):
+        """
+        Count the commits reachable from a commit (including the commit itself).
+
+        :param revision_id: The id of a commit (a hexadecimal string).
+        :returns: The number of commits (an integer, the same number reported
+                  by ``git rev-list --count``) or :data:`None` when the commit
+                  isn't included in the commit-graph file or the file doesn't
+                  contain generation numbers.
+        """
+        position = self.find_position(revision_id)
+        if position is None or self.get_generation(position) == 0:
+            return None
+        counts = self.counts
+        # Find the nearest first parent ancestor with a known count.
+        chain = []
+        while counts[position] < 0:
+            chain.append(position)
+            parents = self.get_parents(position)
+            if not parents:
+                break
+            position = parents[0]
+        # Compute the counts of the commits in the chain, oldest first.
+        for position in reversed(chain):
+            parents = self.get_parents(position)
+            if parents:
+                total = counts[parents[0]] + 1
+                if len(parents) > 1:
+                    total += self.count_exclusive(parents[0], parents[1:])
+            else:
+                total = 1
+            counts[position] = total
+        return counts[chain[0]] if chain else counts[position]
+
+    def count_exclusive(self, base, others):
+        """
+        Count the commits reachable from some commits but not from another commit.
+
+        :param base: The position of the commit whose ancestors are excluded (an integer).
+        :param others: The positions of the other commits (a list of integers).
+        :returns: The number of commits (an integer).
+
+        This walks the history in generation number order, which guarantees
+        that commits are only visited after all of their children. The walk
+        stops as soon as there are no more commits to count.
+        """
+        excluded = {base: True}
+        heap = [(-self.get_generation(base), base)]
+        pending = 0
+        for position in others:
+            if position not in excluded:
+                excluded[position] = False
+                heapq.heappush(heap, (-self.get_generation(position), position))
+                pending += 1
+        total = 0
+        while pending > 0:
+            generation, position = heapq.heappop(heap)
+            is_excluded = excluded[position]
+            if not is_excluded:
+                pending -= 1
+                total += 1
+            for parent in self.get_parents(position):
+                if parent not in excluded:
+                    excluded[parent] = is_excluded
+                    heapq.heappush(heap, (-self.get_generation(parent), parent))
+                    if not is_excluded:
+                        pending += 1
+                elif is_excluded and not excluded[parent]:
+                    excluded[parent] = True
+                    pending -= 1
+        return total
+
+    def find_position(self, revision_id):
+        """
+        Find the position of a commit in the commit-graph file.
+
+        :param revision_id: The id of a commit (a hexadecimal string).
+        :returns: The position (an integer) or :data:`None` when the commit
+                  isn't included in the commit-graph file.
+        """
+        if len(revision_id) != self.hash_length * 2 or not HEX_PATTERN.match(revision_id):
+            return None
+        key = binascii.unhexlify(revision_id)
+        fanout_offset, fanout_length = self.chunks[b'OIDF']
+        first_byte = ord(key[:1])
+        low = struct.unpack_from('>I', self.data, fanout_offset + (first_byte - 1) * 4)[0] if first_byte else 0
+        high = struct.unpack_from('>I', self.data, fanout_offset + first_byte * 4)[0]
+        lookup_offset, lookup_length = self.chunks[b'OIDL']
+        while low < high:
+            middle = (low + high) // 2
+            start = lookup_offset + middle * self.hash_length
+            value = self.data[start:start + self.hash_length]
+            if value == key:
+                return middle
+            elif value < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def get_generation(self, position):
+        """
+        Get the generation number (topological level) of a commit.
+
+        :param position: The position of the commit (an integer).
+        :returns: The generation number (an integer, zero means unknown).
+        """
+        offset, length = self.chunks[b'CDAT']
+        start = offset + position * (self.hash_length + 16) + self.hash_length + 8
+        return struct.unpack_from('>I', self.data, start)[0] >> 2
+
+    def get_parents(self, position):
+        """
+        Get the parents of a commit.
+
+        :param position: The position of the commit (an integer).
+        :returns: A list with the positions of the parent commits.
+        """
+        offset, length = self.chunks[b'CDAT']
+        start = offset + position * (self.hash_length + 16) + self.hash_length
+        first_parent, second_parent = struct.unpack_from('>II', self.data, start)
+        parents = []
+        if first_parent != GRAPH_PARENT_NONE:
+            parents.append(first_parent)
+            if second_parent & GRAPH_EXTRA_EDGES_NEEDED:
+                # Octopus merges store their second and later parents
+                # in the `Extra Edge List' chunk.
+                edges_offset, edges_length = self.chunks[b'EDGE']
+                index = second_parent & GRAPH_EDGE_LAST_MASK
+                while True:
+                    value = struct.unpack_from('>I', self.data, edges_offset + index * 4)[0]
+                    parents.append(value & GRAPH_EDGE_LAST_MASK)
+                    if value & GRAPH_LAST_EDGE:
+                        break
+                    index += 1
+            elif second_parent != GRAPH_PARENT_NONE:
+                parents.append(second_parent)
+        return parents
+
+
+def is_full_revision_id(value):
+    """
+    Check whether a string is a full git revision id.
+
+    :param value: The string to check.
+    :returns: :data:`True` if `value` is a hexadecimal string of 40 (SHA-1)
+              or 64 (SHA-256) characters, :data:`False` otherwise.
+    """
+    return len(value) in (40, 64) and HEX_PATTERN.match(value) is not None
+
+
+def read_ref_storage(directory):
+    """
+    Read the refs stored in a git directory.
+
+    :param directory: The pathname of a git directory (a string).
+    :returns: A tuple with two values, or :data:`None` when the ref storage
+              format isn't supported:
+
+              1. A dictionary that maps full ref names (like
+                 ``refs/heads/master``) to object ids. Symbolic refs are
+                 resolved and dangling symbolic refs are omitted.
+              2. The contents of the ``HEAD`` file (a string like
+                 ``ref: refs/heads/master`` or an object id).
+    :raises: :exc:`~exceptions.EnvironmentError` when reading files fails.
+
+    Loose refs (the files in the ``refs`` directory) take precedence over
+    the ``packed-refs`` file, in the same way as git itself handles them.
+    The reftable format, linked worktrees and unexpected file contents are
+    not supported (:data:`None` is returned).
+    """
+    if not os.path.isfile(os.path.join(directory, 'HEAD')):
+        return None
+    for unsupported in 'commondir', 'reftable':
+        if os.path.exists(os.path.join(directory, unsupported)):
+            return None
+    values = {}
+    # Parse the `packed-refs' file (if it exists).
+    packed_refs = os.path.join(directory, 'packed-refs')
+    if os.path.isfile(packed_refs):
+        with open(packed_refs, 'rb') as handle:
+            for line in handle:
+                line = line.decode('UTF-8').strip()
+                # Skip comments (like the header line) and peeled tags.
+                if line and not line.startswith(('#', '^')):
+                    revision_id, _, name = line.partition(' ')
+                    if not (is_full_revision_id(revision_id) and name.startswith('refs/')):
+                        return None
+                    values[name] = revision_id
+    # Read the loose refs, these take precedence over packed refs.
+    refs_directory = os.path.join(directory, 'refs')
+    for root, dirs, files in os.walk(refs_directory):
+        for filename in files:
+            if not filename.endswith('.lock'):
+                pathname = os.path.join(root, filename)
+                name = '/'.join(['refs'] + os.path.relpath(pathname, refs_directory).split(os.sep))
+                value = read_ref_file(pathname)
+                if value is None:
+                    return None
+                values[name] = value
+    head = read_ref_file(os.path.join(directory, 'HEAD'))
+    if head is None:
+        return None
+    # Resolve symbolic refs.
+    refs = {}
+    for name, value in values.items():
+        # We limit the depth of symbolic refs to avoid infinite loops.
+        for i in range(5):
+            if value and value.startswith('ref: '):
+                value = values.get(value[len('ref: '):])
+            else:
+                break
+        if value and not value.startswith('ref: '):
+            refs[name] = value
+    return refs, head
+
+
+def read_ref_file(pathname):
+    """
+    Read a loose ref.
+
+    :param pathname: The pathname of the file (a string).
+    :returns: An object id, a symbolic ref (a string like ``ref:
+              refs/heads/master``) or :data:`None` when the contents of the
+              file aren't recognized.
+    """
+    with open(pathname, 'rb') as handle:
+        value = handle.read().decode('UTF-8').strip()
+    if is_full_revision_id(value) or value.startswith('ref: refs/'):
+        return value
@@ -1,30 +1,45 @@
 # Version control system repository manager.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: March 5, 2018
+# Last Change: October 16, 2026
 # URL: https://github.com/xolox/python-vcs-repo-mgr
 
 """Support for Mercurial version control repositories."""
 
 # Standard library modules.
+import binascii
 import logging
 import os
+import struct
 
 # External dependencies.
 from executor import quote
-from property_manager import required_property
+from executor.contexts import LocalContext
+from property_manager import mutable_property, required_property
 
 # Modules included in our package.
-from vcs_repo_mgr import Remote, Repository, Revision, coerce_author
+from vcs_repo_mgr import Remote, Repository, Revision, TreeEntry, coerce_author
+from vcs_repo_mgr.helpers import HelperProcess
 
 # Public identifiers that require documentation.
 __all__ = (
+    'CommandServer',
     'HgRepo',
+    'read_changelog_index',
 )
 
 # Initialize a logger for this module.
 logger = logging.getLogger(__name__)
 
+# Mapping of vcs_repo_mgr.ARCHIVE_FORMATS to the values accepted by `hg archive --type'.
+ARCHIVE_TYPES = {'tar': 'tar', 'tar.gz': 'tgz', 'zip': 'zip'}
+
+# Mapping of the file types reported by `hg manifest --debug' to git style file modes.
+MANIFEST_MODES = {' ': 0o100644, '*': 0o100755, '@': 0o120000}
+
+# The binary format of the entries in a revlog (version 1) index.
+REVLOG_ENTRY = struct.Struct('>Qiiiiii20s12x')
+
 
 class HgRepo(Repository):
 
@@ -34,6 +49,11 @@ class HgRepo(Repository):
 
     # Class methods.
 
+    @classmethod
+    def contains_repository_entries(cls, entries):
+        """Check whether the entries in a directory identify a Mercurial repository."""
+        return '.hg' in entries
+
     @staticmethod
     def get_vcs_directory(context, directory):
         """Get the pathname of the directory containing the version control metadata files."""
@@ -49,7 +69,7 @@ class HgRepo(Repository):
     @property
     def current_branch(self):
         """The name of the branch that's currently checked out in the working tree (a string or :data:`None`)."""
-        return self.context.capture('hg', 'branch', check=False, silent=True)
+        return self.capture('branch', check=False, silent=True)
 
     @required_property
     def default_revision(self):
@@ -74,7 +94,7 @@ class HgRepo(Repository):
         self.create()
         # Check the global revision id of the working tree.
         try:
-            output = self.context.capture('hg', 'id', silent=True)
+            output = self.capture('id', silent=True)
             tokens = output.split()
             return int(tokens[0]) == 0
         except Exception:
@@ -86,14 +106,14 @@ class HgRepo(Repository):
         # Make sure the local repository exists.
         self.create()
         # Check whether the `hg diff' output is empty.
-        listing = self.context.capture('hg', 'diff')
+        listing = self.capture('diff')
         return len(listing.splitlines()) == 0
 
     @property
     def known_remotes(self):
         """The names of the configured remote repositories (a list of :class:`.Remote` objects)."""
         objects = []
-        for line in self.context.capture('hg', 'paths').splitlines():
+        for line in self.capture('paths').splitlines():
             name, _, location = line.partition('=')
             if name and location:
                 name = name.strip()
@@ -114,7 +134,7 @@ class HgRepo(Repository):
     def merge_conflicts(self):
         """The filenames of any files with merge conflicts (a list of strings)."""
         filenames = set()
-        listing = self.context.capture('hg', 'resolve', '--list')
+        listing = self.capture('resolve', '--list')
         for line in listing.splitlines():
             tokens = line.split(None, 1)
             if len(tokens) == 2:
@@ -123,6 +143,48 @@ class HgRepo(Repository):
                     filenames.add(name)
         return sorted(filenames)
 
+    @mutable_property
+    def native_caches(self):
+        """
+        :data:`True` to read Mercurial's branch and tag caches directly, :data:`False` (the default) otherwise.
+
+        When this is :data:`True` :func:`find_branches()` and
+        :func:`find_tags()` read the ``.hg/cache/branch2-*`` and
+        ``.hg/cache/tags2-*`` files instead of running ``hg branches`` and
+        ``hg tags``. The caches are only used when they're valid for the
+        current tip of the changelog, otherwise the commands are used (which
+        refreshes the caches). This option only has an effect for
+        repositories that are accessed using
+        :class:`~executor.contexts.LocalContext`.
+        """
+        return False
+
+    @property
+    def ref_files(self):
+        """
+        The pathnames of the files that determine the branches and tags in the repository (a list of strings).
+
+        This includes the changelog, the phase roots and the obsolescence
+        markers (which determine the visible changesets), ``.hgtags``, local
+        tags and bookmarks. Shared repositories aren't supported (an empty
+        list is returned) because their store lives elsewhere.
+        """
+        metadata = os.path.join(self.local, '.hg')
+        if os.path.exists(os.path.join(metadata, 'sharedpath')):
+            return []
+        store = os.path.join(metadata, 'store')
+        if not os.path.isdir(store):
+            store = metadata
+        return [
+            os.path.join(store, '00changelog.i'),
+            os.path.join(store, 'phaseroots'),
+            os.path.join(store, 'obsstore'),
+            os.path.join(store, 'bookmarks'),
+            os.path.join(metadata, 'bookmarks'),
+            os.path.join(metadata, 'localtags'),
+            os.path.join(self.local, '.hgtags'),
+        ]
+
     @property
     def supports_working_tree(self):
         """Always :data:`True` for Mercurial repositories."""
@@ -130,9 +192,67 @@ class HgRepo(Repository):
 
     # Instance methods.
 
+    def capture(self, *arguments, **options):
+        """
+        Run a read only ``hg`` command and capture its output.
+
+        :param arguments: The arguments to the ``hg`` command (strings).
+        :param options: Keyword arguments to :func:`~executor.contexts.AbstractContext.capture()`.
+        :returns: The output of the command (a string).
+
+        When :attr:`~.Repository.persistent_helpers` is enabled the command
+        is executed by the Mercurial command server (see
+        :class:`CommandServer`), otherwise a new ``hg`` process is started.
+        When the command server reports an error (and `check` isn't
+        :data:`False`) the command is executed again as a regular subprocess
+        in order to report the error in the usual way.
+        """
+        helper = self.get_helper('cmdserver')
+        if helper:
+            result = helper.runcommand(*arguments)
+            if result is not None:
+                returncode, output = result
+                if returncode == 0 or not options.get('check', True):
+                    return decode_output(output)
+        return self.context.capture('hg', *arguments, **options)
+
+    def count_revisions_in_bulk(self, revision_ids):
+        """
+        Find the revision numbers of multiple revisions using a single ``hg log`` command.
+
+        :param revision_ids: A list of global revision ids (strings).
+        :returns: A dictionary that maps revision ids to revision numbers.
+        """
+        revision_ids = list(revision_ids)
+        revision_numbers = {}
+        if revision_ids:
+            arguments = ['log', '--template={node} {rev}\n']
+            arguments.extend('--rev=%s' % r for r in revision_ids)
+            listing = self.capture(*arguments, check=False, silent=True)
+            nodes = [line.split() for line in listing.splitlines() if len(line.split()) == 2]
+            for revision_id in revision_ids:
+                # Revision ids can be abbreviated.
+                matches = [int(rev) for node, rev in nodes if node.startswith(revision_id.lower())]
+                if len(matches) == 1:
+                    revision_numbers[revision_id] = matches[0]
+                else:
+                    revision_numbers[revision_id] = self.find_revision_number(revision_id)
+        return revision_numbers
+
+    def create_helper(self, name):
+        """
+        Create a long running helper process.
+
+        :param name: The name of the helper process (a string).
+        :returns: A :class:`CommandServer` object when `name` is the string
+                  'cmdserver', otherwise :data:`None`.
+        """
+        if name == 'cmdserver':
+            return CommandServer(context=self.context)
+
     def find_author(self):
         """Get the author information from the version control system."""
-        return coerce_author(self.context.capture('hg', 'config', 'ui.username'))
+        return coerce_author(self.capture('config', 'ui.username'))
 
     def find_branches(self):
         """
@@ -142,7 +262,12 @@ class HgRepo(Repository):
 
         .. note:: Closed branches are not included.
         """
-        listing = self.context.capture('hg', 'branches')
+        revisions = self.read_branch_cache()
+        if revisions is not None:
+            for revision in revisions:
+                yield revision
+            return
+        listing = self.capture('branches')
         for line in listing.splitlines():
             tokens = line.split()
             if len(tokens) >= 2 and ':' in tokens[1]:
@@ -154,13 +279,24 @@ class HgRepo(Repository):
                     revision_number=int(revision_number),
                 )
 
+    def find_changed_files(self, old_revision, new_revision):
+        """Find the files that changed between two revisions (using ``hg status``)."""
+        listing = self.capture('status', '--rev=%s' % old_revision, '--rev=%s' % new_revision,
+                               '--modified', '--added', '--removed', '--print0', silent=True)
+        changed_files, deleted_files = [], []
+        for entry in listing.split('\0'):
+            status, _, filename = entry.partition(' ')
+            if filename:
+                (deleted_files if status == 'R' else changed_files).append(filename)
+        return changed_files, deleted_files
+
     def find_revision_id(self, revision=None):
         """Find the global revision id of the given revision."""
         # Make sure the local repository exists.
         self.create()
         # Try to find the revision id of the specified revision.
         revision = revision or self.default_revision
-        output = self.context.capture('hg', 'id', '--rev=%s' % revision, '--debug', '--id').rstrip('+')
+        output = self.capture('id', '--rev=%s' % revision, '--debug', '--id').rstrip('+')
         # Validate the `hg id --debug --id' output.
         return self.ensure_hexadecimal_string(output, 'hg id --id')
 
@@ -170,16 +306,45 @@ class HgRepo(Repository):
         self.create()
         # Try to find the revision number of the specified revision.
         revision = revision or self.default_revision
-        output = self.context.capture('hg', 'id', '--rev=%s' % revision, '--num').rstrip('+')
+        output = self.capture('id', '--rev=%s' % revision, '--num').rstrip('+')
         # Validate the `hg id --num' output.
         if not output.isdigit():
             msg = "Failed to find local revision number! ('hg id --num' gave unexpected output)"
             raise EnvironmentError(msg)
         return int(output)
 
+    def find_revisions(self, references):
+        """
+        Find the global revision ids and numbers of multiple revisions using a single ``hg log`` command.
+
+        :param references: A list of revision references (strings).
+        :returns: A list of :class:`.Revision` objects.
+
+        Mercurial reports each revision only once, so when multiple references
+        point to the same revision the output can't be mapped back to the
+        references and the revisions are resolved one by one instead.
+        """
+        self.create()
+        arguments = ['log', '--template={node} {rev}\n']
+        arguments.extend('--rev=%s' % r for r in references)
+        listing = self.capture(*arguments)
+        nodes = [line.split() for line in listing.splitlines() if len(line.split()) == 2]
+        if len(nodes) != len(references):
+            return super(HgRepo, self).find_revisions(references)
+        return self.create_revisions(
+            references,
+            [self.ensure_hexadecimal_string(node, 'hg log') for node, rev in nodes],
+            [int(rev) for node, rev in nodes],
+        )
+
     def find_tags(self):
         """Find information about the tags in the repository."""
-        listing = self.context.capture('hg', 'tags')
+        revisions = self.read_tag_cache()
+        if revisions is not None:
+            for revision in revisions:
+                yield revision
+            return
+        listing = self.capture('tags')
         for line in listing.splitlines():
             tokens = line.split()
             if len(tokens) >= 2 and ':' in tokens[1]:
@@ -191,6 +356,171 @@ class HgRepo(Repository):
                     tag=tokens[0],
                 )
 
+    def find_tree_id(self, revision=None):
+        """Find the node id of the manifest of the given revision."""
+        self.create()
+        revision = revision or self.default_revision
+        # With --debug the manifest keyword expands to the full node id.
+        output = self.capture('log', '--rev=%s' % revision, '--debug', '--template={manifest}')
+        return self.ensure_hexadecimal_string(output.rpartition(':')[2], 'hg log')
+
+    def list_files(self, revision=None, prefix=None):
+        """
+        List the files in the tree of a revision (using ``hg manifest --debug``).
+
+        The ``hg files`` command only reports filenames, ``hg manifest
+        --debug`` also reports the modes and node ids of the files.
+        """
+        self.create()
+        revision = revision or self.default_revision
+        prefix = prefix.strip('/') + '/' if prefix else ''
+        for line in self.iter_output(['hg', 'manifest', '--rev=%s' % revision, '--debug']):
+            # Lines look like `NODE MODE TYPE PATH' where TYPE is `*' for
+            # executable files, `@' for symbolic links and a space otherwise.
+            node, mode, type_and_path = line.split(' ', 2)
+            path = type_and_path[2:]
+            if path.startswith(prefix):
+                yield TreeEntry(path=path, mode=MANIFEST_MODES[type_and_path[0]], object_id=node)
+
+    def read_branch_cache(self):
+        """
+        Get the branches in the repository from Mercurial's branch cache.
+
+        :returns: A list of :class:`.Revision` objects (in the same order as
+                  ``hg branches``) or :data:`None` when :attr:`native_caches`
+                  is disabled or no valid branch cache is available.
+        """
+        index = self.read_changelog()
+        if not index:
+            return None
+        tip_node = index[-1][0]
+        for filter_name in 'visible', 'served', 'immutable', 'base':
+            lines = self.read_cache_file('branch2-%s' % filter_name)
+            # The header line contains the tip node and revision number (and
+            # a hash of the filtered revisions, which we don't support).
+            if lines and lines[0].split() == [tip_node, str(len(index) - 1)]:
+                break
+        else:
+            return None
+        revisions = dict((node, rev) for rev, (node, p1, p2) in enumerate(index))
+        # Find the open heads of each branch.
+        branches = {}
+        for line in lines[1:]:
+            tokens = line.split(' ', 2)
+            if len(tokens) != 3 or tokens[0] not in revisions:
+                return None
+            open_heads = branches.setdefault(tokens[2], [])
+            if tokens[1] == 'o':
+                open_heads.append(revisions[tokens[0]])
+        # The heads of the repository are the revisions without children.
+        parents = set(p for node, p1, p2 in index for p in (p1, p2))
+        listing = []
+        for name, open_heads in branches.items():
+            # Closed branches are not included.
+            if open_heads:
+                active = any(rev not in parents for rev in open_heads)
+                listing.append((active, max(open_heads), name))
+        return [Revision(
+            branch=name,
+            repository=self,
+            revision_id=index[rev][0][:12],
+            revision_number=rev,
+        ) for active, rev, name in sorted(listing, reverse=True)]
+
+    def read_cache_file(self, filename):
+        """
+        Read a file in Mercurial's cache directory.
+
+        :param filename: The name of the file in ``.hg/cache`` (a string).
+        :returns: A list of lines (strings) or :data:`None` when the file
+                  doesn't exist or can't be read.
+        """
+        try:
+            with open(os.path.join(self.local, '.hg', 'cache', filename), 'rb') as handle:
+                return handle.read().decode('UTF-8').splitlines()
+        except EnvironmentError:
+            return None
+
+    def read_changelog(self):
+        """
+        Read the changelog index of the local repository.
+
+        :returns: The result of :func:`read_changelog_index()` or :data:`None`
+                  when :attr:`native_caches` is disabled or the changelog
+                  can't be read.
+        """
+        if self.native_caches and isinstance(self.context, LocalContext):
+            metadata = os.path.join(self.local, '.hg')
+            try:
+                # Shared repositories store their history elsewhere.
+                if not os.path.exists(os.path.join(metadata, 'sharedpath')):
+                    store = os.path.join(metadata, 'store')
+                    return read_changelog_index(store if os.path.isdir(store) else metadata)
+            except EnvironmentError as e:
+                logger.debug("Failed to read changelog of %s: %s", self.local, e)
+
+    def read_files(self, requests):
+        """Read files at revisions using ``hg cat`` (executed by a single command server when possible)."""
+        with self.use_helper('cmdserver') as helper:
+            for revision, path in requests:
+                arguments = ['cat', '--rev=%s' % revision, 'path:%s' % path]
+                result = helper.runcommand(*arguments) if helper else None
+                if result is None:
+                    command = self.context.prepare('hg', *arguments, capture=True, check=False, silent=True)
+                    command.wait()
+                    result = command.returncode, command.stdout
+                returncode, contents = result
+                yield contents if returncode == 0 else None
+
+    def read_tag_cache(self):
+        """
+        Get the tags in the repository from Mercurial's tag cache.
+
+        :returns: A list of :class:`.Revision` objects (in the same order as
+                  ``hg tags``) or :data:`None` when :attr:`native_caches` is
+                  disabled or no valid tag cache is available.
+
+        Global tags are read from the tag cache, local tags are read from
+        ``.hg/localtags`` and the special tag ``tip`` is added.
+        """
+        index = self.read_changelog()
+        if not index:
+            return None
+        tip_node = index[-1][0]
+        for filename in 'tags2-visible', 'tags2':
+            lines = self.read_cache_file(filename)
+            # The header line contains the tip revision number and node (and
+            # a hash of the filtered revisions, which we don't support).
+            if lines and lines[0].split() == [str(len(index) - 1), tip_node]:
+                break
+        else:
+            return None
+        try:
+            with open(os.path.join(self.local, '.hg', 'localtags'), 'rb') as handle:
+                lines.extend(handle.read().decode('UTF-8').splitlines())
+        except EnvironmentError:
+            pass
+        # Later entries override earlier entries (this includes
+        # the history of global tags) and local tags override
+        # global tags.
+        tags = {}
+        for line in lines[1:]:
+            node, _, name = line.strip().partition(' ')
+            if name:
+                tags[name.strip()] = node
+        tags['tip'] = tip_node
+        revisions = dict((node, rev) for rev, (node, p1, p2) in enumerate(index))
+        # Tags that were removed (they refer to the null revision)
+        # or that refer to unknown changesets are not included.
+        listing = sorted(((revisions[node], name, node) for name, node in tags.items() if node in revisions),
+                         reverse=True)
+        return [Revision(
+            repository=self,
+            revision_id=node[:12],
+            revision_number=rev,
+            tag=name,
+        ) for rev, name, node in listing]
+
     def get_add_files_command(self, *filenames):
         """Get the command to include added and/or removed files in the working tree in the next commit."""
         command = ['hg', 'addremove']
@@ -249,6 +579,14 @@ class HgRepo(Repository):
         tokens.append('--close-branch')
         return [' '.join(tokens)]
 
+    def get_archive_command(self, revision, paths=None, format='tar'):
+        """Get the command to write an archive of a revision to standard output."""
+        archive_type = ARCHIVE_TYPES[format]
+        command = ['hg', 'archive', '--rev=%s' % revision, '--type=%s' % archive_type, '--prefix=.']
+        command.extend('--include=path:%s' % p for p in paths or [])
+        command.append('-')
+        return command
+
     def get_export_command(self, directory, revision):
         """Get the command to export the complete tree from the local repository."""
         return ['hg', 'archive', '--rev=%s' % revision, directory]
@@ -274,3 +612,140 @@ class HgRepo(Repository):
         if remote:
             command.append(remote)
         return command
+
+
+class CommandServer(HelperProcess):
+
+    """
+    Run Mercurial commands using a long running ``hg serve --cmdserver pipe`` process.
+
+    Mercurial's `command server`_ executes commands sent to it over its
+    standard input stream, which means the cost of starting the Python
+    interpreter and loading Mercurial and its extensions is paid only once
+    (refer to :attr:`.Repository.persistent_helpers` for details).
+
+    .. _command server: https://www.mercurial-scm.org/wiki/CommandServer
+    """
+
+    @property
+    def command(self):
+        """The command line of the helper process (a list of strings)."""
+        return ['hg', 'serve', '--cmdserver', 'pipe']
+
+    def handshake(self):
+        """
+        Read the hello message of the command server.
+
+        :raises: :exc:`~exceptions.EnvironmentError` when the command server
+                 doesn't support the ``runcommand`` command.
+        """
+        channel, data = self.read_message()
+        capabilities = set()
+        if channel == b'o':
+            for line in data.splitlines():
+                key, _, value = line.partition(b':')
+                if key == b'capabilities':
+                    capabilities.update(value.split())
+        if b'runcommand' not in capabilities:
+            raise EnvironmentError("Mercurial command server doesn't support 'runcommand'!")
+
+    def read_message(self):
+        """
+        Read a message sent by the command server.
+
+        :returns: A tuple with two values:
+
+                  1. The channel identifier (a byte string of one character).
+                  2. The data of the message (a byte string). For the input
+                     channels 'I' and 'L' this is an empty string.
+        """
+        channel, length = struct.unpack('>cI', self.read(5))
+        if channel in (b'I', b'L'):
+            return channel, b''
+        return channel, self.read(length)
+
+    def runcommand(self, *arguments):
+        """
+        Execute a Mercurial command using the command server.
+
+        :param arguments: The arguments to the ``hg`` command (strings).
+        :returns: A tuple with two values (the exit code of the command and
+                  its standard output as a byte string) or :data:`None` when
+                  the command server isn't available.
+        """
+        data = b'\0'.join(a.encode('UTF-8') for a in arguments)
+        with self.lock:
+            if not self.ensure_running():
+                return None
+            try:
+                self.write(b'runcommand\n' + struct.pack('>I', len(data)) + data)
+                output = []
+                while True:
+                    channel, data = self.read_message()
+                    if channel == b'o':
+                        output.append(data)
+                    elif channel == b'e':
+                        logger.debug("Mercurial command server reported: %s", data.decode('UTF-8', 'replace').strip())
+                    elif channel == b'r':
+                        return struct.unpack('>i', data)[0], b''.join(output)
+                    elif channel in (b'I', b'L'):
+                        # Commands that prompt for input get an empty response
+                        # (equivalent to end of file on the standard input).
+                        self.write(struct.pack('>I', 0))
+                    elif channel.isupper():
+                        raise EnvironmentError("Unsupported mandatory channel %r!" % channel)
+            except Exception as e:
+                logger.warning("Helper process failed, falling back to subprocesses: %s", e)
+                self.stop()
+                self.failed = True
+                return None
+
+
+def decode_output(output):
+    """
+    Decode captured output in the same way as :attr:`executor.ExternalCommand.output`.
+
+    :param output: The captured output (a byte string).
+    :returns: The decoded output (a string). Leading and trailing whitespace
+              is stripped when the output consists of a single line.
+    """
+    text = output.decode('UTF-8')
+    stripped = text.strip()
+    return stripped if '\n' not in stripped else text
+
+
+def read_changelog_index(directory):
+    """
+    Read the index of a Mercurial changelog.
+
+    :param directory: The pathname of the directory that contains the
+                      ``00changelog.i`` file (a string).
+    :returns: A list of tuples with three values each (the changeset id as a
+              hexadecimal string and the revision numbers of the two parents,
+              where -1 means no parent) indexed by revision number, or
+              :data:`None` when the revlog format isn't supported.
+    :raises: :exc:`~exceptions.EnvironmentError` when reading the file fails.
+
+    Only version 1 revlogs are supported (both inline and non-inline).
+    """
+    with open(os.path.join(directory, '00changelog.i'), 'rb') as handle:
+        data = handle.read()
+    if not data:
+        return []
+    header = struct.unpack('>I', data[:4])[0]
+    if header & 0xFFFF != 1:
+        return None
+    inline = bool(header & (1 << 16))
+    entries = []
+    offset = 0
+    while offset < len(data):
+        if offset + REVLOG_ENTRY.size > len(data):
+            return None
+        (offset_flags, compressed_length, uncompressed_length,
+         base_revision, linked_revision, p1, p2, node) = REVLOG_ENTRY.unpack_from(data, offset)
+        entries.append((binascii.hexlify(node).decode('ascii'), p1, p2))
+        offset += REVLOG_ENTRY.size
+        # Inline revlogs interleave the index entries with revision data.
+        if inline:
+            offset += compressed_length
+    return entries
@@ -0,0 +1,347 @@
+# Version control system repository manager.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/xolox/python-vcs-repo-mgr
+
+"""
+Answer many repository queries in a single `vcs-tool` process.
+
+Build scripts that call ``vcs-tool`` dozens of times pay the price of
+starting a Python interpreter, importing modules, parsing configuration files
+and constructing :class:`~vcs_repo_mgr.Repository` objects on every call. The
+``vcs-tool --batch`` command avoids this by reading newline delimited JSON
+requests from standard input and writing a JSON response for each request to
+standard output, for example:
+
+.. code-block:: sh
+
+   $ echo '{"repository": "vcs-repo-mgr", "action": "find-revision-id", "revision": "master"}' | vcs-tool --batch
+   {"result": "b617731b6c0ca746665f597d2f24b8814b137ebc"}
+
+Each request is a JSON object with the following keys:
+
+``action``
+ The name of the action (required). Refer to :attr:`BatchSession.actions`
+ for the supported actions, they correspond to the command line options of
+ ``vcs-tool`` (without the leading dashes).
+
+``repository``
+ The name or location of the repository (required by most actions).
+
+``revision``, ``revisions``
+ A revision or a list of revisions (optional). When a list is given the
+ result is a list as well. The list can contain objects with a ``release``
+ key instead of revisions (this is how ``vcs-tool`` combines the
+ ``--release`` and ``--revision`` options).
+
+``release``
+ A release identifier that is translated to a revision (optional, this
+ works like the ``--release`` option).
+
+``arguments``
+ The repository/revision pairs for the ``sum-revisions`` action.
+
+``directory``
+ The target directory for the ``export`` action.
+
+``id``
+ An arbitrary value that is copied to the response (optional).
+
+Each response is a JSON object with a ``result`` key or an ``error`` key
+(containing an error message). Repository objects are kept for the duration
+of the session, so listings of branches, tags and releases stay cached (see
+:attr:`.Repository.ref_snapshot`) and :attr:`.Repository.persistent_helpers`
+is enabled.
+
+While the session is running the output that version control commands write
+to standard output (for example during ``update`` and ``export`` actions) is
+redirected to standard error, so that standard output only contains the JSON
+responses (see :func:`BatchSession.redirect_output()`).
+"""
+
+# Standard library modules.
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+
+# External dependencies.
+from property_manager import PropertyManager, lazy_property
+
+# Modules included in our package.
+from vcs_repo_mgr import coerce_repository
+
+# Public identifiers that require documentation.
+__all__ = (
+    'BatchSession',
+)
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+
+class BatchSession(PropertyManager):
+
+    """Answer newline delimited JSON requests for repository information."""
+
+    @lazy_property
+    def actions(self):
+        """
+        A dictionary that maps action names to methods of :class:`BatchSession`.
+
+        The supported actions are ``export``, ``find-directory``,
+        ``find-revision-id``, ``find-revision-number``, ``list-releases``,
+        ``select-release``, ``sum-revisions``, ``update`` and
+        ``vcs-control-field``.
+        """
+        return {
+            'export': self.export,
+            'find-directory': self.find_directory,
+            'find-revision-id': self.find_revision_id,
+            'find-revision-number': self.find_revision_number,
+            'list-releases': self.list_releases,
+            'select-release': self.select_release,
+            'sum-revisions': self.sum_revisions,
+            'update': self.update,
+            'vcs-control-field': self.vcs_control_field,
+        }
+
+    @lazy_property(repr=False)
+    def repositories(self):
+        """A dictionary that maps repository names to :class:`~vcs_repo_mgr.Repository` objects."""
+        return {}
+
+    def close(self):
+        """Stop the helper processes of the repositories used during the session."""
+        for repository in self.repositories.values():
+            repository.stop_helpers()
+
+    def export(self, request):
+        """Export a revision to the directory given by the ``directory`` key."""
+        directory = request.get('directory')
+        if not directory:
+            raise ValueError("The 'export' action requires a 'directory' value!")
+        self.get_repository(request).export(directory, self.get_revision(request))
+
+    def find_directory(self, request):
+        """Get the local directory of a repository."""
+        return self.get_repository(request).local
+
+    def find_repository(self, name):
+        """
+        Construct the repository object for a repository name or location.
+
+        :param name: The name or location of a repository (a string).
+        :returns: The result of :func:`~vcs_repo_mgr.coerce_repository()`.
+        """
+        return coerce_repository(name)
+
+    def find_revision_id(self, request):
+        """Get the global revision id(s) of the requested revision(s)."""
+        return self.resolve(request, lambda r: r.revision_id, numbers=False)
+
+    def find_revision_number(self, request):
+        """Get the local revision number(s) of the requested revision(s)."""
+        return self.resolve(request, lambda r: r.revision_number, numbers=True)
+
+    def get_repository(self, request):
+        """
+        Get the repository selected by a request.
+
+        :param request: The request (a dictionary).
+        :returns: A :class:`~vcs_repo_mgr.Repository` object.
+        :raises: :exc:`~exceptions.ValueError` when the request doesn't
+                 contain a ``repository`` value.
+        """
+        name = request.get('repository')
+        if not name:
+            raise ValueError("The %r action requires a 'repository' value!" % request.get('action'))
+        if name not in self.repositories:
+            repository = self.find_repository(name)
+            repository.persistent_helpers = True
+            self.repositories[name] = repository
+        return self.repositories[name]
+
+    def get_revision(self, request, selector=None):
+        """
+        Get the revision selected by a request.
+
+        :param request: The request (a dictionary).
+        :param selector: A value from the ``revisions`` list of the request (a
+                         string or a dictionary with a ``release`` value) or
+                         :data:`None` to use the ``revision`` or ``release``
+                         value of the request.
+        :returns: A revision (a string) or :data:`None`.
+        """
+        if selector is None:
+            selector = request
+        elif not isinstance(selector, dict):
+            return selector
+        release_id = selector.get('release')
+        if release_id:
+            repository = self.get_repository(request)
+            if release_id not in repository.releases:
+                raise ValueError("The given release identifier is invalid!")
+            return repository.releases[release_id].revision.revision_id
+        return selector.get('revision')
+
+    def handle(self, request):
+        """
+        Handle a single request.
+
+        :param request: The request (a dictionary).
+        :returns: The response (a dictionary).
+        """
+        response = {}
+        try:
+            if not isinstance(request, dict):
+                raise ValueError("Requests should be JSON objects!")
+            if 'id' in request:
+                response['id'] = request['id']
+            action = self.actions.get(request.get('action'))
+            if not action:
+                raise ValueError("Unsupported action %r!" % request.get('action'))
+            response['result'] = action(request)
+        except Exception as e:
+            logger.debug("Failed to handle request %r!", request, exc_info=True)
+            response['error'] = str(e)
+        return response
+
+    def handle_line(self, line):
+        """
+        Handle a single line of input.
+
+        :param line: A line of input containing a JSON request (a string).
+        :returns: A line of output containing a JSON response (a string) or
+                  :data:`None` when the line is empty.
+        """
+        line = line.strip()
+        if line:
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                response = dict(error="Failed to parse request! (%s)" % e)
+            else:
+                response = self.handle(request)
+            return json.dumps(response, sort_keys=True) + '\n'
+
+    def list_releases(self, request):
+        """Get the identifiers of the releases in a repository."""
+        return [release.identifier for release in self.get_repository(request).ordered_releases]
+
+    @contextlib.contextmanager
+    def redirect_output(self, output):
+        """
+        Protect the output stream from the output of version control commands.
+
+        :param output: The file-like object to which responses are written.
+        :returns: A context manager that returns the file-like object to which
+                  responses should be written.
+
+        When `output` is connected to the standard output stream of the
+        process (file descriptor 1, which is inherited by the external
+        commands run by :class:`~vcs_repo_mgr.Repository` objects) a duplicate
+        of the file descriptor is returned and the standard output stream is
+        redirected to standard error until the context manager exits. Other
+        file-like objects are returned unchanged.
+        """
+        try:
+            fd = output.fileno()
+        except (AttributeError, ValueError, io.UnsupportedOperation):
+            fd = None
+        if fd != 1:
+            yield output
+            return
+        output.flush()
+        sys.stdout.flush()
+        saved_fd = os.dup(1)
+        os.dup2(2, 1)
+        try:
+            with os.fdopen(os.dup(saved_fd), 'w') as responses:
+                yield responses
+        finally:
+            sys.stdout.flush()
+            os.dup2(saved_fd, 1)
+            os.close(saved_fd)
+
+    def resolve(self, request, selector, numbers):
+        """
+        Resolve the revision(s) of a request using :func:`.Repository.resolve_revisions()`.
+
+        :param request: The request (a dictionary).
+        :param selector: A callable that picks a value from a
+                         :class:`~vcs_repo_mgr.Revision` object.
+        :param numbers: Passed on to :func:`.Repository.resolve_revisions()`.
+        :returns: A single value when the request contains a ``revision``
+                  value (or none at all), a list of values when the request
+                  contains a ``revisions`` value.
+        """
+        repository = self.get_repository(request)
+        if 'revisions' in request:
+            revisions = [self.get_revision(request, r) for r in request['revisions']]
+            return [selector(r) for r in repository.resolve_revisions(revisions, numbers=numbers)]
+        return selector(repository.resolve_revisions([self.get_revision(request)], numbers=numbers)[0])
+
+    def run(self, input, output):
+        """
+        Answer requests until the end of the input is reached.
+
+        :param input: A file-like object from which requests are read.
+        :param output: A file-like object to which responses are written.
+
+        Empty lines are ignored, responses are flushed one by one so that the
+        session can be used as a coprocess.
+        """
+        try:
+            with self.redirect_output(output) as output:
+                for line in iter(input.readline, ''):
+                    response = self.handle_line(line)
+                    if response:
+                        output.write(response)
+                        output.flush()
+        finally:
+            self.close()
+
+    def select_release(self, request):
+        """Get the identifier of the newest release not newer than the ``release`` value."""
+        release_id = request.get('release')
+        if not release_id:
+            raise ValueError("The 'select-release' action requires a 'release' value!")
+        return self.get_repository(request).select_release(release_id).identifier
+
+    def sum_revision_number(self, name, revision):
+        """
+        Find the revision number of a repository/revision pair for :func:`sum_revisions()`.
+
+        :param name: The name or location of a repository (a string).
+        :param revision: A revision (a string).
+        :returns: The revision number (an integer).
+        """
+        return self.find_revision_number(dict(repository=name, revision=revision))
+
+    def sum_revisions(self, request):
+        """
+        Sum the revision numbers of the repository/revision pairs given by the ``arguments`` value.
+
+        The revision numbers are found using the repository objects of the
+        session (see :func:`sum_revision_number()`) so that they benefit from
+        its caches and helper processes.
+        """
+        arguments = request.get('arguments')
+        if not arguments:
+            raise ValueError("The 'sum-revisions' action requires an 'arguments' value!")
+        if len(arguments) % 2 != 0:
+            raise ValueError("Please provide an even number of arguments! (one or more repository/revision pairs)")
+        return sum(self.sum_revision_number(name, revision)
+                   for name, revision in zip(arguments[0::2], arguments[1::2]))
+
+    def update(self, request):
+        """Create/update the local clone of a remote repository."""
+        self.get_repository(request).update()
+
+    def vcs_control_field(self, request):
+        """Get the Debian control file field of a repository and revision."""
+        return "%s: %s" % self.get_repository(request).generate_control_field(self.get_revision(request))
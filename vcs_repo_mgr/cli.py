@@ -1,7 +1,7 @@
 # Command line interface for vcs-repo-mgr.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: April 29, 2017
+# Last Change: October 16, 2026
 # URL: https://github.com/xolox/python-vcs-repo-mgr
 
 """
@@ -32,6 +32,10 @@ Supported options:
     combination with the --find-revision-number, --find-revision-id and
     --export options.
 
+    The --find-revision-number and --find-revision-id options accept multiple
+    revisions: Repeat this option to select more than one revision (the
+    revisions are resolved together and reported one per line).
+
     If this option is not provided a default revision is selected: `last:1' for
     Bazaar repositories, `master' for git repositories and `default' (not
     `tip'!) for Mercurial repositories.
@@ -49,8 +53,8 @@ Supported options:
 
   -n, --find-revision-number
 
-    Print the local revision number (an integer) of the revision given with the
-    --revision option. Revision numbers are useful as a build number or when a
+    Print the local revision number (an integer) of the revision(s) given with
+    the --revision option. Revision numbers are useful as a build number or when a
     simple, incrementing version number is required. Revision numbers should
     not be used to unambiguously refer to a revision (use revision ids for that
     instead). This option is used in combination with the --repository and
@@ -58,7 +62,7 @@ Supported options:
 
   -i, --find-revision-id
 
-    Print the global revision id (a string) of the revision given with the
+    Print the global revision id (a string) of the revision(s) given with the
     --revision option. Global revision ids are useful to unambiguously refer to
     a revision. This option is used in combination with the --repository and
     --revision options.
@@ -84,7 +88,8 @@ Supported options:
     This is useful when you're building a package based on revisions from
     multiple VCS repositories. By taking changes in all repositories into
     account when generating version numbers you can make sure that your version
-    number is bumped with every single change.
+    number is bumped with every single change. The repositories are queried
+    concurrently (see --concurrency).
 
   --vcs-control-field
 
@@ -99,6 +104,23 @@ Supported options:
     changes from the remote repository. This option is used in combination with
     the --repository option.
 
+  --update-all
+
+    Create/update the local clones of all repositories defined in the
+    configuration files. The positional arguments can be used to select a
+    subset of the configured repositories using shell wildcard patterns.
+
+    Multiple repositories are updated concurrently (see --concurrency). The
+    duration and outcome of each update are printed on standard output and
+    the exit status is nonzero when any of the updates failed.
+
+  --concurrency=COUNT
+
+    The maximum number of repositories that --update-all and --sum-revisions
+    process at the same time and the number of threads used to compress
+    archives created by --export-archive (defaults to 4). This option should be
+    given before --update-all, --sum-revisions and --export-archive.
+
   -m, --merge-up
 
     Merge a change into one or more release branches and the default branch.
@@ -122,6 +144,32 @@ Supported options:
     directory. This option is used in combination with the --repository and
     --revision options.
 
+  --export-archive=FILE
+
+    Export the contents of a specific revision of a repository to an archive.
+    The archive format is selected by the filename extension (.tar, .tar.gz,
+    .tgz, .tar.xz, .txz or .zip). Compressed tar archives are compressed using
+    multiple threads (see --concurrency). This option is used in combination
+    with the --repository and --revision options.
+
+  --batch
+
+    Read requests from standard input and answer them on standard output,
+    one JSON object per line. This avoids the overhead of starting vcs-tool
+    for each query. Please refer to the vcs-repo-mgr documentation of the
+    vcs_repo_mgr.batch module for details.
+
+  --daemon
+
+    Start a long running daemon that answers queries on a UNIX socket, so
+    that the queries of many vcs-tool processes share the same caches. The
+    socket is /run/vcs-repo-mgr.sock unless the environment variable
+    $VCS_REPO_MGR_SOCKET is set. When the socket exists vcs-tool sends the
+    queries of the --find-revision-number, --find-revision-id, --list-releases,
+    --select-release, --sum-revisions and --vcs-control-field options to the
+    daemon and when the daemon can't be reached vcs-tool answers the queries
+    by itself.
+
   -d, --find-directory
 
     Print the absolute pathname of a local repository. This option is used in
@@ -144,22 +192,30 @@ Supported options:
 import functools
 import getopt
 import logging
+import os
 import sys
 
 # External dependencies.
 import coloredlogs
-from executor import execute
 from humanfriendly.terminal import usage, warning
+from humanfriendly.text import pluralize
+from property_manager import PropertyManager, lazy_property, required_property
 
 # Modules included in our package.
-from vcs_repo_mgr import coerce_repository, sum_revision_numbers
+from vcs_repo_mgr import (
+    DEFAULT_CONCURRENCY,
+    coerce_repository,
+    find_configured_repositories,
+    sum_revision_numbers,
+    update_repositories,
+)
+
+# The batch and daemon modules are imported on demand (to keep the startup
+# time of the `vcs-tool' program low).
 
 # Initialize a logger.
 logger = logging.getLogger(__name__)
 
-# Inject our logger into all execute() calls.
-execute = functools.partial(execute, logger=logger)
-
 
 def main():
     """The command line interface of the ``vcs-tool`` program."""
@@ -168,6 +224,9 @@ def main():
     # Command line option defaults.
     repository = None
     revision = None
+    revisions = []
+    revisions_used = False
+    concurrency = DEFAULT_CONCURRENCY
     actions = []
     # Parse the command line arguments.
     try:
@@ -175,16 +234,22 @@ def main():
             'repository=', 'rev=', 'revision=', 'release=', 'find-directory',
             'find-revision-number', 'find-revision-id', 'list-releases',
             'select-release=', 'sum-revisions', 'vcs-control-field', 'update',
-            'merge-up', 'export=', 'verbose', 'quiet', 'help',
+            'update-all', 'concurrency=', 'merge-up', 'export=', 'export-archive=', 'verbose',
+            'batch', 'daemon', 'quiet', 'help',
         ])
         for option, value in options:
             if option in ('-r', '--repository'):
                 value = value.strip()
                 assert value, "Please specify the name of a repository! (using -r, --repository)"
-                repository = coerce_repository(value)
+                repository = RepositoryArgument(location=value)
             elif option in ('--rev', '--revision'):
                 revision = value.strip()
                 assert revision, "Please specify a nonempty revision string!"
+                # Revisions given after --find-revision-number or
+                # --find-revision-id start a new list of revisions.
+                if revisions_used:
+                    revisions, revisions_used = [], False
+                revisions.append(revision)
             elif option == '--release':
                 # TODO Right now --release and --merge-up cannot be combined
                 #      because the following statements result in a global
@@ -194,17 +259,24 @@ def main():
                 #      --release and --merge-up.
                 assert repository, "Please specify a repository first!"
                 release_id = value.strip()
-                assert release_id in repository.releases, "The given release identifier is invalid!"
-                revision = repository.releases[release_id].revision.revision_id
+                assert release_id, "Please specify a nonempty release identifier!"
+                # The release is translated to a revision id when it's used
+                # (by the daemon when it's available).
+                revision = dict(release=release_id)
+                if revisions_used:
+                    revisions, revisions_used = [], False
+                revisions.append(revision)
             elif option in ('-d', '--find-directory'):
                 assert repository, "Please specify a repository first!"
                 actions.append(functools.partial(print_directory, repository))
             elif option in ('-n', '--find-revision-number'):
                 assert repository, "Please specify a repository first!"
-                actions.append(functools.partial(print_revision_number, repository, revision))
+                actions.append(functools.partial(print_revision_numbers, repository, revisions or [None]))
+                revisions_used = True
             elif option in ('-i', '--find-revision-id'):
                 assert repository, "Please specify a repository first!"
-                actions.append(functools.partial(print_revision_id, repository, revision))
+                actions.append(functools.partial(print_revision_ids, repository, revisions or [None]))
+                revisions_used = True
             elif option == '--list-releases':
                 assert repository, "Please specify a repository first!"
                 actions.append(functools.partial(print_releases, repository))
@@ -215,18 +287,24 @@ def main():
                 actions.append(functools.partial(print_selected_release, repository, release_id))
             elif option in ('-s', '--sum-revisions'):
                 assert len(arguments) >= 2, "Please specify one or more repository/revision pairs!"
-                actions.append(functools.partial(print_summed_revisions, arguments))
+                actions.append(functools.partial(print_summed_revisions, arguments, concurrency))
                 arguments = []
             elif option == '--vcs-control-field':
                 assert repository, "Please specify a repository first!"
                 actions.append(functools.partial(print_vcs_control_field, repository, revision))
             elif option in ('-u', '--update'):
                 assert repository, "Please specify a repository first!"
-                actions.append(functools.partial(repository.update))
+                actions.append(functools.partial(update_repository, repository))
+            elif option == '--update-all':
+                actions.append(functools.partial(update_all_repositories, arguments, concurrency))
+                arguments = []
+            elif option == '--concurrency':
+                assert value.isdigit() and int(value) > 0, "Please specify a positive integer! (using --concurrency)"
+                concurrency = int(value)
             elif option in ('-m', '--merge-up'):
                 assert repository, "Please specify a repository first!"
                 actions.append(functools.partial(
-                    repository.merge_up,
+                    merge_up, repository,
                     target_branch=revision,
                     feature_branch=arguments[0] if arguments else None,
                 ))
@@ -234,7 +312,16 @@ def main():
                 directory = value.strip()
                 assert repository, "Please specify a repository first!"
                 assert directory, "Please specify the directory where the revision should be exported!"
-                actions.append(functools.partial(repository.export, directory, revision))
+                actions.append(functools.partial(export_revision, repository, directory, revision))
+            elif option == '--export-archive':
+                filename = value.strip()
+                assert repository, "Please specify a repository first!"
+                assert filename, "Please specify the filename of the archive!"
+                actions.append(functools.partial(export_archive, repository, filename, revision, concurrency))
+            elif option == '--batch':
+                actions.append(run_batch_session)
+            elif option == '--daemon':
+                actions.append(run_daemon)
             elif option in ('-v', '--verbose'):
                 coloredlogs.increase_verbosity()
             elif option in ('-q', '--quiet'):
@@ -257,36 +344,181 @@ def main():
         sys.exit(1)
 
 
-def print_directory(repository):
+class RepositoryArgument(PropertyManager):
+
+    """
+    A repository given on the command line.
+
+    The :class:`~vcs_repo_mgr.Repository` object is only constructed when
+    it's needed, so queries that are answered by the daemon don't pay the
+    price of parsing configuration files and listing releases.
+    """
+
+    @required_property
+    def location(self):
+        """The name or location of the repository given on the command line (a string)."""
+
+    @lazy_property
+    def name(self):
+        """The name or location of the repository that is sent to the daemon (see :func:`normalize_location()`)."""
+        return normalize_location(self.location)
+
+    @lazy_property(repr=False)
+    def repository(self):
+        """The :class:`~vcs_repo_mgr.Repository` object (created using :func:`~vcs_repo_mgr.coerce_repository()`)."""
+        return coerce_repository(self.location)
+
+    def resolve_revision(self, revision):
+        """
+        Translate a release selected using ``--release`` to a revision id.
+
+        :param revision: A revision (a string), a dictionary with a ``release``
+                         value or :data:`None`.
+        :returns: A revision (a string) or :data:`None`.
+        :raises: :exc:`~exceptions.ValueError` when the release identifier is invalid.
+        """
+        if isinstance(revision, dict):
+            release_id = revision['release']
+            if release_id not in self.repository.releases:
+                raise ValueError("The given release identifier is invalid!")
+            return self.repository.releases[release_id].revision.revision_id
+        return revision
+
+
+def run_batch_session():
+    """Answer JSON requests on standard input until the end of the input is reached."""
+    from vcs_repo_mgr.batch import BatchSession
+    BatchSession().run(sys.stdin, sys.stdout)
+
+
+def run_daemon():
+    """Answer JSON requests on a UNIX socket until interrupted."""
+    from vcs_repo_mgr.daemon import QueryDaemon
+    QueryDaemon().serve_forever()
+
+
+def normalize_location(value):
+    """
+    Prepare a repository name or location to be sent to the daemon.
+
+    :param value: The name or location of a repository (a string).
+    :returns: The absolute pathname of a local directory or the given value
+              (because the daemon doesn't share our working directory).
+    """
+    return os.path.abspath(value) if os.path.isdir(value) else value
+
+
+def query(action, **request):
+    """
+    Try to answer a query using the daemon.
+
+    :param action: The name of the action (a string).
+    :param request: The other values of the request.
+    :returns: The result of the query or :data:`None` when the daemon isn't
+              available or failed to answer the query (in which case the
+              caller should answer the query by itself).
+    """
+    from vcs_repo_mgr.daemon import query_daemon
+    request['action'] = action
+    response = query_daemon(request)
+    if response is not None:
+        if 'result' in response:
+            return response['result']
+        logger.debug("Daemon failed to answer query, falling back to direct execution: %s", response.get('error'))
+
+
+def print_directory(argument):
     """Report the local directory of a repository to standard output."""
-    print(repository.local)
+    print(argument.repository.local)
 
 
-def print_revision_number(repository, revision):
-    """Report the revision number of the given revision to standard output."""
-    print(repository.find_revision_number(revision))
+def print_revision_numbers(argument, revisions):
+    """Report the revision numbers of the given revisions to standard output."""
+    numbers = query('find-revision-number', repository=argument.name, revisions=revisions)
+    if numbers is None:
+        revisions = [argument.resolve_revision(r) for r in revisions]
+        numbers = [revision.revision_number for revision in argument.repository.resolve_revisions(revisions)]
+    for number in numbers:
+        print(number)
 
 
-def print_revision_id(repository, revision):
-    """Report the revision id of the given revision to standard output."""
-    print(repository.find_revision_id(revision))
+def print_revision_ids(argument, revisions):
+    """Report the revision ids of the given revisions to standard output."""
+    revision_ids = query('find-revision-id', repository=argument.name, revisions=revisions)
+    if revision_ids is None:
+        revisions = [argument.resolve_revision(r) for r in revisions]
+        revision_ids = [r.revision_id for r in argument.repository.resolve_revisions(revisions, numbers=False)]
+    for revision_id in revision_ids:
+        print(revision_id)
 
 
-def print_selected_release(repository, release_id):
+def print_selected_release(argument, release_id):
     """Report the identifier of the given release to standard output."""
-    print(repository.select_release(release_id).identifier)
+    identifier = query('select-release', repository=argument.name, release=release_id)
+    if identifier is None:
+        identifier = argument.repository.select_release(release_id).identifier
+    print(identifier)
 
 
-def print_releases(repository):
+def print_releases(argument):
     """Report the identifiers of all known releases of the given repository to standard output."""
-    print('\n'.join(release.identifier for release in repository.ordered_releases))
+    identifiers = query('list-releases', repository=argument.name)
+    if identifiers is None:
+        identifiers = [release.identifier for release in argument.repository.ordered_releases]
+    print('\n'.join(identifiers))
 
 
-def print_summed_revisions(arguments):
+def print_summed_revisions(arguments, concurrency):
     """Report the summed revision numbers for the given arguments to standard output."""
-    print(sum_revision_numbers(arguments))
+    total = query('sum-revisions', arguments=[
+        normalize_location(value) if i % 2 == 0 else value
+        for i, value in enumerate(arguments)
+    ])
+    if total is None:
+        total = sum_revision_numbers(arguments, concurrency=concurrency)
+    print(total)
+
+
+def update_all_repositories(patterns, concurrency):
+    """Update the configured repositories and report the outcome of each update to standard output."""
+    names = find_configured_repositories(patterns)
+    if not names:
+        warning("No configured repositories found matching the given pattern(s)!")
+        sys.exit(1)
+    results = update_repositories(names, concurrency=concurrency)
+    for result in results:
+        print(result)
+    failed = [r for r in results if not r.succeeded]
+    if failed:
+        warning("Failed to update %s!", pluralize(len(failed), "repository", "repositories"))
+        sys.exit(1)
 
 
-def print_vcs_control_field(repository, revision):
+def print_vcs_control_field(argument, revision):
     """Report the VCS control field for the given repository and revision to standard output."""
-    print("%s: %s" % repository.generate_control_field(revision))
+    selector = revision if isinstance(revision, dict) else dict(revision=revision)
+    field = query('vcs-control-field', repository=argument.name, **selector)
+    if field is None:
+        field = "%s: %s" % argument.repository.generate_control_field(argument.resolve_revision(revision))
+    print(field)
+
+
+def update_repository(argument):
+    """Create/update the local clone of a remote repository."""
+    argument.repository.update()
+
+
+def merge_up(argument, target_branch, feature_branch):
+    """Merge a change into one or more release branches and the default branch."""
+    argument.repository.merge_up(target_branch=argument.resolve_revision(target_branch),
+                                 feature_branch=feature_branch)
+
+
+def export_revision(argument, directory, revision):
+    """Export a revision of a repository to a local directory."""
+    argument.repository.export(directory, argument.resolve_revision(revision))
+
+
+def export_archive(argument, filename, revision, concurrency):
+    """Export a revision of a repository to an archive file."""
+    argument.repository.export_archive(filename, argument.resolve_revision(revision), concurrency=concurrency)
@@ -0,0 +1,410 @@
+# Version control system repository manager.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/xolox/python-vcs-repo-mgr
+
+"""
+Answer repository queries from a long running daemon over a UNIX socket.
+
+When many build jobs on the same host query the same repositories, each
+``vcs-tool`` process pays the price of starting a Python interpreter, parsing
+the configuration files and listing branches and tags on its own. The
+``vcs-tool --daemon`` command starts a :class:`QueryDaemon` that listens on a
+UNIX socket (see :func:`find_socket_path()`) and answers the same newline
+delimited JSON requests as ``vcs-tool --batch`` (refer to the documentation of
+the :mod:`vcs_repo_mgr.batch` module for details about the protocol).
+
+The daemon keeps its :class:`~vcs_repo_mgr.Repository` objects (and so their
+caches and helper processes) for as long as it runs:
+
+- Requests are handled by a thread per connection. Requests for the same
+  repository are serialized (repository objects aren't meant to be used from
+  multiple threads at the same time) and identical requests that arrive while
+  the first of them is still being handled share its response.
+
+- The configuration files are checked before every request (using
+  :func:`~vcs_repo_mgr.get_configuration_fingerprint()`) and when they've
+  changed the repository objects are discarded so that the new configuration
+  takes effect.
+
+- Only queries are supported (see :attr:`DaemonSession.actions`), requests
+  that would modify the filesystem (like ``update`` and ``export``) are
+  rejected because they would run with the privileges of the daemon. For the
+  same reason only repositories defined in the configuration files of the
+  daemon are accepted (not arbitrary locations) and their local clones must
+  already exist (the daemon never creates them).
+
+- The socket is only accessible to the user running the daemon (see
+  :attr:`QueryDaemon.socket_mode` and :attr:`QueryDaemon.socket_group`).
+
+When the socket exists ``vcs-tool`` transparently sends its queries to the
+daemon (see :func:`query_daemon()`) and when the daemon can't be reached it
+falls back to answering the queries by itself. Each request includes the
+fingerprint of the configuration files of the client and the daemon refuses
+requests from clients whose configuration differs from its own, so that
+``vcs-tool`` never gives answers based on another user's configuration.
+"""
+
+# Standard library modules.
+import json
+import logging
+import os
+import socket
+import threading
+
+# External dependencies.
+from executor.contexts import LocalContext
+from humanfriendly import format_path, parse_path
+from property_manager import PropertyManager, lazy_property, mutable_property
+from six.moves import socketserver
+
+# Modules included in our package.
+from vcs_repo_mgr import find_configured_repository, get_configuration_fingerprint
+from vcs_repo_mgr.batch import BatchSession
+
+# Public identifiers that require documentation.
+__all__ = (
+    'DEFAULT_SOCKET',
+    'DaemonSession',
+    'PendingResponse',
+    'QueryDaemon',
+    'SOCKET_VARIABLE',
+    'find_socket_path',
+    'query_daemon',
+)
+
+DEFAULT_SOCKET = '/run/vcs-repo-mgr.sock'
+"""The default pathname of the UNIX socket of the daemon (a string)."""
+
+SOCKET_VARIABLE = 'VCS_REPO_MGR_SOCKET'
+"""The name of the environment variable that overrides :data:`DEFAULT_SOCKET` (a string)."""
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+
+def find_socket_path():
+    """
+    Find the pathname of the UNIX socket of the daemon.
+
+    :returns: The value of the environment variable :data:`SOCKET_VARIABLE`
+              or :data:`DEFAULT_SOCKET` (a string, parsed using
+              :func:`~humanfriendly.parse_path()`).
+    """
+    return parse_path(os.environ.get(SOCKET_VARIABLE) or DEFAULT_SOCKET)
+
+
+def query_daemon(request, socket_path=None):
+    """
+    Send a request to the daemon and wait for the response.
+
+    :param request: The request (a dictionary, refer to :mod:`vcs_repo_mgr.batch`).
+    :param socket_path: The pathname of the UNIX socket (a string, defaults
+                        to the value returned by :func:`find_socket_path()`).
+    :returns: The response (a dictionary) or :data:`None` when the socket
+              doesn't exist or the daemon can't be reached.
+
+    The result of :func:`~vcs_repo_mgr.get_configuration_fingerprint()` is
+    added to the request (as the ``configuration`` value) so that the daemon
+    can refuse to answer when its configuration differs.
+    """
+    socket_path = socket_path or find_socket_path()
+    if not os.path.exists(socket_path):
+        return None
+    request = dict(request, configuration=get_configuration_fingerprint())
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.connect(socket_path)
+            client.sendall((json.dumps(request) + '\n').encode('UTF-8'))
+            line = client.makefile('rb').readline()
+        finally:
+            client.close()
+        return json.loads(line.decode('UTF-8'))
+    except Exception as e:
+        logger.debug("Failed to query daemon at %s! (%s)", format_path(socket_path), e)
+        return None
+
+
+class DaemonSession(BatchSession):
+
+    """
+    A :class:`~vcs_repo_mgr.batch.BatchSession` that can be shared between threads.
+
+    The locks and the bookkeeping of pending requests are initialized by
+    :func:`__init__()` because lazy initialization wouldn't be thread safe.
+    """
+
+    def __init__(self, **options):
+        """
+        Initialize a :class:`DaemonSession` object.
+
+        :param options: Any keyword arguments are used to set the values of
+                        the properties of the :class:`DaemonSession` object.
+        """
+        super(DaemonSession, self).__init__(**options)
+        for name in 'lock', 'pending', 'repositories', 'repository_locks':
+            getattr(self, name)
+
+    @lazy_property
+    def actions(self):
+        """
+        A dictionary that maps action names to methods of :class:`DaemonSession`.
+
+        The supported actions are ``find-directory``, ``find-revision-id``,
+        ``find-revision-number``, ``list-releases``, ``select-release``,
+        ``sum-revisions`` and ``vcs-control-field``.
+        """
+        return {
+            'find-directory': self.find_directory,
+            'find-revision-id': self.find_revision_id,
+            'find-revision-number': self.find_revision_number,
+            'list-releases': self.list_releases,
+            'select-release': self.select_release,
+            'sum-revisions': self.sum_revisions,
+            'vcs-control-field': self.vcs_control_field,
+        }
+
+    @mutable_property
+    def configuration_fingerprint(self):
+        """The result of :func:`~vcs_repo_mgr.get_configuration_fingerprint()` when the configuration was loaded."""
+
+    @lazy_property(repr=False)
+    def lock(self):
+        """A :class:`threading.Lock` object that protects the shared state of the session."""
+        return threading.Lock()
+
+    @lazy_property(repr=False)
+    def pending(self):
+        """A dictionary that maps request keys to :class:`PendingResponse` objects."""
+        return {}
+
+    @lazy_property(repr=False)
+    def repository_locks(self):
+        """A dictionary that maps repository names to :class:`threading.Lock` objects."""
+        return {}
+
+    def check_configuration(self):
+        """
+        Discard the repository objects when the configuration files have changed.
+
+        The helper processes of the discarded repositories are stopped while
+        holding the lock of the repository, so that requests that are still
+        using them aren't disrupted.
+        """
+        fingerprint = get_configuration_fingerprint()
+        with self.lock:
+            if fingerprint == self.configuration_fingerprint:
+                return
+            if self.configuration_fingerprint is not None:
+                logger.info("Configuration files changed, discarding %i repositories ..", len(self.repositories))
+            self.configuration_fingerprint = fingerprint
+            discarded = list(self.repositories.items())
+            self.repositories.clear()
+        for name, repository in discarded:
+            with self.get_repository_lock(name):
+                repository.stop_helpers()
+
+    def find_repository(self, name):
+        """
+        Find a repository defined in the configuration files.
+
+        :param name: The name of a repository (a string).
+        :returns: The result of :func:`~vcs_repo_mgr.find_configured_repository()`.
+        :raises: :exc:`~vcs_repo_mgr.exceptions.NoSuchRepositoryError` when
+                 the name doesn't match a configured repository (arbitrary
+                 locations aren't accepted by the daemon).
+        """
+        return find_configured_repository(name)
+
+    def get_repository(self, request):
+        """
+        Get the repository selected by a request (while holding :attr:`lock`).
+
+        :raises: :exc:`~exceptions.ValueError` when the local clone of the
+                 repository doesn't exist (because the daemon never creates
+                 local clones).
+        """
+        with self.lock:
+            repository = super(DaemonSession, self).get_repository(request)
+        if isinstance(repository.context, LocalContext):
+            exists = os.path.isdir(repository.vcs_directory)
+        else:
+            exists = repository.exists
+        if not exists:
+            raise ValueError("The local repository %s doesn't exist (the daemon doesn't create repositories)!"
+                             % format_path(repository.local))
+        return repository
+
+    def get_repository_lock(self, name):
+        """
+        Get the lock that serializes the requests for a repository.
+
+        :param name: The name or location of a repository (a string).
+        :returns: A :class:`threading.Lock` object.
+        """
+        with self.lock:
+            if name not in self.repository_locks:
+                self.repository_locks[name] = threading.Lock()
+            return self.repository_locks[name]
+
+    def handle(self, request):
+        """
+        Handle a single request (coalescing identical concurrent requests).
+
+        :param request: The request (a dictionary).
+        :returns: The response (a dictionary).
+        """
+        if not isinstance(request, dict):
+            return super(DaemonSession, self).handle(request)
+        self.check_configuration()
+        request = dict(request)
+        request_id = request.pop('id', None)
+        # JSON doesn't distinguish tuples from lists.
+        expected_configuration = json.loads(json.dumps(self.configuration_fingerprint))
+        if request.pop('configuration', None) != expected_configuration:
+            response = dict(error="The configuration of the client differs from the configuration of the daemon!")
+            if request_id is not None:
+                response['id'] = request_id
+            return response
+        key = json.dumps(request, sort_keys=True)
+        with self.lock:
+            pending = self.pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = PendingResponse()
+                self.pending[key] = pending
+        if owner:
+            try:
+                name = request.get('repository')
+                if name:
+                    with self.get_repository_lock(name):
+                        pending.response = super(DaemonSession, self).handle(request)
+                else:
+                    pending.response = super(DaemonSession, self).handle(request)
+            finally:
+                with self.lock:
+                    self.pending.pop(key, None)
+                pending.event.set()
+        else:
+            logger.debug("Waiting for response to identical request %s ..", key)
+            pending.event.wait()
+        response = dict(pending.response or dict(error="Failed to handle request!"))
+        if request_id is not None:
+            response['id'] = request_id
+        return response
+
+    def sum_revision_number(self, name, revision):
+        """
+        Find the revision number of a repository/revision pair for :func:`~.BatchSession.sum_revisions()`.
+
+        Unlike :func:`.BatchSession.sum_revision_number()` the revision number
+        is found while holding the lock of the repository.
+        """
+        with self.get_repository_lock(name):
+            return super(DaemonSession, self).sum_revision_number(name, revision)
+
+
+class PendingResponse(object):
+
+    """The response to a request that is being handled by :class:`DaemonSession`."""
+
+    def __init__(self):
+        """Initialize a :class:`PendingResponse` object."""
+        self.event = threading.Event()
+        self.response = None
+
+
+class QueryDaemon(PropertyManager):
+
+    """Serve a :class:`DaemonSession` on a UNIX socket."""
+
+    @mutable_property(repr=False)
+    def server(self):
+        """The :class:`ThreadingUnixStreamServer` while :func:`serve_forever()` is running (or :data:`None`)."""
+
+    @lazy_property(repr=False)
+    def session(self):
+        """The :class:`DaemonSession` that answers the requests."""
+        return DaemonSession()
+
+    @mutable_property
+    def socket_group(self):
+        """
+        The name or id of a group that should be able to use the socket (a string, integer or :data:`None`).
+
+        When this is set the group of the socket is changed and the
+        :attr:`socket_mode` should allow the group to read and write (for
+        example ``0o660``).
+        """
+
+    @mutable_property
+    def socket_mode(self):
+        """The permissions of the UNIX socket (an integer, defaults to ``0o600``)."""
+        return 0o600
+
+    @mutable_property
+    def socket_path(self):
+        """The pathname of the UNIX socket (a string, defaults to the value returned by :func:`find_socket_path()`)."""
+        return find_socket_path()
+
+    def serve_forever(self):
+        """
+        Answer requests until the daemon is interrupted (or :func:`shutdown()` is called).
+
+        A stale socket left behind by a previous daemon is removed, however
+        if another daemon is still listening on the socket :exc:`~exceptions.ValueError`
+        is raised. The permissions of the socket are set according to
+        :attr:`socket_mode` and :attr:`socket_group`. The socket is removed
+        when the daemon stops.
+        """
+        if os.path.exists(self.socket_path):
+            if query_daemon(dict(action='ping'), socket_path=self.socket_path) is not None:
+                raise ValueError("Another daemon is already listening on %s!" % format_path(self.socket_path))
+            logger.debug("Removing stale socket %s ..", format_path(self.socket_path))
+            os.unlink(self.socket_path)
+        session = self.session
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in iter(self.rfile.readline, b''):
+                    response = session.handle_line(line.decode('UTF-8'))
+                    if response:
+                        self.wfile.write(response.encode('UTF-8'))
+                        self.wfile.flush()
+
+        # Make sure the socket is never accessible to other users, not even
+        # between binding the socket and changing its permissions.
+        old_umask = os.umask(0o177)
+        try:
+            self.server = ThreadingUnixStreamServer(self.socket_path, RequestHandler)
+        finally:
+            os.umask(old_umask)
+        if self.socket_group is not None:
+            group = self.socket_group
+            if not isinstance(group, int):
+                import grp
+                group = grp.getgrnam(group).gr_gid
+            os.chown(self.socket_path, -1, group)
+        os.chmod(self.socket_path, self.socket_mode)
+        logger.info("Listening for requests on %s ..", format_path(self.socket_path))
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.server = None
+            os.unlink(self.socket_path)
+            session.close()
+
+    def shutdown(self):
+        """Make :func:`serve_forever()` return (from another thread)."""
+        if self.server is not None:
+            self.server.shutdown()
+
+
+class ThreadingUnixStreamServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    """A UNIX socket server that handles each connection in a separate thread."""
+
+    daemon_threads = True
@@ -0,0 +1,361 @@
+# Version control system repository manager.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/xolox/python-vcs-repo-mgr
+
+"""
+Cache exported trees so that repeated exports don't need to run the VCS.
+
+Build jobs tend to export the same release revisions over and over again.
+The :class:`ExportCache` class keeps a copy of every tree it exports in a
+cache directory, keyed by the id of the tree (see
+:func:`.Repository.find_tree_id()`). When the same tree is exported again the
+cached files are cloned (or copied) into the target directory instead of
+extracting an archive produced by the version control system.
+
+The cache is opt-in: :attr:`.Repository.export_cache` is only set when the
+environment variable ``$VCS_REPO_MGR_EXPORT_CACHE`` is defined (see
+:func:`ExportCache.from_environment()`). Multiple processes can safely share
+a cache directory because new trees are extracted into a temporary directory
+and renamed into place. When a tree is evicted by another process while it's
+being exported the export falls back to extracting an archive.
+
+.. warning:: Hard links (which are opt-in, see :attr:`~ExportCache.link_mode`)
+             share their contents and metadata with the cache, so a program
+             that modifies an exported file in place (or changes its
+             permissions) also modifies the cached copy.
+"""
+
+# Standard library modules.
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+# External dependencies.
+from humanfriendly import Timer, format_path, format_size, parse_path, parse_size
+from humanfriendly.text import pluralize
+from property_manager import PropertyManager, mutable_property, required_property
+
+# Modules included in our package.
+from vcs_repo_mgr import HEX_PATTERN
+
+# Public identifiers that require documentation.
+__all__ = (
+    'DEFAULT_SIZE_LIMIT',
+    'EXPORT_CACHE_VARIABLE',
+    'ExportCache',
+    'LINK_MODES',
+    'LINK_MODE_VARIABLE',
+    'SIZE_LIMIT_VARIABLE',
+)
+
+DEFAULT_SIZE_LIMIT = 1024 ** 3 * 10
+"""The default maximum size of an export cache in bytes (an integer, 10 GiB)."""
+
+EXPORT_CACHE_VARIABLE = 'VCS_REPO_MGR_EXPORT_CACHE'
+"""The name of the environment variable that enables the export cache by setting its directory (a string)."""
+
+LINK_MODES = ('reflink', 'copy', 'hardlink')
+"""The supported values of :attr:`ExportCache.link_mode` (a tuple of strings)."""
+
+LINK_MODE_VARIABLE = 'VCS_REPO_MGR_EXPORT_CACHE_LINKS'
+"""The name of the environment variable that sets :attr:`ExportCache.link_mode` (a string)."""
+
+SIZE_LIMIT_VARIABLE = 'VCS_REPO_MGR_EXPORT_CACHE_SIZE'
+"""The name of the environment variable that sets :attr:`ExportCache.size_limit` (a string)."""
+
+FICLONE = 0x40049409
+"""The Linux ``ioctl()`` request that creates a reflink (copy on write) copy of a file."""
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+
+class ExportCache(PropertyManager):
+
+    """A size limited cache of exported trees, with least recently used eviction."""
+
+    @classmethod
+    def from_environment(cls):
+        """
+        Create an :class:`ExportCache` based on environment variables.
+
+        :returns: An :class:`ExportCache` object or :data:`None` when the
+                  environment variable :data:`EXPORT_CACHE_VARIABLE` isn't set.
+
+        The environment variables :data:`SIZE_LIMIT_VARIABLE` (a size like
+        ``5 GB``, parsed using :func:`~humanfriendly.parse_size()`) and
+        :data:`LINK_MODE_VARIABLE` (one of the values in :data:`LINK_MODES`)
+        can be used to configure the cache.
+        """
+        directory = os.environ.get(EXPORT_CACHE_VARIABLE)
+        if directory:
+            options = dict(directory=parse_path(directory))
+            if os.environ.get(SIZE_LIMIT_VARIABLE):
+                options['size_limit'] = parse_size(os.environ[SIZE_LIMIT_VARIABLE])
+            if os.environ.get(LINK_MODE_VARIABLE):
+                options['link_mode'] = os.environ[LINK_MODE_VARIABLE]
+            return cls(**options)
+
+    @required_property
+    def directory(self):
+        """The pathname of the directory where exported trees are cached (a string)."""
+
+    @mutable_property
+    def hits(self):
+        """The number of exports that were satisfied from the cache (an integer)."""
+        return 0
+
+    @mutable_property
+    def link_mode(self):
+        """
+        How cached files are put into export directories (a string, one of :data:`LINK_MODES`).
+
+        ``reflink`` (the default)
+         Create copy on write clones of the cached files, this requires a
+         file system that supports reflinks (like Btrfs or XFS).
+
+        ``copy``
+         Copy the contents of the cached files.
+
+        ``hardlink``
+         Hard link the cached files, which is the fastest option but shares
+         the contents of the files with the cache (see the warning above).
+
+        When a file can't be cloned or hard linked (for example because the
+        file system doesn't support reflinks or the export directory is on a
+        different file system) it's copied instead.
+        """
+        return 'reflink'
+
+    @mutable_property
+    def misses(self):
+        """The number of exports that required extracting an archive (an integer)."""
+        return 0
+
+    @mutable_property
+    def size_limit(self):
+        """
+        The maximum size of the cache in bytes (an integer, defaults to :data:`DEFAULT_SIZE_LIMIT`).
+
+        When adding a tree pushes the total size of the cache over this limit
+        the least recently used trees are evicted (the tree that was just
+        added is always kept).
+        """
+        return DEFAULT_SIZE_LIMIT
+
+    def export(self, repository, revision, directory):
+        """
+        Export a revision using the cache.
+
+        :param repository: The :class:`~vcs_repo_mgr.Repository` object.
+        :param revision: The revision to export (a string).
+        :param directory: The absolute pathname of the directory where the
+                          tree should be exported (a string).
+
+        When the tree isn't cached yet it's extracted into the cache (using
+        :func:`.Repository.extract_archive()`) before it's linked into the
+        export directory. When the tree is evicted from the cache (by another
+        process) while it's being linked, the revision is exported using
+        :func:`.Repository.extract_archive()` instead.
+        """
+        if self.link_mode not in LINK_MODES:
+            raise ValueError("Unsupported link mode! (%r)" % self.link_mode)
+        revision_id = repository.find_revision_id(revision)
+        key = self.get_key(repository, revision_id)
+        entry = os.path.join(self.directory, key)
+        if self.touch(key):
+            logger.debug("Found tree of revision %s in export cache (%s).", revision_id, format_path(entry))
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.store(repository, revision_id, key)
+            self.prune(keep=key)
+        try:
+            self.link_tree(entry, directory)
+            # The metadata file is removed before a tree is evicted.
+            complete = os.path.isfile(entry + '.json')
+        except EnvironmentError as e:
+            logger.debug("Failed to link tree from export cache! (%s)", e)
+            complete = False
+        if not complete:
+            logger.info("Tree of revision %s was evicted from export cache, extracting archive instead ..",
+                        revision_id)
+            repository.extract_archive(repository.get_archive_command(revision_id), directory)
+
+    def get_key(self, repository, revision_id):
+        """
+        Get the key that identifies the tree of a revision.
+
+        :param repository: The :class:`~vcs_repo_mgr.Repository` object.
+        :param revision_id: A global revision id (a string).
+        :returns: A string that's safe to use as a filename.
+
+        The key is based on :func:`.Repository.find_tree_id()` when the
+        backend supports it, otherwise on the global revision id.
+        """
+        try:
+            kind, value = 'tree', repository.find_tree_id(revision_id)
+        except NotImplementedError:
+            kind, value = 'revision', revision_id
+        if not HEX_PATTERN.match(value):
+            value = hashlib.sha1(value.encode('UTF-8')).hexdigest()
+        return '%s-%s-%s' % (repository.ALIASES[0], kind, value.lower())
+
+    def link_file(self, source, target):
+        """
+        Link (or copy) a cached file into an export directory.
+
+        :param source: The pathname of the cached file (a string).
+        :param target: The pathname of the exported file (a string).
+        """
+        if self.link_mode == 'hardlink':
+            try:
+                os.link(source, target)
+                return
+            except OSError as e:
+                logger.debug("Failed to hard link %s, copying instead! (%s)", format_path(target), e)
+        elif self.link_mode == 'reflink':
+            try:
+                import fcntl
+                with open(source, 'rb') as input_handle:
+                    with open(target, 'wb') as output_handle:
+                        fcntl.ioctl(output_handle.fileno(), FICLONE, input_handle.fileno())
+                shutil.copystat(source, target)
+                return
+            except (ImportError, IOError, OSError) as e:
+                logger.debug("Failed to clone %s, copying instead! (%s)", format_path(target), e)
+        shutil.copy2(source, target)
+
+    def link_tree(self, source, target):
+        """
+        Link (or copy) a cached tree into an export directory.
+
+        :param source: The pathname of the cached tree (a string).
+        :param target: The pathname of the export directory (a string).
+        :raises: Any exceptions raised by :func:`os.walk()` (for example
+                 because the tree was removed from the cache).
+
+        Existing files in the export directory are replaced.
+        """
+        for root, directories, filenames in os.walk(source, onerror=self.raise_error):
+            target_directory = os.path.normpath(os.path.join(target, os.path.relpath(root, source)))
+            if not os.path.isdir(target_directory):
+                os.makedirs(target_directory)
+            # os.walk() doesn't follow symbolic links to directories, but
+            # reports them as directories, so we handle them like files.
+            for name in directories + filenames:
+                pathname = os.path.join(root, name)
+                if os.path.isdir(pathname) and not os.path.islink(pathname):
+                    continue
+                target_file = os.path.join(target_directory, name)
+                if os.path.lexists(target_file):
+                    os.unlink(target_file)
+                if os.path.islink(pathname):
+                    os.symlink(os.readlink(pathname), target_file)
+                else:
+                    self.link_file(pathname, target_file)
+
+    def prune(self, keep=None):
+        """
+        Evict the least recently used trees until the cache fits in :attr:`size_limit`.
+
+        :param keep: The key of a tree that shouldn't be evicted (a string or :data:`None`).
+        """
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.json'):
+                key = filename[:-len('.json')]
+                metadata_file = os.path.join(self.directory, filename)
+                try:
+                    with open(metadata_file) as handle:
+                        size = json.load(handle)['size']
+                    entries.append((os.path.getmtime(metadata_file), key, size))
+                except Exception as e:
+                    logger.debug("Ignoring invalid export cache metadata %s! (%s)", format_path(metadata_file), e)
+        total_size = sum(size for mtime, key, size in entries)
+        for mtime, key, size in sorted(entries):
+            if total_size <= self.size_limit:
+                break
+            if key != keep:
+                logger.info("Evicting %s (%s) from export cache ..", key, format_size(size))
+                self.remove(key)
+                total_size -= size
+
+    def raise_error(self, exception):
+        """Re-raise the exceptions reported by :func:`os.walk()` (which are ignored by default)."""
+        raise exception
+
+    def remove(self, key):
+        """
+        Remove a tree from the cache.
+
+        :param key: The key of the tree (a string).
+
+        The metadata file is removed first so that other processes stop using
+        the tree, then the tree is renamed out of the way before it's deleted.
+        """
+        entry = os.path.join(self.directory, key)
+        try:
+            os.unlink(entry + '.json')
+            trash = tempfile.mkdtemp(prefix=key + '.', suffix='.trash', dir=self.directory)
+            os.rename(entry, os.path.join(trash, key))
+        except OSError as e:
+            # Another process may have removed the tree already.
+            if e.errno != errno.ENOENT:
+                raise
+        else:
+            shutil.rmtree(trash, ignore_errors=True)
+
+    def store(self, repository, revision_id, key):
+        """
+        Extract the tree of a revision into the cache.
+
+        :param repository: The :class:`~vcs_repo_mgr.Repository` object.
+        :param revision_id: The global revision id to extract (a string).
+        :param key: The key of the tree (a string).
+        """
+        timer = Timer()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        entry = os.path.join(self.directory, key)
+        temporary_directory = tempfile.mkdtemp(prefix=key + '.', suffix='.tmp', dir=self.directory)
+        try:
+            extractor = repository.extract_archive(repository.get_archive_command(revision_id), temporary_directory)
+            try:
+                os.rename(temporary_directory, entry)
+            except OSError as e:
+                # Another process may have stored the same tree concurrently.
+                if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                    raise
+                logger.debug("Tree of revision %s was cached concurrently.", revision_id)
+        finally:
+            shutil.rmtree(temporary_directory, ignore_errors=True)
+        # Write the metadata file atomically, it marks the tree as complete.
+        handle = tempfile.NamedTemporaryFile(mode='w', prefix=key + '.', suffix='.tmp',
+                                             dir=self.directory, delete=False)
+        with handle:
+            json.dump(dict(files=extractor.num_files, size=extractor.num_bytes), handle)
+        os.rename(handle.name, entry + '.json')
+        logger.debug("Took %s to add %s (%s) to export cache.", timer,
+                     pluralize(extractor.num_files, "file"),
+                     format_size(extractor.num_bytes))
+
+    def touch(self, key):
+        """
+        Check whether a tree is cached and mark it as recently used.
+
+        :param key: The key of the tree (a string).
+        :returns: :data:`True` if the tree is cached, :data:`False` otherwise.
+        """
+        entry = os.path.join(self.directory, key)
+        try:
+            os.utime(entry + '.json', None)
+            return os.path.isdir(entry)
+        except OSError:
+            return False
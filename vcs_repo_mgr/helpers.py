@@ -0,0 +1,268 @@
+# Version control system repository manager.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/xolox/python-vcs-repo-mgr
+
+"""
+Long running helper processes that answer repository queries.
+
+Most of the queries supported by `vcs-repo-mgr` are implemented by running a
+version control command and parsing its output. This is simple and robust but
+every query pays the price of starting a new process (and in the case of
+Mercurial and Bazaar, a new Python interpreter).
+
+Some version control systems support a mode where a single process answers
+many queries over its standard input and output streams (for example ``git
+cat-file --batch-check``). The :class:`HelperProcess` class manages the life
+cycle of such processes, backends subclass it to implement the protocol.
+Refer to :attr:`.Repository.persistent_helpers` for details.
+
+Helper processes are stopped when the object that owns them is garbage
+collected or the interpreter exits (see :func:`stop_when_collected()`).
+"""
+
+# Standard library modules.
+import atexit
+import io
+import logging
+import threading
+import weakref
+
+# External dependencies.
+from property_manager import PropertyManager, lazy_property, mutable_property, required_property
+
+# Public identifiers that require documentation.
+__all__ = (
+    'HelperProcess',
+    'stop_helper_processes',
+    'stop_when_collected',
+)
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+# Weak references to the owners of helper processes and their helper
+# processes (only used on Python 2, where weakref.finalize() isn't
+# available).
+registered_owners = {}
+
+
+def stop_helper_processes(helpers, wait=True):
+    """
+    Stop helper processes.
+
+    :param helpers: A dictionary whose values are :class:`HelperProcess`
+                    objects (the dictionary is cleared).
+    :param wait: Passed on to :func:`HelperProcess.stop()`.
+    """
+    for helper in list(helpers.values()):
+        helper.stop(wait=wait)
+    helpers.clear()
+
+
+def stop_when_collected(owner, helpers):
+    """
+    Stop helper processes when the object that owns them is garbage collected.
+
+    :param owner: The object that owns the helper processes (for example a
+                  :class:`~vcs_repo_mgr.Repository` object).
+    :param helpers: A dictionary whose values are :class:`HelperProcess`
+                    objects (the dictionary may be changed later on).
+
+    Unlike a :func:`__del__()` method this doesn't prevent reference cycles
+    that include the owner from being garbage collected on Python 2. The
+    helper processes are stopped without waiting for them to exit, and
+    helper processes that are still running when the interpreter exits are
+    stopped as well. This uses :class:`weakref.finalize` when it's available
+    and a weak reference callback combined with :mod:`atexit` otherwise.
+    """
+    if hasattr(weakref, 'finalize'):
+        weakref.finalize(owner, stop_helper_processes, helpers, wait=False)
+    else:
+        if not registered_owners:
+            atexit.register(stop_registered_helpers)
+
+        def callback(reference):
+            stop_helper_processes(registered_owners.pop(reference, {}), wait=False)
+        registered_owners[weakref.ref(owner, callback)] = helpers
+
+
+def stop_registered_helpers():
+    """Stop the helper processes registered by :func:`stop_when_collected()` (on interpreter exit)."""
+    for helpers in list(registered_owners.values()):
+        stop_helper_processes(helpers, wait=False)
+
+
+class HelperProcess(PropertyManager):
+
+    """
+    Base class for long running helper processes.
+
+    The helper process is started on demand by :func:`ensure_running()` and
+    communicates with its parent using pipes connected to its standard input
+    and output streams. Access to the pipes is serialized using :attr:`lock`
+    so that a single helper process can be shared between threads.
+    """
+
+    @required_property
+    def command(self):
+        """The command line of the helper process (a list of strings)."""
+
+    @required_property(repr=False)
+    def context(self):
+        """The execution context used to start the helper process (see :mod:`executor.contexts`)."""
+
+    @mutable_property
+    def environment(self):
+        """Environment variables for the helper process (a dictionary, defaults to an empty dictionary)."""
+        return {}
+
+    @mutable_property
+    def failed(self):
+        """:data:`True` when the helper process previously failed, :data:`False` otherwise."""
+        return False
+
+    @property
+    def is_running(self):
+        """:data:`True` if the helper process is running, :data:`False` otherwise."""
+        return self.process is not None and self.process.is_running
+
+    @lazy_property(repr=False)
+    def lock(self):
+        """A :class:`threading.RLock` object that serializes access to the helper process."""
+        return threading.RLock()
+
+    @mutable_property(repr=False)
+    def process(self):
+        """The :class:`~executor.ExternalCommand` object of the helper process (or :data:`None`)."""
+
+    @mutable_property(repr=False)
+    def stdin(self):
+        """A pipe connected to the standard input stream of the helper process (or :data:`None`)."""
+
+    @mutable_property(repr=False)
+    def stdout(self):
+        """A buffered pipe connected to the standard output stream of the helper process (or :data:`None`)."""
+
+    def ensure_running(self):
+        """
+        Make sure the helper process is running.
+
+        :returns: :data:`True` if the helper process is running, :data:`False`
+                  if it failed to start (now or in the past).
+
+        Once a helper process has failed it is not restarted, which means
+        callers only pay the price of the failure once (after that they
+        directly fall back to running regular subprocesses).
+        """
+        with self.lock:
+            if self.failed:
+                return False
+            if not self.is_running:
+                try:
+                    self.start()
+                except Exception as e:
+                    logger.warning("Failed to start helper process (%s), falling back to subprocesses: %s",
+                                   ' '.join(self.command), e)
+                    self.stop()
+                    self.failed = True
+                    return False
+            return True
+
+    def handshake(self):
+        """
+        Perform protocol specific initialization after the helper process has been started.
+
+        The default implementation does nothing, subclasses can override this
+        method to read a greeting from the helper process or to validate its
+        capabilities. Any exception raised by this method marks the helper
+        process as :attr:`failed`.
+        """
+
+    def read(self, size):
+        """
+        Read exactly the given number of bytes from the helper process.
+
+        :param size: The number of bytes to read (an integer).
+        :returns: The data that was read (a byte string).
+        :raises: :exc:`~exceptions.EOFError` when the helper process
+                 closes its standard output stream prematurely.
+        """
+        data = self.stdout.read(size) if size > 0 else b''
+        if len(data) != size:
+            raise EOFError("Helper process closed its standard output stream prematurely!")
+        return data
+
+    def readline(self):
+        """
+        Read a line of output from the helper process.
+
+        :returns: The line that was read, without its trailing newline (a byte string).
+        :raises: :exc:`~exceptions.EOFError` when the helper process
+                 closes its standard output stream prematurely.
+        """
+        line = self.stdout.readline()
+        if not line.endswith(b'\n'):
+            raise EOFError("Helper process closed its standard output stream prematurely!")
+        return line[:-1]
+
+    def start(self):
+        """Start the helper process and perform the :func:`handshake()`."""
+        logger.debug("Starting helper process: %s", ' '.join(self.command))
+        self.process = self.context.execute(
+            *self.command,
+            asynchronous=True,
+            buffered=False,
+            capture=True,
+            environment=self.environment,
+            input=True,
+            silent=True
+        )
+        self.stdin = self.process.stdin
+        self.stdout = self.process.stdout
+        # On Python 3 the pipes are unbuffered, which means readline() would
+        # read one byte at a time and write() is allowed to write partially.
+        if isinstance(self.stdin, io.RawIOBase):
+            self.stdin = io.BufferedWriter(self.stdin)
+        if isinstance(self.stdout, io.RawIOBase):
+            self.stdout = io.BufferedReader(self.stdout)
+        self.handshake()
+
+    def stop(self, wait=True):
+        """
+        Stop the helper process by closing its standard input stream.
+
+        :param wait: :data:`True` (the default) to wait for the helper process
+                     to exit, :data:`False` to kill the helper process when
+                     it's still running after its input has been closed (this
+                     is used by the garbage collector, which shouldn't block).
+        """
+        with self.lock:
+            if self.process is not None:
+                logger.debug("Stopping helper process: %s", ' '.join(self.command))
+                try:
+                    if self.stdin is not None:
+                        self.stdin.close()
+                    if self.process.is_running and not wait:
+                        self.process.kill()
+                    if self.process.is_running or not wait:
+                        self.process.wait(check=False)
+                except Exception as e:
+                    logger.debug("Swallowing exception while stopping helper process: %s", e)
+                    try:
+                        self.process.kill()
+                    except Exception:
+                        pass
+            self.process = None
+            self.stdin = None
+            self.stdout = None
+
+    def write(self, data):
+        """
+        Send data to the helper process.
+
+        :param data: The data to send (a byte string).
+        """
+        self.stdin.write(data)
+        self.stdin.flush()
@@ -1,20 +1,32 @@
 # Version control system repository manager.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: March 28, 2018
+# Last Change: October 16, 2026
 # URL: https://github.com/xolox/python-vcs-repo-mgr
 
 """Test suite for the `vcs-repo-mgr` package."""
 
 # Standard library modules.
 import codecs
+import gc
+import gzip
+import io
+import json
 import logging
 import os
 import shutil
+import stat
+import subprocess
+import sys
+import tarfile
 import tempfile
+import threading
 import time
+import zipfile
+import zlib
 
 # External dependencies.
+from executor import ExternalCommandFailed
 from humanfriendly import parse_path
 from humanfriendly.testing import (
     MockedHomeDirectory,
@@ -29,21 +41,41 @@ from six import string_types
 # The module we're testing.
 from vcs_repo_mgr import (
     Author,
+    CONFIG_INDEX_VARIABLE,
+    EXPORT_MARKER_FILE,
     FeatureBranchSpec,
+    HEX_PATTERN,
     Release,
     Remote,
+    Repository,
+    RepositoryCache,
+    Revision,
+    TreeEntry,
     USER_CONFIG_FILE,
     coerce_author,
     coerce_feature_branch,
     coerce_repository,
+    find_configured_repositories,
     find_configured_repository,
+    find_repository_type,
     limit_vcs_updates,
+    load_configuration_index,
     sum_revision_numbers,
+    update_repositories,
+)
+from vcs_repo_mgr.archives import (
+    COMPRESSED_FORMATS,
+    SMALL_FILE_SIZE,
+    ArchiveExtractor,
+    ParallelCompressor,
+    find_archive_format,
 )
 from vcs_repo_mgr.backends.bzr import BzrRepo
 from vcs_repo_mgr.backends.git import GitRepo
-from vcs_repo_mgr.backends.hg import HgRepo
+from vcs_repo_mgr.backends.hg import CommandServer, HgRepo
+from vcs_repo_mgr.batch import BatchSession
 from vcs_repo_mgr.cli import main
+from vcs_repo_mgr.daemon import SOCKET_VARIABLE, QueryDaemon, query_daemon
 from vcs_repo_mgr.exceptions import (
     AmbiguousRepositoryNameError,
     MergeConflictError,
@@ -53,12 +85,16 @@ from vcs_repo_mgr.exceptions import (
     UnknownRepositoryTypeError,
     WorkingTreeNotCleanError,
 )
+from vcs_repo_mgr.exports import EXPORT_CACHE_VARIABLE, ExportCache
 
 AUTHOR_NAME = 'John Doe'
 AUTHOR_EMAIL = 'john.doe@example.com'
 AUTHOR_COMBINED = '%s <%s>' % (AUTHOR_NAME, AUTHOR_EMAIL)
 TEMPORARY_DIRECTORIES = []
 
+STARTUP_BUDGET = 0.3
+"""The maximum time that importing the ``vcs-tool`` entry point may take (in seconds)."""
+
 # Initialize a logger.
 logger = logging.getLogger(__name__)
 
@@ -163,6 +199,75 @@ class VcsRepoMgrTestCase(TestCase):
             location = '%s/test.git' % directory
             assert isinstance(coerce_repository(location), GitRepo)
 
+    def test_find_repository_type(self):
+        """Test :func:`vcs_repo_mgr.find_repository_type()`."""
+        with TemporaryDirectory() as directory:
+            # Directories without a repository are recognized as such.
+            assert find_repository_type(directory) is None
+            assert find_repository_type(os.path.join(directory, 'missing')) is None
+            # The metadata directories of the bundled backends are recognized.
+            for name, marker, vcs_type in (('.bzr', 'branch-format', BzrRepo),
+                                           ('.git', 'config', GitRepo),
+                                           ('.hg', None, HgRepo)):
+                subdirectory = os.path.join(directory, vcs_type.__name__)
+                os.makedirs(os.path.join(subdirectory, name))
+                if marker:
+                    # Metadata directories without their marker file aren't enough.
+                    assert find_repository_type(subdirectory) is None
+                    with open(os.path.join(subdirectory, name, marker), 'w') as handle:
+                        handle.write('\n')
+                assert find_repository_type(subdirectory) is vcs_type
+            # A .git file (instead of a directory) isn't enough.
+            subdirectory = os.path.join(directory, 'worktree')
+            os.makedirs(subdirectory)
+            with open(os.path.join(subdirectory, '.git'), 'w') as handle:
+                handle.write('gitdir: /nonexistent\n')
+            assert find_repository_type(subdirectory) is None
+            # Bare git repositories are recognized.
+            bare = GitRepo(local=os.path.join(directory, 'bare'), bare=True)
+            bare.create()
+            assert find_repository_type(bare.local) is GitRepo
+            # The cache is invalidated when the directory changes.
+            subdirectory = os.path.join(directory, 'later')
+            os.makedirs(subdirectory)
+            assert find_repository_type(subdirectory) is None
+            time.sleep(0.01)
+            os.makedirs(os.path.join(subdirectory, '.hg'))
+            assert find_repository_type(subdirectory) is HgRepo
+
+    def test_repository_cache(self):
+        """Test the bounded cache used by :func:`vcs_repo_mgr.repository_factory()`."""
+        with TemporaryDirectory() as directory:
+            cache = RepositoryCache(max_size=2)
+            first = cache.get_or_create(('first',), lambda: GitRepo(local=os.path.join(directory, 'first')))
+            second = cache.get_or_create(('second',), lambda: GitRepo(local=os.path.join(directory, 'second')))
+            assert cache.get_or_create(('first',), None) is first
+            # Adding a third repository evicts the least recently used one.
+            cache.get_or_create(('third',), lambda: GitRepo(local=os.path.join(directory, 'third')))
+            assert len(cache) == 2
+            assert (cache.hits, cache.misses, cache.evictions) == (1, 3, 1)
+            # Evicted repositories that are still in use are found using weak references.
+            assert cache.get_or_create(('second',), None) is second
+            cache.weak_references = False
+            cache.get_or_create(('fourth',), lambda: GitRepo(local=os.path.join(directory, 'fourth')))
+            # The cache can be used like a dictionary (like loaded_repositories used to be).
+            assert cache[('fourth',)].local == os.path.join(directory, 'fourth')
+            assert cache.get(('missing',)) is None
+            self.assertRaises(KeyError, cache.__getitem__, ('missing',))
+            cache[('fifth',)] = GitRepo(local=os.path.join(directory, 'fifth'))
+            assert sorted(cache.keys()) == [('fifth',), ('fourth',)]
+            del cache[('fifth',)]
+            assert ('fifth',) not in cache
+            # Concurrently constructed duplicates are discarded.
+            duplicate = GitRepo(local=os.path.join(directory, 'fourth'))
+            assert cache.get_or_create(('sixth',), lambda: cache.setdefault(('sixth',), first) and duplicate) is first
+            # Repositories can be evicted explicitly.
+            assert cache.evict(second) is True
+            assert cache.evict(('second',)) is False
+            assert ('second',) not in cache
+            cache.clear()
+            assert len(cache) == 0
+
     def test_default_local(self):
         """Test default locations of local repositories."""
         with TemporaryDirectory() as directory:
@@ -246,6 +351,31 @@ class VcsRepoMgrTestCase(TestCase):
             # Make sure unknown repository types raise the expected exception.
             self.assertRaises(UnknownRepositoryTypeError, find_configured_repository, 'unknown-type')
 
+    def test_configuration_index(self):
+        """Test :func:`vcs_repo_mgr.load_configuration_index()`."""
+        with MockedHomeDirectory() as home:
+            index_file = os.path.join(home, 'index.json')
+            os.environ[CONFIG_INDEX_VARIABLE] = index_file
+            try:
+                options = dict(type='git', local=os.path.join(home, 'repo'))
+                prepare_config({'Some-Repo': options})
+                index = load_configuration_index()
+                assert [list(e) for e in index['somerepo']] == [['Some-Repo', options]]
+                # Make sure the index is cached in memory and on disk.
+                assert load_configuration_index() is index
+                assert os.path.isfile(index_file)
+                with open(index_file) as handle:
+                    assert 'somerepo' in json.load(handle)['index']
+                # Make sure changes to the configuration invalidate the index.
+                prepare_config({'other-repo': dict(type='hg', local=os.path.join(home, 'other'))})
+                index = load_configuration_index()
+                assert 'somerepo' not in index
+                assert 'otherrepo' in index
+                assert find_configured_repositories() == ['other-repo']
+                self.assertRaises(NoSuchRepositoryError, find_configured_repository, 'some-repo')
+            finally:
+                del os.environ[CONFIG_INDEX_VARIABLE]
+
     def test_find_directory(self):
         """Test the translation of repository names into repository directories."""
         with MockedHomeDirectory() as home:
@@ -285,6 +415,306 @@ class VcsRepoMgrTestCase(TestCase):
         """Make sure Repository objects must be created with a local directory or remote location set."""
         self.assertRaises(ValueError, GitRepo)
 
+    def test_archive_extractor(self):
+        """Test :class:`vcs_repo_mgr.archives.ArchiveExtractor`."""
+        def create_archive(members):
+            buffer = io.BytesIO()
+            archive = tarfile.open(fileobj=buffer, mode='w')
+            try:
+                for name, contents in members:
+                    info = tarfile.TarInfo(name)
+                    if contents is None:
+                        info.type = tarfile.DIRTYPE
+                        archive.addfile(info)
+                    elif contents.startswith(b'->'):
+                        info.type = tarfile.SYMTYPE
+                        info.linkname = contents[2:].decode('UTF-8')
+                        archive.addfile(info)
+                    else:
+                        info.size = len(contents)
+                        info.mode = 0o755 if name.endswith('.sh') else 0o644
+                        archive.addfile(info, io.BytesIO(contents))
+            finally:
+                archive.close()
+            buffer.seek(0)
+            return buffer
+        large_contents = b'x' * (SMALL_FILE_SIZE * 3 + 1)
+        members = [('docs', None), ('docs/README', b'Hello world!\n'), ('build.sh', b'#!/bin/sh\n'),
+                   ('large.bin', large_contents), ('link', b'->docs/README')]
+        members.extend(('many/file-%i.txt' % i, ('%i\n' % i).encode('ascii')) for i in range(250))
+        with TemporaryDirectory() as directory:
+            extractor = ArchiveExtractor(directory=os.path.join(directory, 'target'))
+            extractor.extract(create_archive(members))
+            assert extractor.num_files == 253
+            with open(os.path.join(directory, 'target', 'docs', 'README'), 'rb') as handle:
+                assert handle.read() == b'Hello world!\n'
+            with open(os.path.join(directory, 'target', 'large.bin'), 'rb') as handle:
+                assert handle.read() == large_contents
+            assert os.access(os.path.join(directory, 'target', 'build.sh'), os.X_OK)
+            assert os.readlink(os.path.join(directory, 'target', 'link')) == 'docs/README'
+            assert len(os.listdir(os.path.join(directory, 'target', 'many'))) == 250
+            # Members outside of the target directory are refused.
+            extractor = ArchiveExtractor(directory=os.path.join(directory, 'target'))
+            self.assertRaises(ValueError, extractor.extract, create_archive([('../evil', b'evil')]))
+            assert not os.path.exists(os.path.join(directory, 'evil'))
+            # Members can't be written through symbolic links that point outside of the target directory.
+            outside = os.path.join(directory, 'outside')
+            os.mkdir(outside)
+            extractor = ArchiveExtractor(directory=os.path.join(directory, 'target'))
+            archive = create_archive([('sub', ('->' + outside).encode('UTF-8')), ('sub/evil', b'evil')])
+            self.assertRaises(ValueError, extractor.extract, archive)
+            assert not os.listdir(outside)
+            # Failing archive commands are reported as such (not as unreadable archives).
+            repository = GitRepo(local=directory)
+            command = ['sh', '-c', 'echo Failed to create archive! >&2; exit 3']
+            self.assertRaises(ExternalCommandFailed, repository.extract_archive, command, outside)
+
+    def test_parallel_compressor(self):
+        """Test :class:`vcs_repo_mgr.archives.ParallelCompressor`."""
+        data = b''.join(('%i\n' % i).encode('ascii') for i in range(100000))
+        for compression in sorted(COMPRESSED_FORMATS.values()):
+            if compression == 'xz' and sys.version_info[0] == 2:
+                continue
+            output = io.BytesIO()
+            compressor = ParallelCompressor(block_size=1024 * 16, compression=compression)
+            assert compressor.compress(io.BytesIO(data), output) == len(output.getvalue())
+            # The blocks are readable by the standard modules.
+            output.seek(0)
+            if compression == 'gz':
+                handle = gzip.GzipFile(fileobj=output)
+                assert handle.read() == data
+                handle.close()
+            else:
+                import lzma
+                assert lzma.decompress(output.getvalue()) == data
+        self.assertRaises(ValueError, ParallelCompressor(compression='rar').compress, io.BytesIO(data), io.BytesIO())
+        # Short reads (like those from pipes) don't result in extra blocks.
+        class ShortReadStream(io.BytesIO):
+            def read(self, size=-1):
+                return super(ShortReadStream, self).read(min(size, 1024 * 8))
+        output = io.BytesIO()
+        compressor = ParallelCompressor(block_size=len(data) + 1, compression='gz')
+        compressor.compress(ShortReadStream(data), output)
+        members = 0
+        remaining = output.getvalue()
+        while remaining:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            decompressor.decompress(remaining)
+            remaining = decompressor.unused_data
+            members += 1
+        assert members == 1
+        assert find_archive_format('release.TGZ') == 'tar.gz'
+        self.assertRaises(ValueError, find_archive_format, 'release.rar')
+
+    def test_batch_mode(self):
+        """Test answering JSON requests using ``vcs-tool --batch``."""
+        with MockedHomeDirectory() as home:
+            repository = GitRepo(author=AUTHOR_COMBINED, bare=False, local=os.path.join(home, 'repo'))
+            repository.create()
+            repository.context.write_file('README', "This is a git repository.\n")
+            repository.add_files('README')
+            repository.commit("Initial commit")
+            repository.create_tag('1.0')
+            prepare_config({'repo': {'type': 'git', 'local': repository.local}})
+            requests = [
+                dict(id=1, repository='repo', action='find-revision-id'),
+                dict(repository='repo', action='find-revision-number', revisions=['master', '1.0']),
+                dict(repository='repo', action='find-directory'),
+                dict(repository='repo', action='no-such-action'),
+                dict(action='sum-revisions', arguments=['repo', 'master']),
+            ]
+            returncode, output = run_cli(
+                main, '--batch',
+                input='\n'.join(json.dumps(r) for r in requests) + '\n\nnot json\n',
+            )
+            self.assertEquals(returncode, 0)
+            responses = [json.loads(line) for line in output.splitlines()]
+            assert len(responses) == 6
+            assert responses[0] == dict(id=1, result=repository.find_revision_id())
+            assert responses[1] == dict(result=[1, 1])
+            assert responses[2] == dict(result=repository.local)
+            assert 'error' in responses[3]
+            assert responses[4] == dict(result=1)
+            assert 'error' in responses[5]
+            # Make sure sum-revisions uses the repository objects of the session.
+            session = BatchSession()
+            assert session.handle(dict(action='sum-revisions', arguments=['repo', 'master', 'repo', '1.0'])) == \
+                dict(result=2)
+            assert list(session.repositories) == ['repo']
+            assert session.repositories['repo'].persistent_helpers
+            assert 'error' in session.handle(dict(action='sum-revisions', arguments=['repo', 'master', 'repo']))
+            session.close()
+
+    def test_batch_mode_output(self):
+        """Make sure the output of version control commands doesn't end up in the responses of ``vcs-tool --batch``."""
+        with MockedHomeDirectory() as home:
+            repository = GitRepo(author=AUTHOR_COMBINED, bare=False, local=os.path.join(home, 'repo'))
+            repository.create()
+            repository.context.write_file('README', "This is a git repository.\n")
+            repository.add_files('README')
+            repository.commit("Initial commit")
+            prepare_config({
+                'clone': {
+                    'type': 'git',
+                    'bare': 'false',
+                    'local': os.path.join(home, 'clone'),
+                    'remote': repository.local,
+                },
+            })
+            requests = [
+                dict(repository='clone', action='update'),
+                dict(repository='clone', action='update'),
+                dict(repository='clone', action='export', directory=os.path.join(home, 'export')),
+                dict(repository='clone', action='find-revision-id'),
+            ]
+            environment = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            process = subprocess.Popen(
+                [sys.executable, '-c', 'from vcs_repo_mgr.cli import main; main()', '--batch'],
+                env=environment, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            )
+            stdout, stderr = process.communicate(''.join(json.dumps(r) + '\n' for r in requests).encode('UTF-8'))
+            assert process.returncode == 0
+            responses = [json.loads(line) for line in stdout.decode('UTF-8').splitlines()]
+            assert responses == [dict(result=None)] * 3 + [dict(result=repository.find_revision_id())]
+
+    def test_daemon(self):
+        """Test answering queries using the daemon behind ``vcs-tool --daemon``."""
+        with MockedHomeDirectory() as home:
+            repository = GitRepo(author=AUTHOR_COMBINED, bare=False, local=os.path.join(home, 'repo'))
+            repository.create()
+            repository.context.write_file('README', "This is a git repository.\n")
+            repository.add_files('README')
+            repository.commit("Initial commit")
+            repository.create_tag('1.0')
+            prepare_config({'repo': {'type': 'git', 'local': repository.local}})
+            socket_path = os.path.join(home, 'daemon.sock')
+            daemon = QueryDaemon(socket_path=socket_path)
+            thread = threading.Thread(target=daemon.serve_forever)
+            thread.start()
+            os.environ[SOCKET_VARIABLE] = socket_path
+            try:
+                for i in range(50):
+                    if daemon.server is not None:
+                        break
+                    time.sleep(0.1)
+                # Make sure the socket is only accessible to the current user.
+                assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+                response = query_daemon(dict(id=42, repository='repo', action='find-revision-id'))
+                assert response == dict(id=42, result=repository.find_revision_id())
+                assert 'error' in query_daemon(dict(repository='repo', action='update'))
+                # Make sure arbitrary locations are rejected.
+                assert 'error' in query_daemon(dict(repository=repository.local, action='find-revision-id'))
+                # Make sure requests with a different configuration are rejected.
+                response = daemon.session.handle(dict(repository='repo', action='find-revision-id', configuration=[]))
+                assert 'error' in response
+                # Make sure vcs-tool uses the daemon.
+                returncode, output = run_cli(main, '--repository=repo', '--find-revision-number', '--find-revision-id')
+                self.assertEquals(returncode, 0)
+                assert output.split() == ['1', repository.find_revision_id()]
+                # Make sure vcs-tool doesn't construct repository objects (or
+                # list releases) when the daemon answers the query.
+                import vcs_repo_mgr.cli
+                coerce_repository = vcs_repo_mgr.cli.coerce_repository
+                vcs_repo_mgr.cli.coerce_repository = MagicMock(side_effect=Exception)
+                try:
+                    returncode, output = run_cli(main, '--repository=repo', '--release=1.0',
+                                                 '--find-revision-number', '--vcs-control-field')
+                finally:
+                    vcs_repo_mgr.cli.coerce_repository = coerce_repository
+                self.assertEquals(returncode, 0)
+                assert output.splitlines() == ['1', 'Vcs-Git: %s#%s' % (repository.local, repository.find_revision_id())]
+                # Make sure changes to the configuration are picked up.
+                prepare_config({'other': {'type': 'git', 'local': repository.local}})
+                response = query_daemon(dict(repository='repo', action='find-directory'))
+                assert 'error' in response
+                response = query_daemon(dict(repository='other', action='find-directory'))
+                assert response == dict(result=repository.local)
+                # Make sure the daemon doesn't create local clones.
+                missing = os.path.join(home, 'missing')
+                prepare_config({'missing': {'type': 'git', 'local': missing, 'remote': repository.local}})
+                assert 'error' in query_daemon(dict(repository='missing', action='find-revision-id'))
+                assert not os.path.exists(missing)
+            finally:
+                del os.environ[SOCKET_VARIABLE]
+                daemon.shutdown()
+                thread.join()
+            assert not os.path.exists(socket_path)
+
+    def test_startup_time(self):
+        """Make sure the ``vcs-tool`` entry point imports quickly (using ``python -X importtime``)."""
+        if sys.version_info[:2] < (3, 7):
+            return self.skipTest("python -X importtime requires Python 3.7+")
+        environment = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        timings = []
+        for i in range(3):
+            process = subprocess.Popen(
+                [sys.executable, '-X', 'importtime', '-c', 'import vcs_repo_mgr.cli'],
+                env=environment, stderr=subprocess.PIPE,
+            )
+            stdout, stderr = process.communicate()
+            assert process.returncode == 0
+            modules = {}
+            for line in stderr.decode('UTF-8').splitlines():
+                if line.startswith('import time:') and '|' in line:
+                    self_time, cumulative_time, name = line[len('import time:'):].split('|')
+                    if cumulative_time.strip().isdigit():
+                        modules[name.strip()] = int(cumulative_time) / 1000000.0
+            # Modules that are only needed by some actions aren't imported.
+            for name in ('natsort', 'vcs_repo_mgr.backends.bzr', 'vcs_repo_mgr.backends.hg',
+                         'vcs_repo_mgr.batch', 'vcs_repo_mgr.daemon'):
+                assert name not in modules
+            timings.append(modules['vcs_repo_mgr.cli'])
+        assert min(timings) < STARTUP_BUDGET, "Importing vcs_repo_mgr.cli took %.3fs!" % min(timings)
+
+    def test_update_all(self):
+        """Test updating all configured repositories using ``vcs-tool --update-all``."""
+        with MockedHomeDirectory() as home:
+            source = GitRepo(author=AUTHOR_COMBINED, bare=False, local=os.path.join(home, 'source'))
+            source.create()
+            source.context.write_file('README', "This is a git repository.\n")
+            source.add_files('README')
+            source.commit("Initial commit")
+            config = dict(('mirror-%s' % n, {
+                'type': 'git',
+                'local': os.path.join(home, 'mirror-%s' % n),
+                'remote': source.local,
+            }) for n in ('one', 'two', 'three'))
+            config['broken'] = {
+                'type': 'git',
+                'local': os.path.join(home, 'broken'),
+                'remote': os.path.join(home, 'missing'),
+            }
+            prepare_config(config)
+            assert find_configured_repositories(['mirror-*']) == ['mirror-one', 'mirror-three', 'mirror-two']
+            # Update a subset of the configured repositories.
+            returncode, output = run_cli(main, '--concurrency=2', '--update-all', 'mirror-*')
+            self.assertEquals(returncode, 0)
+            lines = output.splitlines()
+            assert len(lines) == 3
+            assert all('updated in' in line for line in lines)
+            assert all(os.path.isdir(os.path.join(home, 'mirror-%s' % n)) for n in ('one', 'two', 'three'))
+            # Failed updates are reported and cause a nonzero exit status.
+            results = update_repositories(['broken', 'mirror-one'])
+            assert [r.succeeded for r in results] == [False, True]
+            # Names that refer to the same local repository are updated only once.
+            config['alias'] = dict(config['mirror-one'])
+            prepare_config(config)
+            names = ['mirror-one', 'alias', os.path.join(home, 'mirror-one')]
+            original_pull = GitRepo.pull
+            GitRepo.pull = MagicMock()
+            try:
+                results = update_repositories(names)
+                assert GitRepo.pull.call_count == 1
+            finally:
+                GitRepo.pull = original_pull
+            assert [r.name for r in results] == names
+            assert all(r.succeeded for r in results)
+            del config['alias']
+            prepare_config(config)
+            returncode, output = run_cli(main, '--update-all')
+            self.assertEquals(returncode, 1)
+            assert 'broken: failed after' in output
+
     def test_sum_revision_numbers(self):
         """Test :func:`vcs_repo_mgr.sum_revision_numbers()`."""
         with MockedHomeDirectory() as home:
@@ -333,6 +763,15 @@ class VcsRepoMgrTestCase(TestCase):
             )
             updated_summed_revision_number = int(output)
             assert updated_summed_revision_number > initial_summed_revision_number
+            # Make sure identical pairs are counted each time (regardless of concurrency).
+            arguments = [
+                'repo-one', repo_one.default_revision,
+                'repo-two', repo_two.default_revision,
+                repo_one.local, repo_one.default_revision,
+            ]
+            expected = updated_summed_revision_number + repo_one.find_revision_number()
+            assert sum_revision_numbers(arguments, concurrency=1) == expected
+            assert sum_revision_numbers(arguments, concurrency=4) == expected
 
 
 class BackendTestCase(object):
@@ -623,6 +1062,153 @@ class BackendTestCase(object):
             # Reset the working directory.
             os.chdir(tempfile.gettempdir())
 
+    def test_export_archive(self):
+        """Test exporting of revisions to compressed archives."""
+        with TemporaryDirectory() as directory:
+            repository = self.get_instance(bare=False, local=os.path.join(directory, 'repo'))
+            repository.create()
+            self.commit_file(repository=repository, filename='file', contents='contents', message="Initial commit")
+            filename = os.path.join(directory, 'snapshot.tar.gz')
+            returncode, output = run_cli(
+                main, '--repository=%s' % repository.local,
+                '--concurrency=2', '--export-archive=%s' % filename,
+            )
+            assert returncode == 0
+            with tarfile.open(filename) as archive:
+                names = [os.path.normpath(name) for name in archive.getnames()]
+                assert 'file' in names
+            # The temporary file was renamed into place.
+            assert sorted(os.listdir(directory)) == ['repo', 'snapshot.tar.gz']
+
+    def test_export_cache(self):
+        """Test exporting of revisions using the export cache."""
+        with TemporaryDirectory() as directory:
+            repository = self.get_instance(bare=False, local=os.path.join(directory, 'repo'))
+            repository.create()
+            self.commit_file(repository=repository, filename='file', contents='1', message="Initial commit")
+            initial_revision = repository.find_revision_id()
+            self.commit_file(repository=repository, filename='file', contents='2', message="Second commit")
+            cache = ExportCache(directory=os.path.join(directory, 'cache'))
+            repository.export_cache = cache
+            # The first export fills the cache, the second export hits the cache.
+            for name in 'first', 'second':
+                repository.export(os.path.join(directory, name))
+                with open(os.path.join(directory, name, 'file')) as handle:
+                    assert handle.read() == '2'
+            assert cache.misses == 1
+            assert cache.hits == 1
+            # Files aren't hard linked by default, so the cache can't be modified through exports.
+            assert os.stat(os.path.join(directory, 'second', 'file')).st_nlink == 1
+            with open(os.path.join(directory, 'second', 'file'), 'w') as handle:
+                handle.write('modified')
+            repository.export(os.path.join(directory, 'fourth'))
+            with open(os.path.join(directory, 'fourth', 'file')) as handle:
+                assert handle.read() == '2'
+            # Hard links are opt-in.
+            cache.link_mode = 'hardlink'
+            repository.export(os.path.join(directory, 'fifth'))
+            assert os.stat(os.path.join(directory, 'fifth', 'file')).st_nlink == 2
+            cache.link_mode = 'reflink'
+            # Trees evicted while they're being linked are exported normally.
+            link_tree = cache.link_tree
+            cache.link_tree = MagicMock(side_effect=lambda source, target: (
+                link_tree(source, target), cache.remove(os.path.basename(source))
+            ))
+            repository.export(os.path.join(directory, 'evicted'))
+            assert cache.link_tree.called
+            del cache.link_tree
+            with open(os.path.join(directory, 'evicted', 'file')) as handle:
+                assert handle.read() == '2'
+            # Errors while walking the cached tree aren't ignored.
+            self.assertRaises(EnvironmentError, cache.link_tree, os.path.join(cache.directory, 'missing'),
+                              os.path.join(directory, 'missing'))
+            # Exporting another tree evicts the least recently used tree.
+            cache.size_limit = 1
+            repository.export(os.path.join(directory, 'third'), revision=initial_revision)
+            with open(os.path.join(directory, 'third', 'file')) as handle:
+                assert handle.read() == '1'
+            assert len([fn for fn in os.listdir(cache.directory) if fn.endswith('.json')]) == 1
+            # The export cache is opt-in.
+            assert ExportCache.from_environment() is None
+            os.environ[EXPORT_CACHE_VARIABLE] = cache.directory
+            try:
+                assert ExportCache.from_environment().directory == cache.directory
+                # The cache created from the environment is kept by the repository.
+                repository = self.get_instance(bare=False, local=repository.local)
+                for name in 'sixth', 'seventh':
+                    repository.export(os.path.join(directory, name))
+                assert repository.export_cache is repository.export_cache
+                assert repository.export_cache.misses == 1
+                assert repository.export_cache.hits == 1
+            finally:
+                del os.environ[EXPORT_CACHE_VARIABLE]
+
+    def test_export_incremental(self):
+        """Test incremental exports."""
+        with TemporaryDirectory() as directory:
+            repository = self.get_instance(bare=False, local=os.path.join(directory, 'repo'))
+            repository.create()
+            self.commit_file(repository=repository, filename='kept', contents='1', message="Initial commit")
+            self.commit_file(repository=repository, filename='modified', contents='1', message="Second commit")
+            os.mkdir(os.path.join(repository.local, 'subdirectory'))
+            self.commit_file(repository=repository, filename='subdirectory/deleted',
+                             contents='1', message="Third commit")
+            export_directory = os.path.join(directory, 'export')
+            repository.export(export_directory, incremental=True)
+            marker_file = os.path.join(export_directory, EXPORT_MARKER_FILE)
+            assert os.path.isfile(marker_file)
+            assert os.path.isfile(os.path.join(export_directory, 'subdirectory', 'deleted'))
+            # Modify, delete and add files.
+            os.unlink(os.path.join(repository.local, 'subdirectory', 'deleted'))
+            repository.add_files()
+            self.commit_file(repository=repository, filename='modified', contents='2', message="Fourth commit")
+            self.commit_file(repository=repository, filename='added', contents='1', message="Fifth commit")
+            # Mark a file that didn't change so we can tell that it wasn't rewritten.
+            os.utime(os.path.join(export_directory, 'kept'), (0, 0))
+            repository.export(export_directory, incremental=True)
+            with open(os.path.join(export_directory, 'modified')) as handle:
+                assert handle.read() == '2'
+            assert os.path.isfile(os.path.join(export_directory, 'added'))
+            assert not os.path.exists(os.path.join(export_directory, 'subdirectory'))
+            if type(repository).find_changed_files is not Repository.find_changed_files:
+                assert os.path.getmtime(os.path.join(export_directory, 'kept')) == 0
+            with open(marker_file) as handle:
+                assert repository.find_revision_id() in handle.read()
+            # Corrupt markers trigger a complete export (that removes stale files).
+            with open(marker_file, 'w') as handle:
+                handle.write('garbage')
+            os.mkdir(os.path.join(export_directory, 'stale'))
+            with open(os.path.join(export_directory, 'stale', 'file'), 'w') as handle:
+                handle.write('stale')
+            repository.export(export_directory, incremental=True)
+            assert os.path.getmtime(os.path.join(export_directory, 'kept')) != 0
+            assert not os.path.exists(os.path.join(export_directory, 'stale'))
+            assert os.path.isfile(marker_file)
+            # Complete exports remove the marker.
+            repository.export(export_directory)
+            assert not os.path.exists(marker_file)
+
+    def test_export_stream(self):
+        """Test streaming archives of revisions."""
+        with TemporaryDirectory() as directory:
+            repository = self.get_instance(bare=False, local=directory)
+            repository.create()
+            self.commit_file(repository=repository, filename='file', contents='contents', message="Initial commit")
+            for format in 'tar', 'tar.gz':
+                output = io.BytesIO()
+                assert repository.export_stream(format=format, output=output) == len(output.getvalue())
+                output.seek(0)
+                with tarfile.open(fileobj=output) as archive:
+                    names = [os.path.normpath(name) for name in archive.getnames()]
+                    assert 'file' in names
+            with repository.export_stream(format='zip') as stream:
+                archive = zipfile.ZipFile(io.BytesIO(stream.read()))
+                assert archive.read([n for n in archive.namelist() if n.endswith('file')][0]) == b'contents'
+            # Closing a stream before the archive was read kills the command.
+            with repository.export_stream() as stream:
+                assert len(stream.read(10)) == 10
+            self.assertRaises(ValueError, repository.export_stream, format='rar')
+
     def test_find_revision_number(self):
         """Test querying the command line interface for local revision numbers."""
         with TemporaryDirectory() as directory:
@@ -646,6 +1232,65 @@ class BackendTestCase(object):
             self.assertEquals(returncode, 0)
             self.assertEquals(int(output), second_revision_number)
 
+    def test_find_revision_numbers(self):
+        """Test finding the revision numbers of many revisions at once."""
+        with TemporaryDirectory() as directory:
+            repository = self.get_instance(bare=False, local=directory)
+            self.create_initial_commit(repository)
+            repository.create_tag('1.0')
+            repository.create_branch('dev')
+            self.commit_file(repository)
+            repository.create_tag('2.0')
+            # Create a merge commit so that the history isn't linear.
+            repository.checkout()
+            self.commit_file(repository)
+            repository.merge('dev')
+            repository.commit(message="Merged 'dev' branch")
+            repository.create_tag('3.0')
+            revision_ids = set(r.revision.revision_id for r in repository.ordered_releases)
+            revision_ids.update(r.revision_id for r in repository.branches.values())
+            expected = dict((i, repository.find_revision_number(i)) for i in revision_ids)
+            # Check the revision numbers computed in bulk.
+            revisions = [Revision(repository=repository, revision_id=i) for i in revision_ids]
+            assert repository.find_revision_numbers(revisions) == expected
+            assert all(r.revision_number == expected[r.revision_id] for r in revisions)
+            # Check the default selection of revisions (all branches and tags).
+            revision_numbers = repository.find_revision_numbers()
+            assert all(revision_numbers[i] == n for i, n in expected.items())
+
+    def test_resolve_revisions(self):
+        """Test resolving many revisions at once."""
+        with TemporaryDirectory() as directory:
+            repository = self.get_instance(bare=False, local=directory)
+            self.create_initial_commit(repository)
+            repository.create_tag('1.0')
+            self.commit_file(repository)
+            references = [repository.default_revision, '1.0']
+            revisions = repository.resolve_revisions(references)
+            assert [r.revision_id for r in revisions] == [repository.find_revision_id(r) for r in references]
+            assert [r.revision_number for r in revisions] == [repository.find_revision_number(r) for r in references]
+            assert revisions[1].tag == '1.0'
+            # Branches and tags are only listed when they're needed.
+            other = self.get_instance(bare=False, local=directory)
+            other.find_branches = MagicMock(side_effect=Exception)
+            other.find_tags = MagicMock(side_effect=Exception)
+            assert [r.revision_id for r in other.resolve_revisions(references)] == \
+                [r.revision_id for r in revisions]
+            assert not other.find_branches.called
+            assert not other.find_tags.called
+            # References to the same revision are resolved as well.
+            duplicates = repository.resolve_revisions([None, repository.default_revision])
+            assert duplicates[0].revision_id == duplicates[1].revision_id == revisions[0].revision_id
+            # Make sure `vcs-tool' accepts repeated --revision options.
+            returncode, output = run_cli(
+                main, '--repository=%s' % repository.local,
+                '--revision=%s' % references[0], '--revision=1.0',
+                '--find-revision-number', '--find-revision-id',
+            )
+            self.assertEquals(returncode, 0)
+            expected = [str(r.revision_number) for r in revisions] + [r.revision_id for r in revisions]
+            self.assertEquals(output.split(), expected)
+
     def test_find_revision_id(self):
         """Test querying the command line interface for global revision ids."""
         with TemporaryDirectory() as directory:
@@ -699,6 +1344,46 @@ class BackendTestCase(object):
             # Make sure ensure_clean() now raises the expected exception.
             self.assertRaises(WorkingTreeNotCleanError, repository.ensure_clean)
 
+    def test_async_repository(self):
+        """Test the :mod:`asyncio` interface to repositories."""
+        if sys.version_info[:2] < (3, 4):
+            return self.skipTest("the asyncio interface requires Python 3.4+")
+        import asyncio
+        from vcs_repo_mgr.aio import DEFAULT_MAX_WORKERS, AsyncRepository
+        with TemporaryDirectory() as directory:
+            source = self.get_instance(local=os.path.join(directory, 'source'), bare=False)
+            self.create_initial_commit(source)
+            targets = [
+                AsyncRepository(self.get_instance(local=os.path.join(directory, name), remote=source.local))
+                for name in ('one', 'two')
+            ]
+            # The repositories share a thread pool that's sized for many repositories.
+            assert targets[0].executor is targets[1].executor
+            assert targets[0].executor._max_workers == DEFAULT_MAX_WORKERS
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                # Create the clones concurrently.
+                loop.run_until_complete(asyncio.gather(*(t.pull() for t in targets)))
+                assert all(t.repository.exists for t in targets)
+                # Pull a new commit into the clones concurrently.
+                self.create_followup_commit(source)
+                loop.run_until_complete(asyncio.gather(*(t.pull() for t in targets)))
+                revision_ids = loop.run_until_complete(asyncio.gather(*(t.find_revision_id() for t in targets)))
+                assert revision_ids == [source.find_revision_id()] * 2
+                revision_number = loop.run_until_complete(targets[0].find_revision_number())
+                assert revision_number == source.find_revision_number()
+                branches = loop.run_until_complete(targets[0].branches)
+                assert source.default_revision in branches
+                # Failing commands raise the usual exception.
+                self.assertRaises(
+                    ExternalCommandFailed, loop.run_until_complete,
+                    targets[0].pull(remote=os.path.join(directory, 'missing')),
+                )
+            finally:
+                asyncio.set_event_loop(None)
+                loop.close()
+
     def test_last_updated(self):
         """Make sure the last_updated logic is robust."""
         with TemporaryDirectory() as directory:
@@ -770,6 +1455,27 @@ class BackendTestCase(object):
             for feature_id in features:
                 assert feature_id not in listed_releases
 
+    def test_list_files(self):
+        """Test listing the files in the tree of a revision."""
+        with TemporaryDirectory() as directory:
+            repository = self.get_instance(bare=False, local=directory)
+            repository.create()
+            os.makedirs(os.path.join(directory, 'docs', 'api'))
+            self.commit_file(repository=repository, filename='setup.py', contents='# setup')
+            self.commit_file(repository=repository, filename='docs/api/index.rst', contents='API')
+            self.commit_file(repository=repository, filename='docs/README', contents='README')
+            entries = list(repository.list_files())
+            assert all(isinstance(e, TreeEntry) for e in entries)
+            assert sorted(e.path for e in entries) == ['docs/README', 'docs/api/index.rst', 'setup.py']
+            assert all(e.mode in (None, 0o100644) for e in entries)
+            assert all(e.object_id is None or HEX_PATTERN.match(e.object_id) for e in entries)
+            assert sorted(e.path for e in repository.list_files(prefix='docs')) == ['docs/README', 'docs/api/index.rst']
+            assert [e.path for e in repository.list_files(prefix='docs/api/')] == ['docs/api/index.rst']
+            assert list(repository.list_files(prefix='missing')) == []
+            # Stopping early kills the command.
+            for entry in repository.list_files():
+                break
+
     def test_merge_conflicts(self):
         """Test handling of merge conflicts."""
         with TemporaryDirectory() as directory:
@@ -894,6 +1600,29 @@ class BackendTestCase(object):
         """Test pulling of changes into a repository with a working tree."""
         self.check_pull(bare=True)
 
+    def test_read_files(self):
+        """Test reading files at revisions without exporting the tree."""
+        for persistent_helpers in False, True:
+            with TemporaryDirectory() as directory:
+                repository = self.get_instance(bare=False, local=directory, persistent_helpers=persistent_helpers)
+                repository.create()
+                for version in '1.0', '2.0', '3.0':
+                    self.commit_file(repository=repository, filename='VERSION', contents=version)
+                    repository.create_tag(version)
+                self.commit_file(repository=repository, filename='README', contents='Hello world!')
+                initial_revision = repository.ordered_releases[0].revision.revision_id
+                assert repository.read_file(None, 'README') == b'Hello world!'
+                assert repository.read_file(initial_revision, 'VERSION') == b'1.0'
+                assert repository.read_file(initial_revision, 'README') is None
+                assert list(repository.iter_files(None, ['VERSION', 'missing', 'README'])) == [
+                    ('VERSION', b'3.0'), ('missing', None), ('README', b'Hello world!'),
+                ]
+                assert [(release.identifier, contents) for release, contents in
+                        repository.iter_release_files('VERSION')] == [
+                    ('1.0', b'1.0'), ('2.0', b'2.0'), ('3.0', b'3.0'),
+                ]
+                repository.stop_helpers()
+
     def test_push(self):
         """Test pulling of changes from another repository."""
         with TemporaryDirectory() as directory:
@@ -912,6 +1641,27 @@ class BackendTestCase(object):
         """Test pulling of specific revisions."""
         self.check_selective_push_or_pull('push')
 
+    def test_ref_snapshot(self):
+        """Test that branches, tags and releases are cached until they change."""
+        with TemporaryDirectory() as directory:
+            repository = self.get_instance(bare=False, local=directory)
+            self.create_initial_commit(repository)
+            repository.create_tag('1.0')
+            assert '1.0' in repository.tags
+            # Tags created using external commands are noticed automatically.
+            repository.context.execute(*repository.get_create_tag_command('2.0'))
+            assert '2.0' in repository.tags
+            assert '2.0' in repository.releases
+            if repository.ref_fingerprint is not None:
+                # Cached values are used as long as nothing changes.
+                expected = (sorted(repository.branches), sorted(repository.tags), sorted(repository.releases))
+                repository.find_branches = MagicMock(side_effect=Exception)
+                repository.find_tags = MagicMock(side_effect=Exception)
+                assert (sorted(repository.branches), sorted(repository.tags), sorted(repository.releases)) == expected
+                # The snapshot can also be cleared explicitly.
+                repository.clear_ref_snapshot()
+                self.assertRaises(Exception, getattr, repository, 'tags')
+
     def test_remotes(self):
         """Test introspection of remote repositories."""
         with TemporaryDirectory() as directory:
@@ -1063,6 +1813,166 @@ class GitTestCase(BackendTestCase, TestCase):
             handle.write('name = %s\n' % name)
             handle.write('email = %s\n' % email)
 
+    def test_persistent_helpers(self):
+        """Test resolving of revisions using the ``git cat-file --batch-check`` helper."""
+        with TemporaryDirectory() as directory:
+            repository = self.get_instance(bare=False, local=directory)
+            self.create_initial_commit(repository)
+            repository.create_tag('v1')
+            repository.create_branch('dev')
+            self.create_followup_commit(repository)
+            # Resolve some revisions without helper processes.
+            names = ['master', 'dev', 'v1', 'HEAD~1']
+            expected = [repository.find_revision_id(n) for n in names]
+            # Resolve the same revisions using the helper process.
+            repository.persistent_helpers = True
+            assert [repository.find_revision_id(n) for n in names] == expected
+            helper = repository.helpers['cat-file']
+            assert helper.is_running
+            # Make sure new commits are visible to the running helper.
+            self.commit_file(repository)
+            assert repository.find_revision_id('dev') == repository.context.capture('git', 'rev-parse', 'dev')
+            # Make sure errors are still reported in the usual way.
+            self.assertRaises(ExternalCommandFailed, repository.find_revision_id, 'nonexisting')
+            # Make sure the helper process can be shut down.
+            repository.stop_helpers()
+            assert not helper.is_running
+            assert not repository.helpers
+            # Make sure helper processes are stopped when a repository in a reference cycle is garbage collected.
+            repository.find_revision_id('master')
+            helper = repository.helpers['cat-file']
+            assert helper.is_running
+            repository.cycle = repository
+            del repository
+            gc.collect()
+            assert not helper.is_running
+
+    def test_cache_revision_numbers(self):
+        """Test the persistent store of revision numbers."""
+        with TemporaryDirectory() as directory:
+            repository = self.get_instance(bare=False, local=directory, cache_revision_numbers=True)
+            self.create_initial_commit(repository)
+            self.create_followup_commit(repository)
+            revision_id = repository.find_revision_id('master')
+            assert repository.find_revision_number('master') == 2
+            assert repository.revision_numbers == {revision_id: 2}
+            # Make sure the revision number is found without running `git rev-list'.
+            repository = self.get_instance(bare=False, local=directory, cache_revision_numbers=True)
+            repository.count_revisions = MagicMock(side_effect=Exception)
+            assert repository.find_revision_number('master') == 2
+            assert repository.find_revision_number(revision_id) == 2
+            # Make sure new revisions are still counted.
+            self.commit_file(repository)
+            self.assertRaises(Exception, repository.find_revision_number, 'master')
+            repository.count_revisions = MagicMock(return_value=3)
+            assert repository.find_revision_number('master') == 3
+            assert len(repository.revision_numbers) == 2
+
+    def test_count_revisions_in_bulk(self):
+        """Test that a few revisions are counted without a bulk history traversal."""
+        with TemporaryDirectory() as directory:
+            repository = self.get_instance(bare=False, local=directory)
+            self.create_initial_commit(repository)
+            repository.create_branch('dev')
+            self.create_followup_commit(repository)
+            repository.checkout('master')
+            self.commit_file(repository)
+            repository.create_branch('other')
+            self.commit_file(repository)
+            revision_ids = [repository.find_revision_id(n) for n in ('master', 'dev', 'other')]
+            expected = dict((i, repository.count_revisions(i)) for i in revision_ids)
+            # A single revision is counted using `git rev-list --count'.
+            repository.iter_output = MagicMock(side_effect=Exception)
+            assert repository.count_revisions_in_bulk(revision_ids[:1]) == {revision_ids[0]: expected[revision_ids[0]]}
+            # Many revisions are counted using a single (streamed) history traversal.
+            repository = self.get_instance(bare=False, local=directory)
+            repository.count_revisions = MagicMock(side_effect=Exception)
+            assert repository.count_revisions_in_bulk(revision_ids) == expected
+
+    def test_list_files_undecodable(self):
+        """Make sure filenames that aren't valid UTF-8 can be listed."""
+        if sys.version_info[0] == 2:
+            return self.skipTest("filenames are byte strings on Python 2")
+        with TemporaryDirectory() as directory:
+            repository = self.get_instance(bare=False, local=directory)
+            repository.create()
+            with open(os.path.join(directory.encode('UTF-8'), b'caf\xe9.txt'), 'w') as handle:
+                handle.write("Latin-1 filename\n")
+            repository.add_files(all=True)
+            repository.commit(message="Add file with Latin-1 filename")
+            paths = [e.path for e in repository.list_files()]
+            assert [os.fsencode(p) for p in paths] == [b'caf\xe9.txt']
+
+    def test_commit_graph(self):
+        """Test counting revisions using git's commit-graph file."""
+        with TemporaryDirectory() as directory:
+            repository = self.get_instance(bare=False, local=directory)
+            self.create_initial_commit(repository)
+            repository.create_branch('dev')
+            self.commit_file(repository)
+            repository.checkout()
+            self.commit_file(repository)
+            repository.merge('dev')
+            repository.commit(message="Merged 'dev' branch")
+            revisions = ['master', 'dev', 'master~1', repository.find_revision_id('master')]
+            expected = [repository.count_revisions(r) for r in revisions]
+            # Write the commit-graph file and check that it's used.
+            repository.use_commit_graph = True
+            assert repository.commit_graph is None
+            repository.update_commit_graph()
+            graph = repository.commit_graph
+            assert graph.commit_count == 4
+            assert graph.count_ancestors(repository.find_revision_id('master')) == 4
+            assert [repository.count_revisions(r) for r in revisions] == expected
+            # Revisions that aren't in the commit-graph file are still counted.
+            self.commit_file(repository)
+            assert graph.count_ancestors(repository.find_revision_id('master')) is None
+            assert repository.count_revisions('master') == 5
+            # Make sure the commit-graph file is written by clones.
+            clone = self.get_instance(local=os.path.join(directory, 'clone'), remote=directory, use_commit_graph=True)
+            clone.create()
+            assert clone.commit_graph.count_ancestors(repository.find_revision_id('master')) == 5
+            # Make sure unsupported and corrupt commit-graph files are ignored.
+            filename = os.path.join(clone.local_git_directory, 'objects', 'info', 'commit-graph')
+            with open(filename, 'rb') as handle:
+                contents = handle.read()
+            for i, corrupted in enumerate((contents[:4] + b'\x02' + contents[5:], contents[:10], b'')):
+                os.unlink(filename)
+                with open(filename, 'wb') as handle:
+                    handle.write(corrupted)
+                # Make sure the commit-graph file is recognized as changed.
+                os.utime(filename, (i, i))
+                assert clone.commit_graph is None
+                assert clone.count_revisions('master') == 5
+
+    def test_native_refs(self):
+        """Test that reading refs directly from the git directory matches the output of git commands."""
+        with TemporaryDirectory() as directory:
+            repository = self.get_instance(bare=False, local=directory)
+            self.create_initial_commit(repository)
+            repository.create_tag('v1')
+            repository.create_branch('dev')
+            # Move some of the refs into the `packed-refs' file.
+            repository.context.execute('git', 'pack-refs', '--all')
+            self.create_followup_commit(repository)
+            repository.create_tag('v2')
+
+            def snapshot():
+                return (list(repository.find_branches_raw()),
+                        sorted((t.tag, t.revision_id) for t in repository.find_tags()),
+                        repository.current_branch)
+            assert repository.native_refs
+            assert repository.read_refs() is not None
+            native = snapshot()
+            repository.native_refs = False
+            assert native == snapshot()
+            assert native[2] == 'dev'
+            # Make sure unsupported ref storage formats fall back to git commands.
+            repository.native_refs = True
+            os.mkdir(os.path.join(directory, '.git', 'reftable'))
+            assert repository.read_refs() is None
+            assert snapshot() == native
+
 
 class HgTestCase(BackendTestCase, TestCase):
 
@@ -1075,3 +1985,67 @@ class HgTestCase(BackendTestCase, TestCase):
         with open(os.path.join(home, '.hgrc'), 'w') as handle:
             handle.write('[ui]\n')
             handle.write('username = %s <%s>\n' % (name, email))
+
+    def test_persistent_helpers(self):
+        """Test running queries using the Mercurial command server."""
+        with TemporaryDirectory() as directory:
+            repository = self.get_instance(bare=False, local=directory)
+            self.create_initial_commit(repository)
+            repository.create_tag('v1')
+            self.create_followup_commit(repository)
+            # Run some queries without helper processes.
+            expected = (
+                repository.find_revision_id('default'),
+                repository.find_revision_number('v1'),
+                repository.current_branch,
+                repository.is_clean,
+                sorted(repository.tags),
+            )
+            # Run the same queries using the command server.
+            repository.persistent_helpers = True
+            assert (
+                repository.find_revision_id('default'),
+                repository.find_revision_number('v1'),
+                repository.current_branch,
+                repository.is_clean,
+                sorted(repository.tags),
+            ) == expected
+            helper = repository.helpers['cmdserver']
+            assert helper.is_running
+            # Make sure new commits are visible to the running server.
+            revision_number = repository.find_revision_number('default')
+            self.commit_file(repository)
+            assert repository.find_revision_number('default') == revision_number + 1
+            # Make sure errors are still reported in the usual way.
+            self.assertRaises(ExternalCommandFailed, repository.find_revision_id, 'nonexisting')
+            # Make sure we fall back to subprocesses when the server fails.
+            repository.stop_helpers()
+            assert not helper.is_running
+            repository.helpers['cmdserver'] = CommandServer(context=repository.context, failed=True)
+            assert repository.find_revision_id('default') == repository.find_revision_id('tip')
+
+    def test_native_caches(self):
+        """Test that reading Mercurial's branch and tag caches matches the output of ``hg branches`` and ``hg tags``."""
+        with TemporaryDirectory() as directory:
+            repository = self.get_instance(bare=False, local=directory)
+            self.create_initial_commit(repository)
+            repository.create_tag('v1')
+            repository.create_branch('dev')
+            self.create_followup_commit(repository)
+
+            def snapshot():
+                return ([(r.branch, r.revision_id, r.revision_number) for r in repository.find_branches()],
+                        [(r.tag, r.revision_id, r.revision_number) for r in repository.find_tags()])
+            # Running `hg branches' and `hg tags' refreshes the caches.
+            expected = snapshot()
+            repository.native_caches = True
+            assert repository.read_branch_cache() is not None
+            assert repository.read_tag_cache() is not None
+            assert snapshot() == expected
+            # Make sure stale caches are ignored.
+            self.commit_file(repository)
+            assert repository.read_tag_cache() is None
+            repository.native_caches = False
+            expected = snapshot()
+            repository.native_caches = True
+            assert snapshot() == expected